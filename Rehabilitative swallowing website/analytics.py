@@ -0,0 +1,240 @@
+# per-session swallow metrics for trends across sessions: swallow count, peak envelope, duration, area under
+# the curve, rms and median frequency. computed from the saved raw/env arrays with numpy (no per-sample
+# python loops), cached in data/cache/metrics/<params hash>/<id>.json and recomputed when the session's
+# files change.  python analytics.py [ids...] prints the metrics of every (or the given) saved session
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+import storage
+from catalog import DEFAULT_FS
+from reprocess import params_key
+
+DATA_DIR = Path(__file__).parent / "data"
+BLOCK_ROWS = 1 << 16
+
+# offline version of detector.SwallowDetector's thresholds: baseline + k * noise, with the baseline and noise
+# taken over the whole session (median / median absolute deviation) instead of running averages
+PARAMS = {
+    "channel": 0,       # envelope channel swallows are detected on
+    "k_on": 3.0,
+    "k_off": 1.5,
+    "min_s": 0.15,
+    "max_s": 5.0,
+    "nperseg": 256,     # segment length for the session spectrum (median frequency)
+}
+EVENT_FIELDS = ("duration", "peak", "auc", "rms", "median_freq")
+
+
+def cache_path(data_dir, session_id, params):
+    return Path(data_dir) / "cache" / "metrics" / params_key(params) / f"{session_id}.json"
+
+
+def source_key(data_dir, session_id, fs):
+    # what the cached result was computed from; anything different means recompute
+    return [[p.stat().st_mtime_ns, p.stat().st_size] for p in storage.session_files(data_dir, session_id)] + [fs]
+
+
+def detect(env, fs, params):
+    # hysteresis on one envelope column, vectorized: runs above the `off` level that reach the `on` level
+    # and last at least min_s; runs longer than max_s are cut there (like the online detector).
+    # returns (onsets, ends (exclusive), baseline)
+    baseline = float(np.median(env))
+    noise = float(np.median(np.abs(env - baseline)))
+    on = baseline + params["k_on"] * noise
+    off = baseline + params["k_off"] * noise
+
+    edges = np.diff(np.concatenate([[0], (env > off).astype(np.int8), [0]]))
+    s = np.flatnonzero(edges == 1)
+    e = np.flatnonzero(edges == -1)
+    e = np.minimum(e, s + max(1, int(params["max_s"] * fs)))
+    keep = (e - s) >= max(1, int(params["min_s"] * fs))
+    s, e = s[keep], e[keep]
+    if len(s):
+        # max over each [s, e): reduceat over interleaved bounds, every other result
+        peaks = np.maximum.reduceat(np.append(env, -np.inf), np.ravel(np.column_stack([s, e])))[::2]
+        keep = peaks > on
+        s, e = s[keep], e[keep]
+    return s, e, baseline
+
+
+def median_freq(power, freqs):
+    # frequency where the cumulative power spectrum reaches half its total, along the last axis
+    cum = np.cumsum(power, axis=-1)
+    half = cum[..., -1:] / 2
+    idx = np.argmax(cum >= half, axis=-1)
+    out = freqs[idx]
+    return np.where(cum[..., -1] > 0, out, np.nan)
+
+
+def event_metrics(env, raw, s, e, baseline, fs):
+    # per-event features for all events at once. env/raw: the detection channel, (N,)
+    n_ev = len(s)
+    if not n_ev:
+        return {k: np.empty(0) for k in EVENT_FIELDS}, np.empty(0, dtype=np.int64)
+    lengths = e - s
+
+    # sums over [s, e) from cumulative sums
+    area = np.concatenate([[0.0], np.cumsum(env - baseline)])
+    sq = np.concatenate([[0.0], np.cumsum(np.square(raw))])
+    auc = (area[e] - area[s]) / fs
+    rms = np.sqrt((sq[e] - sq[s]) / lengths)
+
+    # peak and where it is: label every sample with its event, sort by (event, -value), first of each event
+    idx = np.concatenate([np.arange(a, b) for a, b in zip(s, e)])
+    label = np.repeat(np.arange(n_ev), lengths)
+    order = np.lexsort((-env[idx], label))
+    first = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    peak_sample = idx[order[first]]
+    peak = env[peak_sample]
+
+    # spectra of all events in one batch: (events, nfft) zero padded hann-windowed segments
+    nfft = 1 << int(np.ceil(np.log2(max(8, lengths.max()))))
+    batch = np.zeros((n_ev, nfft))
+    col = np.arange(len(idx)) - np.repeat(first, lengths)
+    win = np.concatenate([np.hanning(n) for n in lengths])
+    batch[label, col] = raw[idx] * win
+    power = np.abs(np.fft.rfft(batch, axis=1)) ** 2
+    mdf = median_freq(power, np.fft.rfftfreq(nfft, 1.0 / fs))
+
+    return {"duration": lengths / fs, "peak": peak, "auc": auc, "rms": rms, "median_freq": mdf}, peak_sample
+
+
+def session_spectrum(raw, fs, nperseg):
+    # welch-style average power spectrum per channel, accumulated block by block: (C, nperseg // 2 + 1)
+    n, c = raw.shape
+    nperseg = min(nperseg, n) or 1
+    win = np.hanning(nperseg)[None, :, None] if nperseg > 1 else np.ones((1, 1, 1))
+    total = np.zeros((nperseg // 2 + 1, c))
+    step = max(1, BLOCK_ROWS // nperseg) * nperseg
+    for i in range(0, n - nperseg + 1, step):
+        block = np.asarray(raw[i:i + step])
+        m = block.shape[0] // nperseg
+        segs = block[:m * nperseg].reshape(m, nperseg, c)
+        segs = segs - segs.mean(axis=1, keepdims=True)
+        total += (np.abs(np.fft.rfft(segs * win, axis=1)) ** 2).sum(axis=0)
+    return total.T, np.fft.rfftfreq(nperseg, 1.0 / fs)
+
+
+def _stats(x):
+    x = x[np.isfinite(x)]
+    if not len(x):
+        return None
+    return {"mean": float(x.mean()), "std": float(x.std()), "min": float(x.min()), "max": float(x.max())}
+
+
+def _floats(a):
+    return [None if not np.isfinite(v) else float(v) for v in a]
+
+
+def compute(data_dir, session_id, params=None, default_fs=DEFAULT_FS):
+    params = {**PARAMS, **(params or {})}
+    arrays = storage.open_session(data_dir, session_id)
+    if arrays is None:
+        return None
+    raw, env = arrays
+    fs = storage.read_meta(data_dir, session_id).get("fs", default_fs)
+    n, c = raw.shape
+    ch = params["channel"]
+    if not 0 <= ch < c:
+        raise ValueError(f"channel must be between 0 and {c - 1}")
+
+    # per channel, streamed in blocks
+    env_peak = np.full(c, -np.inf)
+    raw_sq = np.zeros(c)
+    for i in range(0, n, BLOCK_ROWS):
+        env_peak = np.maximum(env_peak, np.asarray(env[i:i + BLOCK_ROWS]).max(axis=0))
+        raw_sq += np.square(np.asarray(raw[i:i + BLOCK_ROWS])).sum(axis=0)
+    power, freqs = session_spectrum(raw, fs, params["nperseg"])
+
+    # swallows on the detection channel (one column, n floats)
+    e_col = np.asarray(env[:, ch], dtype=np.float64)
+    r_col = np.asarray(raw[:, ch], dtype=np.float64)
+    s, e, baseline = detect(e_col, fs, params)
+    ev, peak_sample = event_metrics(e_col, r_col, s, e, baseline, fs)
+
+    duration = n / fs
+    return {
+        "session_id": session_id,
+        "fs": fs,
+        "n_samples": n,
+        "duration": duration,
+        "params": params,
+        "swallow_count": len(s),
+        "swallows_per_min": len(s) / duration * 60 if duration else None,
+        "peak_envelope": float(ev["peak"].max()) if len(s) else None,
+        "total_auc": float(ev["auc"].sum()),
+        **{f"swallow_{k}": _stats(v) for k, v in ev.items()},
+        "channels": {
+            "env_peak": _floats(env_peak),
+            "raw_rms": _floats(np.sqrt(raw_sq / n)) if n else [None] * c,
+            "median_freq": _floats(median_freq(power, freqs)),
+        },
+        "events": [
+            {"onset": int(a), "offset": int(b) - 1, "peak_sample": int(p), **{k: float(ev[k][j]) for k in EVENT_FIELDS}}
+            for j, (a, b, p) in enumerate(zip(s, e, peak_sample))
+        ],
+    }
+
+
+def cached(data_dir, session_id, params=None, default_fs=DEFAULT_FS):
+    # cached metrics if they were computed from the files as they are now, else None
+    params = {**PARAMS, **(params or {})}
+    path = cache_path(data_dir, session_id, params)
+    if not path.exists() or storage.open_session(data_dir, session_id) is None:
+        return None
+    fs = storage.read_meta(data_dir, session_id).get("fs", default_fs)
+    try:
+        entry = json.loads(path.read_text(encoding="utf-8"))
+    except ValueError:
+        return None
+    return entry["metrics"] if entry.get("source") == source_key(data_dir, session_id, fs) else None
+
+
+def session_metrics(data_dir, session_id, params=None, default_fs=DEFAULT_FS):
+    # cached or freshly computed (and cached) metrics; None if there is no such session
+    params = {**PARAMS, **(params or {})}
+    hit = cached(data_dir, session_id, params, default_fs)
+    if hit is not None:
+        return hit
+    fs = storage.read_meta(data_dir, session_id).get("fs", default_fs)
+    source = source_key(data_dir, session_id, fs) if storage.open_session(data_dir, session_id) else None
+    out = compute(data_dir, session_id, params, default_fs)
+    if out is None:
+        return None
+    path = cache_path(data_dir, session_id, params)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".part")
+    tmp.write_text(json.dumps({"source": source, "metrics": out}), encoding="utf-8")
+    os.replace(tmp, path)
+    return out
+
+
+def summary(data_dir, session_ids, params=None, default_fs=DEFAULT_FS, workers=None):
+    # metrics of several sessions (without the event lists). cache hits are read here, the rest are
+    # computed in parallel, one process per session. missing sessions map to None
+    params = {**PARAMS, **(params or {})}
+    out = {sid: cached(data_dir, sid, params, default_fs) for sid in session_ids}
+    cold = [sid for sid, m in out.items() if m is None and storage.open_session(data_dir, sid) is not None]
+    if len(cold) == 1:
+        out[cold[0]] = session_metrics(data_dir, cold[0], params, default_fs)
+    elif cold:
+        workers = min(len(cold), workers or os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = pool.map(session_metrics, [data_dir] * len(cold), cold, [params] * len(cold),
+                               [default_fs] * len(cold))
+            out.update(zip(cold, results))
+    return {sid: ({k: v for k, v in m.items() if k != "events"} if m else None) for sid, m in out.items()}
+
+
+if __name__ == "__main__":
+    ids = sys.argv[1:] or storage.session_ids(DATA_DIR)
+    t0 = time.perf_counter()
+    result = summary(DATA_DIR, ids)
+    print(json.dumps(result, indent=2))
+    print(f"{len(ids)} sessions in {time.perf_counter() - t0:.2f} s", file=sys.stderr)
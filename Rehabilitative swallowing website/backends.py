@@ -0,0 +1,205 @@
+# board backends for the server. each one looks like the bit of BoardShim that Acquisition uses:
+#   fs, channels (rows of `data` holding EMG), get_board_data_count(), get_board_data(n), start(), stop(),
+#   package_channel / timestamp_channel (rows with package numbers / host timestamps, or None) and
+#   package_period (package numbers wrap after this many, see timing.py)
+# pick one with environment variables before starting uvicorn:
+#   EMG_BACKEND=ganglion   EMG_SERIAL_PORT=COM4 (BLED112 dongle)
+#   EMG_BACKEND=ganglion_ble  EMG_MAC_ADDRESS=... (native bluetooth, empty = first ganglion found)
+#   EMG_BACKEND=synthetic  brainflow's synthetic board, no hardware
+#   EMG_BACKEND=replay     EMG_REPLAY=<session id, .npy or .emgc path>  EMG_REPLAY_SPEED=1|10|100  EMG_REPLAY_LOOP=1
+# or several boards at once (devices.py), as id=spec pairs:
+#   EMG_DEVICES="left=ganglion:COM4,right=ganglion:COM5,sim=synthetic,old=replay:<session id>:10"
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+from brainflow.board_shim import BoardShim, BrainFlowInputParams, BoardIds
+
+DATA_DIR = Path(__file__).parent / "data"
+RING_BUFFER = 45000  # brainflow's internal buffer (# samples); 45000 ~ 3.75 min at 200 Hz
+# package numbers run 0..255 on most boards, the ganglion counts 0..200
+PACKAGE_PERIOD = {BoardIds.GANGLION_BOARD.value: 201, BoardIds.GANGLION_NATIVE_BOARD.value: 201}
+
+
+class BrainFlowBackend:
+    def __init__(self, board_id, serial_port="", mac_address="", other_info=""):
+        self.board_id = board_id
+        self.params = BrainFlowInputParams()
+        self.params.serial_port = serial_port
+        self.params.mac_address = mac_address
+        self.params.other_info = other_info  # brainflow won't open two sessions with identical params
+        self.board = None
+
+        self.fs = BoardShim.get_sampling_rate(board_id)
+        channels = BoardShim.get_emg_channels(board_id)
+        if not channels:  # if emg_channels is empty use exg channels
+            channels = BoardShim.get_exg_channels(board_id)
+        self.channels = channels
+        self.timestamp_channel = BoardShim.get_timestamp_channel(board_id)
+        self.package_channel = BoardShim.get_package_num_channel(board_id)
+        self.package_period = PACKAGE_PERIOD.get(board_id, 256)
+
+    def start(self):
+        if self.board is not None:
+            return  # already streaming
+        BoardShim.enable_dev_board_logger()
+        board = BoardShim(self.board_id, self.params)
+        board.prepare_session()
+        try:
+            board.start_stream(RING_BUFFER)
+        except Exception:
+            board.release_session()
+            raise
+        self.board = board
+
+    def stop(self):
+        if self.board is None:
+            return
+        board, self.board = self.board, None
+        try:
+            board.stop_stream()
+        finally:
+            board.release_session()
+
+    def get_board_data_count(self):
+        return self.board.get_board_data_count()
+
+    def get_board_data(self, n):
+        return self.board.get_board_data(n)
+
+
+def ganglion(serial_port="COM4", mac_address=""):
+    return BrainFlowBackend(BoardIds.GANGLION_BOARD.value, serial_port, mac_address)
+
+
+def ganglion_ble(mac_address=""):
+    return BrainFlowBackend(BoardIds.GANGLION_NATIVE_BOARD.value, mac_address=mac_address)
+
+
+def synthetic(other_info=""):
+    return BrainFlowBackend(BoardIds.SYNTHETIC_BOARD.value, other_info=other_info)
+
+
+class ReplayBackend:
+    # streams a saved data/board_<id>.npy / raw_<id>.npy (memory-mapped) or data/session_<id>.emgc in real time, or
+    # `speed` times faster. sessions with the unfiltered board samples replay those; older ones only have "raw", which
+    # is already filtered once, so those are for load/regression runs, not new recordings
+    def __init__(self, path, fs=200, speed=1.0, loop=True):
+        self.path = Path(path)
+        if self.path.suffix == ".emgc":
+            import chunked
+            s = chunked.open_session(self.path)
+            self.data = s.board if s.board is not None else s.raw   # (N, C), decoded a chunk at a time
+        else:
+            self.data = np.load(self.path, mmap_mode="r")   # (N, C)
+        self.fs = fs
+        self.speed = float(speed)
+        self.loop = loop
+        self.channels = list(range(self.data.shape[1]))  # get_board_data returns the EMG rows,
+        self.timestamp_channel = self.data.shape[1]        # then when each sample was "acquired"
+        self.package_channel = None
+        self.package_period = None
+        self.t0 = None
+        self.wall0 = None
+        self.read = 0  # samples handed out so far
+
+    def start(self):
+        if self.t0 is None:
+            self.t0 = time.perf_counter()
+            self.wall0 = time.time()
+            self.read = 0
+
+    def stop(self):
+        self.t0 = None
+
+    def _due(self):
+        # samples that should have been "acquired" by now
+        due = int((time.perf_counter() - self.t0) * self.fs * self.speed)
+        if not self.loop:
+            due = min(due, self.data.shape[0])
+        return due
+
+    def get_board_data_count(self):
+        if self.t0 is None:
+            return 0
+        return max(0, self._due() - self.read)
+
+    def get_board_data(self, n):
+        n = min(n, self.get_board_data_count())
+        total = self.data.shape[0]
+        k = self.read + np.arange(n)
+        idx = k % total  # wraps around when looping
+        self.read += n
+        stamps = self.wall0 + k / (self.fs * self.speed)
+        return np.vstack([np.asarray(self.data[idx]).T, stamps])  # (C + 1, n), like brainflow's (rows, samples)
+
+
+def replay(session, speed=1.0, loop=True, fs=None):
+    import storage
+    path = Path(session)
+    if not path.suffix:  # a session id, in whichever format it was saved
+        path = storage.chunked_path(DATA_DIR, session)
+        if not path.exists():
+            path = storage.board_path(DATA_DIR, session)
+        if not path.exists():
+            path = DATA_DIR / f"raw_{session}.npy"
+    if fs is None:
+        # the rate is in meta_<id>.json next to raw_<id>, board_<id> or session_<id>
+        prefix, _, sid = path.stem.partition("_")
+        if prefix not in ("raw", "board", "session") or not sid:
+            raise ValueError(f"{path.name}: can't tell the session from the file name, expected raw_<id>.npy, "
+                             f"board_<id>.npy or session_<id>.emgc")
+        fs = storage.read_meta(path.parent, sid).get("fs", 200)
+    return ReplayBackend(path, fs, speed, loop)
+
+
+def from_env(default="ganglion"):
+    kind = os.environ.get("EMG_BACKEND", default)
+    if kind == "ganglion":
+        return ganglion(os.environ.get("EMG_SERIAL_PORT", "COM4"), os.environ.get("EMG_MAC_ADDRESS", ""))
+    if kind == "ganglion_ble":
+        return ganglion_ble(os.environ.get("EMG_MAC_ADDRESS", ""))
+    if kind == "synthetic":
+        return synthetic()
+    if kind == "replay":
+        session = os.environ.get("EMG_REPLAY")
+        if not session:
+            raise ValueError("EMG_BACKEND=replay needs EMG_REPLAY=<session id or .npy path>")
+        return replay(session, float(os.environ.get("EMG_REPLAY_SPEED", "1")),
+                      os.environ.get("EMG_REPLAY_LOOP", "1") != "0")
+    raise ValueError(f"unknown EMG_BACKEND {kind!r} (ganglion, ganglion_ble, synthetic or replay)")
+
+
+def from_spec(spec, device_id=""):
+    # one EMG_DEVICES entry: ganglion:COM5, ganglion_ble[:mac], synthetic, replay:<session id>[:speed]
+    kind, _, arg = spec.strip().partition(":")
+    if kind == "ganglion":
+        return ganglion(arg or "COM4")
+    if kind == "ganglion_ble":
+        return ganglion_ble(arg)
+    if kind == "synthetic":
+        return synthetic(other_info=device_id)
+    if kind == "replay":
+        session, _, speed = arg.partition(":")
+        if not session:
+            raise ValueError("replay needs a session, e.g. replay:<session id>[:speed]")
+        return replay(session, float(speed or 1))
+    raise ValueError(f"unknown board {kind!r} in {spec!r} (ganglion, ganglion_ble, synthetic or replay)")
+
+
+def devices_from_env(default="ganglion"):
+    # {device id: backend}. without EMG_DEVICES it's the single board from from_env(), as device "default"
+    spec = os.environ.get("EMG_DEVICES", "").strip()
+    if not spec:
+        return {"default": from_env(default)}
+    boards = {}
+    for entry in spec.split(","):
+        device_id, sep, board_spec = entry.partition("=")
+        device_id = device_id.strip()
+        if not sep or not device_id:
+            raise ValueError(f"EMG_DEVICES entries look like id=board, got {entry!r}")
+        if device_id in boards:
+            raise ValueError(f"device {device_id!r} is listed twice in EMG_DEVICES")
+        boards[device_id] = from_spec(board_spec, device_id)
+    return boards
@@ -0,0 +1,108 @@
+# several boards in one server process: starts the app (uvicorn, in-process) with N devices, streams each one to
+# its own websocket client and checks that every device delivers every sample, at its board's rate, while the
+# others run. prints per-device rates/gaps and the process cpu per device.
+#   python bench_devices.py --devices 8 --seconds 20
+#   python bench_devices.py --devices 4 --board replay:<session id>:10
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+
+import uvicorn
+import websockets
+
+HOST = "127.0.0.1"
+
+
+async def client(port, device_id, deadline, result):
+    n_samples, gaps, dups, rows_recorded = 0, 0, 0, None
+    expected = None
+    async with websockets.connect(f"ws://{HOST}:{port}/devices/{device_id}/ws?format=binary", max_size=None) as ws:
+        meta = json.loads(await ws.recv())
+        while time.perf_counter() < deadline:
+            try:
+                msg = await asyncio.wait_for(ws.recv(), timeout=max(0.01, deadline - time.perf_counter()))
+            except asyncio.TimeoutError:
+                break
+            if not isinstance(msg, bytes):
+                continue
+            _, _, _, seq, rows, start, n, _, _, _ = frames.HEADER.unpack_from(msg, 0)
+            await ws.send(json.dumps({"type": "ack", "seq": seq}))
+            if expected is not None:
+                if start > expected:
+                    gaps += start - expected
+                elif start < expected:
+                    dups += expected - start
+            expected = start + n
+            n_samples += n
+        rec = server.app.state.pending.get(meta["session_id"])
+        rows_recorded = rec.n_samples if rec is not None else None
+    await asyncio.to_thread(urllib.request.urlopen,
+                            urllib.request.Request(f"http://{HOST}:{port}/discard/{meta['session_id']}", method="POST"))
+    result[device_id] = {"fs": meta["fs"], "samples": n_samples, "missing": gaps, "duplicated": dups,
+                         "recorded": rows_recorded}
+
+
+async def main_async(args):
+    # bench sessions and their catalog go to a temp dir, not data/. importing server made an empty
+    # data/sessions.db if there was none, remove it again so the real server still builds it from data/
+    tmp = Path(tempfile.mkdtemp(prefix="bench_data_"))
+    if server.catalog_is_new:
+        server.CATALOG_PATH.unlink(missing_ok=True)
+    server.DATA_DIR = tmp
+    server.CATALOG_PATH = tmp / "sessions.db"
+    server.catalog = Catalog(server.CATALOG_PATH)
+
+    config = uvicorn.Config(server.app, host=HOST, port=args.port, log_level="warning")
+    srv = uvicorn.Server(config)
+    serve = asyncio.create_task(srv.serve())
+    result = {}
+    try:
+        while not srv.started or not server.devices.status()["ready"]:
+            await asyncio.sleep(0.05)
+        cpu0, t0 = time.process_time(), time.perf_counter()
+        deadline = t0 + args.seconds
+        await asyncio.gather(*(client(args.port, d.id, deadline, result) for d in server.devices))
+        elapsed = time.perf_counter() - t0
+        cpu = time.process_time() - cpu0
+    finally:
+        srv.should_exit = True
+        await serve
+        shutil.rmtree(tmp, ignore_errors=True)
+    return result, elapsed, cpu
+
+
+def main():
+    ap = argparse.ArgumentParser(description="several boards served by one process")
+    ap.add_argument("--devices", type=int, default=4)
+    ap.add_argument("--board", default="synthetic", help="board spec for every device (backends.from_spec)")
+    ap.add_argument("--seconds", type=float, default=10.0)
+    ap.add_argument("--port", type=int, default=8765)
+    args = ap.parse_args()
+
+    os.environ["EMG_DEVICES"] = ",".join(f"b{i}={args.board}" for i in range(args.devices))
+    global server, frames, Catalog
+    sys.path.insert(0, str(Path(__file__).parent))
+    import server
+    import frames
+    from catalog import Catalog
+
+    result, elapsed, cpu = asyncio.run(main_async(args))
+    ok = True
+    for device_id, r in sorted(result.items()):
+        rate = r["samples"] / elapsed
+        ok &= r["missing"] == 0 and r["duplicated"] == 0
+        print(f"{device_id}: {r['samples']} samples ({rate:.0f}/s, board {r['fs']} Hz), missing {r['missing']}, "
+              f"duplicated {r['duplicated']}, recorded {r['recorded']}")
+    print(f"{len(result)} devices, {elapsed:.1f} s: process cpu {cpu / elapsed * 100:.1f}% "
+          f"({cpu / elapsed * 100 / max(1, len(result)):.2f}% per device)" + ("" if ok else "  <- samples missed"))
+
+
+if __name__ == "__main__":
+    main()
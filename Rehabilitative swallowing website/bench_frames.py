@@ -0,0 +1,39 @@
+# serialize cost and bandwidth of the json vs binary websocket frames (frames.py)
+# run: python bench_frames.py
+import time
+
+import numpy as np
+
+import frames
+
+FS = 200               # Ganglion sampling rate
+CHUNK_SAMPLES = 20
+REPEAT = 2000
+
+
+def bench(fmt, n_channels, chunk):
+    rng = np.random.default_rng(0)
+    raw = rng.normal(0, 100, (chunk, n_channels))
+    env = np.abs(raw)
+
+    t0 = time.perf_counter()
+    for seq in range(REPEAT):
+        msg = frames.encode(fmt, seq, seq * chunk, raw, env)
+    dt = (time.perf_counter() - t0) / REPEAT
+
+    size = len(msg) if isinstance(msg, bytes) else len(msg.encode("utf-8"))
+    msgs_per_s = FS / chunk
+    return dt * 1e6, size, size * msgs_per_s
+
+
+def main():
+    print(f"fs={FS} Hz, {CHUNK_SAMPLES} samples/msg ({FS / CHUNK_SAMPLES:.0f} msgs/s)")
+    print(f"{'channels':>8} {'format':>7} {'encode us':>10} {'bytes/msg':>10} {'bytes/s':>10}")
+    for n_channels in (1, 4, 8, 16, 32):
+        for fmt in frames.FORMATS:
+            us, size, bps = bench(fmt, n_channels, CHUNK_SAMPLES)
+            print(f"{n_channels:>8} {fmt:>7} {us:>10.1f} {size:>10} {bps:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+# end-to-end benchmark of the streaming server, on the brainflow synthetic board by default.
+# starts the server app in-process (uvicorn), connects N websocket clients and sweeps
+# CHUNK_SAMPLES x SEND_INTERVAL_MS x channel count x client count. results go to a json file so runs
+# can be compared between commits.
+#   python bench_server.py                       # default sweep, 10 s per run
+#   python bench_server.py --chunk 10 20 --interval 20 50 --channels 4 16 --clients 1 8 32 --seconds 30
+#   EMG_BACKEND=replay EMG_REPLAY=<session id> EMG_REPLAY_SPEED=10 python bench_server.py   # recorded data
+#   python bench_server.py --feedback            # with biofeedback on: its latency under the same load (feedback.py)
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import uvicorn
+import websockets
+
+sys.path.insert(0, str(Path(__file__).parent))
+os.environ.setdefault("EMG_BACKEND", "synthetic")
+import server  # noqa: E402
+import frames  # noqa: E402
+import stream  # noqa: E402
+from catalog import Catalog  # noqa: E402
+
+HOST = "127.0.0.1"
+DEVICE = server.devices.default  # the bench drives the first (usually only) board
+ALL_CHANNELS = list(DEVICE.channels)
+# stand-in calibration for --feedback, effort 1 at 100 uV of envelope
+BENCH_CALIBRATION = {"patient": "bench", "channel": 0, "fs": DEVICE.fs, "rest": 0.0, "max": 100.0}
+
+
+def rss_mb():
+    # current resident memory (linux), falls back to peak rss elsewhere
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2**20 if sys.platform == "darwin" else peak / 1024
+
+
+class StageTimer:
+    # wraps callables and adds up wall and cpu (thread) time per stage
+    def __init__(self):
+        self.stats = defaultdict(lambda: {"calls": 0, "wall_s": 0.0, "cpu_s": 0.0})
+
+    def wrap(self, name, fn):
+        def timed(*args, **kwargs):
+            w0, c0 = time.perf_counter(), time.thread_time()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                st = self.stats[name]
+                st["calls"] += 1
+                st["wall_s"] += time.perf_counter() - w0
+                st["cpu_s"] += time.thread_time() - c0
+        return timed
+
+    def report(self):
+        out = {}
+        for name, st in self.stats.items():
+            n = max(1, st["calls"])
+            out[name] = {"calls": st["calls"], "cpu_ms_total": st["cpu_s"] * 1e3,
+                         "cpu_us_per_call": st["cpu_s"] / n * 1e6, "wall_us_per_call": st["wall_s"] / n * 1e6}
+        return out
+
+
+class TimedBoard:
+    # the two board calls Acquisition makes, timed, remembering brainflow's timestamp of the newest sample
+    # (boards without timestamps: latency is measured from the read instead)
+    def __init__(self, board, timer):
+        self.board = board
+        self.ts_row = board.timestamp_channel
+        self.timestamp_channel = board.timestamp_channel  # for the gap tracking (timing.py)
+        self.package_channel = board.package_channel
+        self.package_period = board.package_period
+        self.last_ts = None
+        self.get_board_data = timer.wrap("board_read", self._get_board_data)
+
+    def start(self):
+        self.board.start()  # no-op, the server's acquisition already opened it
+
+    def stop(self):
+        self.board.stop()
+
+    def get_board_data_count(self):
+        return self.board.get_board_data_count()
+
+    def _get_board_data(self, n):
+        data = self.board.get_board_data(n)
+        self.last_ts = float(data[self.ts_row, -1]) if self.ts_row is not None else time.time()
+        return data
+
+
+def make_acquisition(chunk, interval, n_channels, timer, stamps):
+    # fresh Acquisition for one run, with every stage wrapped by the timer
+    board = TimedBoard(DEVICE.board, timer)
+    acq = stream.Acquisition(board, DEVICE.fs, ALL_CHANNELS[:n_channels], chunk, interval, name=DEVICE.id)
+    acq.filt.process = timer.wrap("filter", acq.filt.process)
+    acq.detector.process = timer.wrap("detect", acq.detector.process)
+
+    read = acq._read
+    def _read():
+        out = read()
+        if out is not None:
+            stamps[out[0]] = board.last_ts
+        return out
+    acq._read = _read
+    acq._publish = timer.wrap("publish", acq._publish)
+    return acq
+
+
+async def client(port, fmt, deadline, stamps, result, subscribe=None):
+    lat, board_lat, n_msgs, n_samples, gaps, dups, reduced, n_bytes, n_feedback = [], [], 0, 0, 0, 0, 0, 0, 0
+    expected = None
+    async with websockets.connect(f"ws://{HOST}:{port}/ws?format={fmt}", max_size=None) as ws:
+        meta = json.loads(await ws.recv())
+        if subscribe:
+            await ws.send(json.dumps({"type": "subscribe", **subscribe}))
+        while time.perf_counter() < deadline:
+            try:
+                msg = await asyncio.wait_for(ws.recv(), timeout=max(0.01, deadline - time.perf_counter()))
+            except asyncio.TimeoutError:
+                break
+            now = time.time()
+            n_bytes += len(msg)
+            if isinstance(msg, bytes):
+                _, _, _, _, rows, start, n, _, _, t_last = frames.HEADER.unpack_from(msg, 0)
+            else:
+                m = json.loads(msg)
+                if m.get("type") == "feedback":
+                    # echoed like index.html does once it's drawn
+                    n_feedback += 1
+                    await ws.send(json.dumps({"type": "feedback_ack", "t": m["t"]}))
+                    continue
+                if m.get("type") != "data":
+                    continue
+                start, rows = m["start"], len(m.get("raw") or m["env"])
+                n = m.get("span", rows)
+                t_last = m.get("t1", float("nan"))
+            if t_last == t_last:  # board timestamp of the newest sample in the frame (not nan)
+                board_lat.append((now - t_last) * 1e3)
+            n_msgs += 1
+            reduced += n != rows  # min/max decimated because we fell behind
+            n_samples += n
+            if expected is not None:
+                if start > expected:
+                    gaps += start - expected
+                elif start < expected:
+                    dups += expected - start
+            expected = start + n
+            if start in stamps:
+                lat.append((now - stamps[start]) * 1e3)
+    # don't leave bench sessions in pending/
+    await asyncio.to_thread(urllib.request.urlopen,
+                            urllib.request.Request(f"http://{HOST}:{port}/discard/{meta['session_id']}", method="POST"))
+    result.append({"latency_ms": lat, "board_latency_ms": board_lat, "msgs": n_msgs, "samples": n_samples, "missing": gaps, "duplicated": dups, "bytes": n_bytes,
+                   "decimated_msgs": reduced, "feedback_msgs": n_feedback})
+
+
+async def run_one(port, cfg, seconds, fmt, subscribe=None, with_feedback=False):
+    timer = StageTimer()
+    stamps = {}
+    await DEVICE.acq.stop()
+    DEVICE.acq = make_acquisition(cfg["chunk_samples"], cfg["interval_ms"], cfg["channels"], timer, stamps)
+    DEVICE.channels = ALL_CHANNELS[:cfg["channels"]]  # recorders size their files from this
+    if with_feedback:
+        DEVICE.acq.set_feedback(BENCH_CALIBRATION)
+    DEVICE.acq.start()
+
+    # encode is a module function, patch it for the duration of the run
+    encode = frames.encode
+    frames.encode = timer.wrap("encode", encode)
+
+    rss = [(0.0, rss_mb())]
+    results = []
+    t0 = time.perf_counter()
+    deadline = t0 + seconds
+    tasks = [asyncio.create_task(client(port, fmt, deadline, stamps, results, subscribe)) for _ in range(cfg["clients"])]
+    while time.perf_counter() < deadline:
+        await asyncio.sleep(min(1.0, max(0.0, deadline - time.perf_counter())))
+        rss.append((time.perf_counter() - t0, rss_mb()))
+    await asyncio.gather(*tasks)
+    frames.encode = encode
+
+    lat = np.concatenate([np.asarray(r["latency_ms"]) for r in results]) if results else np.array([])
+    board_lat = np.concatenate([np.asarray(r["board_latency_ms"]) for r in results]) if results else np.array([])
+    elapsed = time.perf_counter() - t0
+    t, mb = np.array(rss).T
+    growth = float(np.polyfit(t, mb, 1)[0] * 60) if len(t) > 2 else 0.0
+    return {
+        "config": cfg,
+        "latency_ms": {p: float(np.percentile(lat, q)) if lat.size else None
+                       for p, q in (("p50", 50), ("p90", 90), ("p99", 99), ("max", 100))},
+        # from the board's own timestamp of the newest sample in each frame (includes brainflow's buffering)
+        "board_latency_ms": {p: float(np.percentile(board_lat, q)) if board_lat.size else None
+                             for p, q in (("p50", 50), ("p90", 90), ("p99", 99), ("max", 100))},
+        "board_lost_samples": DEVICE.acq.gaps.missing,
+        "msgs_per_s": sum(r["msgs"] for r in results) / elapsed,
+        "samples_per_s": sum(r["samples"] for r in results) / elapsed,
+        "bytes_per_s": sum(r["bytes"] for r in results) / elapsed,
+        "samples_per_s_per_client": float(np.mean([r["samples"] for r in results])) / elapsed if results else 0.0,
+        "missing_samples": sum(r["missing"] for r in results),
+        "duplicated_samples": sum(r["duplicated"] for r in results),
+        "decimated_msgs": sum(r["decimated_msgs"] for r in results),
+        "feedback_msgs_per_s": sum(r["feedback_msgs"] for r in results) / elapsed,
+        "feedback_latency": DEVICE.acq.latency.summary() if with_feedback else None,
+        "stages": timer.report(),
+        "memory": {"rss_start_mb": float(mb[0]), "rss_end_mb": float(mb[-1]), "growth_mb_per_min": growth},
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=Path(__file__).parent,
+                                       text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def main_async(args):
+    # bench sessions and their catalog go to a temp dir, not data/. importing server made an empty
+    # data/sessions.db if there was none, remove it again so the real server still builds it from data/
+    tmp = Path(tempfile.mkdtemp(prefix="bench_data_"))
+    if server.catalog_is_new:
+        server.CATALOG_PATH.unlink(missing_ok=True)
+    server.DATA_DIR = tmp
+    server.CATALOG_PATH = tmp / "sessions.db"
+    server.catalog = Catalog(server.CATALOG_PATH)
+
+    config = uvicorn.Config(server.app, host=HOST, port=args.port, log_level="warning")
+    srv = uvicorn.Server(config)
+    serve = asyncio.create_task(srv.serve())
+    runs = []
+    grid = [{"chunk_samples": c, "interval_ms": i, "channels": min(ch, len(ALL_CHANNELS)), "clients": n}
+            for c in args.chunk for i in args.interval for ch in args.channels for n in args.clients]
+    try:
+        while not srv.started or DEVICE.acq.state != "streaming":
+            await asyncio.sleep(0.05)
+        for k, cfg in enumerate(grid, 1):
+            res = await run_one(args.port, cfg, args.seconds, args.format, args.subscribe, args.feedback)
+            runs.append(res)
+            lat = res["latency_ms"]
+            p50 = f"{lat['p50']:.1f}" if lat["p50"] is not None else "-"
+            p99 = f"{lat['p99']:.1f}" if lat["p99"] is not None else "-"
+            fb = res["feedback_latency"]
+            fb = f", feedback p95 {fb['shown']['p95_ms']:.1f} ms ({fb['shown']['late']} late, " \
+                 f"{res['feedback_msgs_per_s']:.0f} msgs/s)" if fb is not None and fb["shown"]["n"] else ""
+            print(f"[{k}/{len(grid)}] {cfg}: p50 {p50} ms, p99 {p99} ms, "
+                  f"{res['msgs_per_s']:.0f} msgs/s, {res['samples_per_s']:.0f} samples/s, {res['bytes_per_s'] / 1e3:.0f} kB/s, "
+                  f"missing {res['missing_samples']}, lost at the board {res['board_lost_samples']}, rss +{res['memory']['growth_mb_per_min']:.2f} MB/min{fb}")
+    finally:
+        await DEVICE.acq.stop()
+        srv.should_exit = True
+        await serve
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    return {
+        "commit": git_commit(),
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "backend": os.environ["EMG_BACKEND"],
+        "fs": server.fs,
+        "format": args.format,
+        "subscribe": args.subscribe,
+        "feedback": args.feedback,
+        "seconds_per_run": args.seconds,
+        "runs": runs,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="latency/throughput benchmark of the streaming server")
+    ap.add_argument("--chunk", nargs="+", type=int, default=[20], help="CHUNK_SAMPLES values")
+    ap.add_argument("--interval", nargs="+", type=int, default=[20, 50], help="SEND_INTERVAL_MS values")
+    ap.add_argument("--channels", nargs="+", type=int, default=[4, 16])
+    ap.add_argument("--clients", nargs="+", type=int, default=[1, 8])
+    ap.add_argument("--seconds", type=float, default=10.0, help="duration of each run")
+    ap.add_argument("--format", choices=frames.FORMATS, default="binary")
+    ap.add_argument("--subscribe", type=json.loads, default=None,
+                    help='subscribe message fields for every client, e.g. \'{"channels": [0], "streams": ["env"]}\'')
+    ap.add_argument("--feedback", action="store_true", help="switch biofeedback on and measure its latency too")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--out", type=Path, default=None, help="json output (default bench_results/<time>_<commit>.json)")
+    args = ap.parse_args()
+
+    report = asyncio.run(main_async(args))
+
+    out = args.out
+    if out is None:
+        out_dir = Path(__file__).parent / "bench_results"
+        out_dir.mkdir(exist_ok=True)
+        out = out_dir / f"{datetime.now():%Y%m%d_%H%M%S}_{report['commit'] or 'nogit'}.json"
+    out.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"wrote {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+# sqlite index of saved sessions (data/sessions.db), so /sessions doesn't glob + parse every meta file.
+# kept up to date by /save, /discard and /meta. rebuild from what's on disk: python catalog.py
+import sqlite3
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+import storage
+
+DEFAULT_FS = 200   # Ganglion; used for old sessions whose meta has no fs
+BLOCK_ROWS = 1 << 16
+
+COLUMNS = ("id", "label", "notes", "saved_at", "duration", "n_samples", "n_channels", "fs",
+           "env_mean", "env_max", "raw_rms")
+SORTABLE = ("id", "label", "saved_at", "duration", "n_samples", "env_mean", "env_max", "raw_rms")
+EVENT_COLUMNS = ("onset", "offset", "peak", "peak_sample", "duration", "area")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,     -- recording start time, so sorting by id is chronological
+    label TEXT NOT NULL DEFAULT '',
+    notes TEXT NOT NULL DEFAULT '',
+    saved_at TEXT,
+    duration REAL,           -- seconds
+    n_samples INTEGER,
+    n_channels INTEGER,
+    fs REAL,
+    env_mean REAL,
+    env_max REAL,
+    raw_rms REAL
+);
+CREATE INDEX IF NOT EXISTS sessions_label ON sessions(label);
+CREATE INDEX IF NOT EXISTS sessions_saved_at ON sessions(saved_at);
+CREATE INDEX IF NOT EXISTS sessions_duration ON sessions(duration);
+
+CREATE TABLE IF NOT EXISTS events (   -- detected swallows, sample indices relative to the session start
+    session_id TEXT NOT NULL,
+    onset INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    peak REAL,
+    peak_sample INTEGER,
+    duration REAL,          -- seconds
+    area REAL
+);
+CREATE INDEX IF NOT EXISTS events_session ON events(session_id, onset);
+"""
+
+
+def summarize(data_dir, session_id, default_fs=DEFAULT_FS):
+    # catalog row for a saved session: meta fields + size + summary stats (streamed in blocks)
+    arrays = storage.open_session(data_dir, session_id)
+    if arrays is None:
+        return None
+    raw, env = arrays
+    meta = storage.read_meta(data_dir, session_id)
+    n, c = raw.shape
+    fs = meta.get("fs", default_fs)
+
+    env_sum, env_max, raw_sq = 0.0, None, 0.0
+    for i in range(0, n, BLOCK_ROWS):
+        e = np.asarray(env[i:i + BLOCK_ROWS])
+        r = np.asarray(raw[i:i + BLOCK_ROWS])
+        env_sum += float(e.sum())
+        m = float(e.max())
+        env_max = m if env_max is None else max(env_max, m)
+        raw_sq += float(np.square(r).sum())
+    count = n * c
+
+    return {
+        "id": session_id,
+        "label": meta.get("label", ""),
+        "notes": meta.get("notes", ""),
+        "saved_at": meta.get("saved_at"),
+        "duration": n / fs if fs else None,
+        "n_samples": n,
+        "n_channels": c,
+        "fs": fs,
+        "env_mean": env_sum / count if count else None,
+        "env_max": env_max,
+        "raw_rms": float(np.sqrt(raw_sq / count)) if count else None,
+    }
+
+
+class Catalog:
+    def __init__(self, path):
+        self.path = Path(path)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        # one short-lived connection per call, endpoints run on different threads
+        conn = sqlite3.connect(self.path)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:  # commit on success, rollback on error
+                yield conn
+        finally:
+            conn.close()
+
+    def upsert(self, row):
+        cols = [c for c in COLUMNS if c in row]
+        sql = (f"INSERT INTO sessions ({', '.join(cols)}) VALUES ({', '.join('?' for _ in cols)}) "
+               f"ON CONFLICT(id) DO UPDATE SET {', '.join(f'{c}=excluded.{c}' for c in cols if c != 'id')}")
+        with self._connect() as conn:
+            conn.execute(sql, [row[c] for c in cols])
+
+    def update_meta(self, session_id, meta):
+        # only touches sessions that are already in the catalog (i.e. saved)
+        fields = {k: meta[k] for k in ("label", "notes", "saved_at") if k in meta}
+        if not fields:
+            return
+        with self._connect() as conn:
+            conn.execute(f"UPDATE sessions SET {', '.join(f'{k}=?' for k in fields)} WHERE id=?",
+                         [*fields.values(), session_id])
+
+    def add(self, data_dir, session_id, default_fs=DEFAULT_FS):
+        row = summarize(data_dir, session_id, default_fs)
+        if row is not None:
+            self.upsert(row)
+        return row
+
+    def remove(self, session_id):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM sessions WHERE id=?", (session_id,))
+            conn.execute("DELETE FROM events WHERE session_id=?", (session_id,))
+
+    def set_events(self, session_id, events):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM events WHERE session_id=?", (session_id,))
+            self._insert_events(conn, session_id, events)
+
+    def _insert_events(self, conn, session_id, events):
+        conn.executemany(f"INSERT INTO events (session_id, {', '.join(EVENT_COLUMNS)}) "
+                         f"VALUES (?, {', '.join('?' for _ in EVENT_COLUMNS)})",
+                         [[session_id, *(ev.get(c) for c in EVENT_COLUMNS)] for ev in events])
+
+    def events(self, session_id, start=None, end=None):
+        # events overlapping [start, end) samples (whole session by default)
+        where, args = "session_id=?", [session_id]
+        if start is not None:
+            where += " AND offset >= ?"
+            args.append(int(start))
+        if end is not None:
+            where += " AND onset < ?"
+            args.append(int(end))
+        with self._connect() as conn:
+            rows = conn.execute(f"SELECT {', '.join(EVENT_COLUMNS)} FROM events WHERE {where} ORDER BY onset", args).fetchall()
+        return [dict(r) for r in rows]
+
+    def query(self, q="", sort="id", order="desc", limit=100, offset=0):
+        # text search on label/notes + sort + pagination; returns (total matches, rows)
+        if sort not in SORTABLE:
+            raise ValueError(f"sort must be one of {', '.join(SORTABLE)}")
+        order = "ASC" if str(order).lower() == "asc" else "DESC"
+        where, args = "", []
+        if q:
+            where = "WHERE label LIKE ? ESCAPE '\\' OR notes LIKE ? ESCAPE '\\'"
+            pat = "%" + q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            args = [pat, pat]
+        with self._connect() as conn:
+            total = conn.execute(f"SELECT COUNT(*) FROM sessions {where}", args).fetchone()[0]
+            rows = conn.execute(f"SELECT {', '.join(COLUMNS)} FROM sessions {where} ORDER BY {sort} {order}, id {order} "
+                                f"LIMIT ? OFFSET ?", [*args, int(limit), int(offset)]).fetchall()
+        return total, [dict(r) for r in rows]
+
+    def rebuild(self, data_dir, default_fs=DEFAULT_FS):
+        ids = storage.session_ids(data_dir)
+        rows = [summarize(data_dir, sid, default_fs) for sid in ids]
+        rows = [r for r in rows if r is not None]
+        with self._connect() as conn:
+            conn.execute("DELETE FROM sessions")
+            conn.execute("DELETE FROM events")
+            conn.executemany(f"INSERT INTO sessions ({', '.join(COLUMNS)}) VALUES ({', '.join('?' for _ in COLUMNS)})",
+                             [[r[c] for c in COLUMNS] for r in rows])
+            for r in rows:
+                self._insert_events(conn, r["id"], storage.read_events(data_dir, r["id"]))
+        return len(rows)
+
+
+if __name__ == "__main__":
+    data_dir = Path(__file__).parent / "data"
+    n = Catalog(data_dir / "sessions.db").rebuild(data_dir)
+    print(f"catalog rebuilt: {n} sessions")
@@ -0,0 +1,283 @@
+# compressed, chunked session files (data/session_<id>.emgc), several times smaller than the raw_/env_ .npy pair.
+# rows are cut into chunks of CHUNK_ROWS that are compressed on their own, with an index of where each chunk is,
+# so reading a window only decodes the chunks it touches. the envelope doesn't have to be stored: it's the
+# moving average of |raw| (dsp.py), and is recomputed on read when it isn't there. a recording joins the stream
+# partway, so its first envelope rows also average samples from before it: those (the env_lead, win - 1 rectified
+# samples) go in the footer.
+#
+# layout:
+#   b"EMGC" u8 version, 3 bytes padding
+#   chunk blobs
+#   footer: json (sizes, fs, codec, per stream {"scale", "offset", "chunks": [[offset, nbytes, encoding], ...]})
+#   u64 footer length, b"EMGC"
+# chunk encodings, before compression:
+#   "q32d"  values / scale rounded to int32, delta along time per channel, zigzag, byte-shuffled.
+#           scale 0.001 uV is well below what the ganglion resolves, the error is at most scale / 2
+#   "f32"   float32, byte-shuffled (used when a chunk doesn't fit int32 at the given scale)
+# streams are "raw", "env" (optional), "board" (optional, the unfiltered board samples) and "time" (optional, board
+# timestamps, stored relative to the first one in steps of TIME_SCALE). compression is zlib, or zstd when the zstandard package is installed (pip install zstandard), faster at
+# the same ratio. the codec is recorded in the footer
+import json
+import os
+import struct
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+import dsp
+
+try:
+    import zstandard
+except ImportError:  # zlib is always there
+    zstandard = None
+
+MAGIC = b"EMGC"
+VERSION = 1
+TAIL = struct.Struct("<Q4s")
+CHUNK_ROWS = 1 << 13   # ~41 s at 200 Hz
+RAW_SCALE = 0.001      # uV per integer step
+TIME_SCALE = 1e-5      # s per integer step for timestamps (int32 covers ~6 h of session, f32 chunks after that)
+CACHE_CHUNKS = 8       # decoded chunks kept per stream, for sequential reads in small steps
+ZLIB_LEVEL = 1
+INT32 = np.iinfo(np.int32)
+
+
+def _compress(codec, buf):
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=3).compress(buf)
+    return zlib.compress(buf, ZLIB_LEVEL)
+
+
+def _decompress(codec, buf):
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("this session was written with zstd, pip install zstandard to read it")
+        return zstandard.ZstdDecompressor().decompress(buf)
+    return zlib.decompress(buf)
+
+
+def _shuffle(a):
+    # group the bytes by significance (all low bytes, then the next...), compresses much better
+    b = np.ascontiguousarray(a).view(np.uint8).reshape(-1, a.dtype.itemsize)
+    return np.ascontiguousarray(b.T).tobytes()
+
+
+def _unshuffle(buf, dtype, shape):
+    b = np.frombuffer(buf, dtype=np.uint8).reshape(dtype.itemsize, -1)
+    return np.ascontiguousarray(b.T).view(dtype).reshape(shape)
+
+
+def encode_chunk(block, scale, codec):
+    block = np.asarray(block, dtype=np.float64)
+    q = np.round(block / scale)
+    if np.isfinite(q).all() and q.size and INT32.min < q.min() and q.max() < INT32.max:
+        d = np.diff(q.astype(np.int64), axis=0, prepend=0)
+        if INT32.min < d.min() and d.max() < INT32.max:
+            z = ((d << 1) ^ (d >> 63)).astype("<u4")  # zigzag: small +/- deltas -> small unsigned ints
+            return _compress(codec, _shuffle(z)), "q32d"
+    return _compress(codec, _shuffle(block.astype("<f4"))), "f32"
+
+
+def decode_chunk(buf, encoding, rows, n_channels, scale, codec):
+    raw = _decompress(codec, buf)
+    if encoding == "q32d":
+        z = _unshuffle(raw, np.dtype("<u4"), (rows, n_channels)).astype(np.int64)
+        d = (z >> 1) ^ -(z & 1)
+        return np.cumsum(d, axis=0) * scale
+    if encoding == "f32":
+        return _unshuffle(raw, np.dtype("<f4"), (rows, n_channels)).astype(np.float64)
+    raise ValueError(f"unknown chunk encoding {encoding!r}")
+
+
+def write(path, raw, env=None, fs=None, chunk_rows=CHUNK_ROWS, scale=RAW_SCALE, codec=None, times=None, board=None,
+          env_lead=None):
+    # raw/env/board: (N, C) arrays (memmaps are fine, they're read a chunk at a time). env=None: computed on read,
+    # starting from env_lead ((win - 1, C) rectified samples before the first row, None = zeros).
+    # times: (N, 1) timestamps or None
+    # written to <path>.part and renamed, so a half-written file never has the real name
+    codec = codec or ("zstd" if zstandard is not None else "zlib")
+    path = Path(path)
+    tmp = path.with_name(path.name + ".part")
+    n, c = raw.shape
+    streams = {"raw": raw} if env is None else {"raw": raw, "env": env}
+    if board is not None:
+        streams["board"] = board
+    index = {name: {"scale": scale, "offset": 0.0, "chunks": []} for name in streams}
+    if times is not None:
+        finite = np.asarray(times[:chunk_rows]).ravel()
+        finite = finite[np.isfinite(finite)]
+        streams["time"] = times
+        index["time"] = {"scale": TIME_SCALE, "offset": float(finite[0]) if len(finite) else 0.0, "chunks": []}
+    with open(tmp, "wb") as f:
+        f.write(MAGIC + bytes([VERSION, 0, 0, 0]))
+        for i in range(0, n, chunk_rows):
+            for name, a in streams.items():
+                info = index[name]
+                blob, encoding = encode_chunk(np.asarray(a[i:i + chunk_rows]) - info["offset"], info["scale"], codec)
+                index[name]["chunks"].append([f.tell(), len(blob), encoding])
+                f.write(blob)
+        footer = json.dumps({"version": VERSION, "n_rows": n, "n_channels": c, "chunk_rows": chunk_rows, "fs": fs,
+                             "codec": codec, "env_ms": dsp.ENV_MS, "streams": index,
+                             "env_lead": None if env_lead is None else np.asarray(env_lead).tolist()}).encode("utf-8")
+        f.write(footer)
+        f.write(TAIL.pack(len(footer), MAGIC))
+    os.replace(tmp, path)
+    return path
+
+
+class _Rows:
+    # the bit of the ndarray interface the readers use: shape, a[i:j], a[i:j, cols], a[:, ch], a[idx], np.asarray(a).
+    # subclasses provide _rows(start, stop, cols) -> float64 (stop - start, len(cols)) array
+    dtype = np.dtype(np.float64)
+    ndim = 2
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None):
+        out = self._rows(0, self.shape[0], slice(None))
+        return out if dtype is None else out.astype(dtype)
+
+    def __getitem__(self, key):
+        rows, cols = key if isinstance(key, tuple) else (key, slice(None))
+        n = self.shape[0]
+        col_sel = cols if isinstance(cols, slice) else np.atleast_1d(cols)
+        if isinstance(rows, slice):
+            start, stop, step = rows.indices(n)
+            if step == 1:
+                out = self._rows(start, max(start, stop), col_sel)
+            else:
+                out = self._take(np.arange(start, stop, step), col_sel)
+        elif np.isscalar(rows):
+            i = int(rows) + n if int(rows) < 0 else int(rows)
+            if not 0 <= i < n:
+                raise IndexError(f"index {rows} is out of bounds for axis 0 with size {n}")
+            out = self._rows(i, i + 1, col_sel)[0]
+        else:
+            idx = np.asarray(rows)
+            if idx.dtype == bool:
+                idx = np.flatnonzero(idx)
+            idx = np.where(idx < 0, idx + n, idx)
+            if idx.size and (idx.min() < 0 or idx.max() >= n):
+                raise IndexError(f"index out of bounds for axis 0 with size {n}")
+            out = self._take(idx, col_sel)
+        if not isinstance(cols, slice) and np.ndim(cols) == 0:
+            out = out[..., 0]  # a single column index drops that axis, like numpy
+        return out
+
+    def _take(self, idx, cols):
+        # rows at arbitrary indices: decode the span they cover (replay asks for short wrapped runs)
+        if not idx.size:
+            return self._rows(0, 0, cols)
+        out = np.empty((idx.size, len(np.arange(self.shape[1])[cols])))
+        order = np.argsort(idx, kind="stable")
+        sorted_idx = idx[order]
+        # runs of indices that are close together are read as one range
+        breaks = np.flatnonzero(np.diff(sorted_idx) > CHUNK_ROWS) + 1
+        for part in np.split(np.arange(idx.size), breaks):
+            lo, hi = sorted_idx[part[0]], sorted_idx[part[-1]] + 1
+            block = self._rows(int(lo), int(hi), cols)
+            out[order[part]] = block[sorted_idx[part] - lo]
+        return out
+
+
+class ChunkedArray(_Rows):
+    # one stream of a .emgc file, decoded chunk by chunk on access
+    def __init__(self, buf, info, n_rows, n_channels, chunk_rows, codec):
+        self.buf = buf   # memory-mapped file bytes
+        self.chunks = info["chunks"]
+        self.scale = info["scale"]
+        self.offset = info.get("offset", 0.0)
+        self.shape = (n_rows, n_channels)
+        self.chunk_rows = chunk_rows
+        self.codec = codec
+        self.cache = OrderedDict()  # chunk number -> decoded (rows, C)
+
+    @property
+    def nbytes(self):
+        # stored (compressed) size
+        return sum(nbytes for _, nbytes, _ in self.chunks)
+
+    def chunk(self, k):
+        hit = self.cache.get(k)
+        if hit is not None:
+            self.cache.move_to_end(k)
+            return hit
+        offset, nbytes, encoding = self.chunks[k]
+        rows = min(self.chunk_rows, self.shape[0] - k * self.chunk_rows)
+        out = decode_chunk(bytes(self.buf[offset:offset + nbytes]), encoding, rows, self.shape[1], self.scale, self.codec)
+        if self.offset:
+            out += self.offset
+        self.cache[k] = out
+        if len(self.cache) > CACHE_CHUNKS:
+            self.cache.popitem(last=False)
+        return out
+
+    def _rows(self, start, stop, cols):
+        parts = []
+        cr = self.chunk_rows
+        for k in range(start // cr, -(-stop // cr)):
+            a, b = max(start, k * cr) - k * cr, min(stop, (k + 1) * cr) - k * cr
+            parts.append(self.chunk(k)[a:b][:, cols])
+        if not parts:
+            return np.empty((0, self.shape[1]))[:, cols]
+        return parts[0].copy() if len(parts) == 1 else np.concatenate(parts)
+
+
+class EnvelopeOnRead(_Rows):
+    # envelope of a session saved without one: moving average of |raw| over dsp.env_window samples, the same thing
+    # the live filter computed while recording. before the first sample the window holds `lead` ((win - 1, C), the
+    # rectified samples the stream had before the recording joined), or zeros
+    def __init__(self, raw, win, lead=None):
+        self.raw = raw
+        self.win = win
+        self.shape = raw.shape
+        lead = None if lead is None else np.asarray(lead, dtype=np.float64)
+        if lead is None or lead.shape != (win - 1, raw.shape[1]):
+            lead = np.zeros((win - 1, raw.shape[1]))
+        self.lead = lead
+
+    def _rows(self, start, stop, cols):
+        lead = min(start, self.win - 1)  # samples before `start` that are still in the window
+        rect = np.abs(self.raw._rows(start - lead, stop, cols))
+        if lead < self.win - 1:
+            rect = np.concatenate([self.lead[lead:][:, cols], rect])
+        csum = np.cumsum(rect, axis=0)
+        env = csum[self.win - 1:].copy()
+        env[1:] -= csum[:-self.win]
+        return env / self.win
+
+
+class ChunkedSession:
+    def __init__(self, path):
+        self.path = Path(path)
+        self.buf = np.memmap(self.path, dtype=np.uint8, mode="r")
+        if bytes(self.buf[:4]) != MAGIC:
+            raise ValueError(f"{self.path.name} is not a chunked session file")
+        footer_len, magic = TAIL.unpack(bytes(self.buf[-TAIL.size:]))
+        if magic != MAGIC:
+            raise ValueError(f"{self.path.name} is incomplete (no footer)")
+        end = len(self.buf) - TAIL.size
+        self.meta = json.loads(bytes(self.buf[end - footer_len:end]).decode("utf-8"))
+        m = self.meta
+        streams = m["streams"]
+        self.raw = ChunkedArray(self.buf, streams["raw"], m["n_rows"], m["n_channels"], m["chunk_rows"], m["codec"])
+        if "env" in streams:
+            self.env = ChunkedArray(self.buf, streams["env"], m["n_rows"], m["n_channels"], m["chunk_rows"], m["codec"])
+        else:
+            fs = m.get("fs") or 200
+            self.env = EnvelopeOnRead(self.raw, dsp.env_window(fs, m.get("env_ms", dsp.ENV_MS)), m.get("env_lead"))
+        self.board = ChunkedArray(self.buf, streams["board"], m["n_rows"], m["n_channels"], m["chunk_rows"], m["codec"]) \
+            if "board" in streams else None
+        self.times = ChunkedArray(self.buf, streams["time"], m["n_rows"], 1, m["chunk_rows"], m["codec"]) \
+            if "time" in streams else None
+
+    @property
+    def has_env(self):
+        return isinstance(self.env, ChunkedArray)
+
+
+def open_session(path):
+    return ChunkedSession(path)
@@ -0,0 +1,70 @@
+import numpy as np
+
+
+class SwallowDetector:
+    # online swallow detection on one envelope channel.
+    # adaptive threshold: baseline + k * noise, where baseline/noise are slow running averages of the envelope
+    # that only update outside events. hysteresis: an event starts above the `on` level and ends below the
+    # lower `off` level. it is only reported once it has lasted min_s, so onsets arrive min_s + one chunk late
+    # at most, and offsets one chunk late.
+    def __init__(self, fs, channel=0, k_on=3.0, k_off=1.5, min_s=0.15, max_s=5.0, tau_s=5.0, warmup_s=1.0):
+        self.fs = fs
+        self.channel = channel
+        self.k_on = k_on
+        self.k_off = k_off
+        self.min_len = max(1, int(min_s * fs))
+        self.max_len = int(max_s * fs)
+        self.alpha = 1.0 / max(1.0, tau_s * fs)   # per-sample running average weight
+        self.warmup = int(warmup_s * fs)
+        self.reset()
+
+    def reset(self):
+        self.n = 0              # samples seen
+        self.baseline = None
+        self.noise = 0.0
+        self.active = None      # current event: dict(onset, peak, peak_sample, area, confirmed)
+
+    def process(self, env, start):
+        # env: (chunk, C) envelope block whose first row is sample index `start`.
+        # returns a list of event dicts (kind = "onset" | "offset") completed in this block
+        x = np.asarray(env)[:, self.channel]
+        events = []
+        for i, v in enumerate(x):
+            v = float(v)
+            idx = start + i
+            self.n += 1
+
+            if self.baseline is None:
+                self.baseline = v
+            if self.active is None:
+                # track baseline/noise while quiet
+                self.baseline += self.alpha * (v - self.baseline)
+                self.noise += self.alpha * (abs(v - self.baseline) - self.noise)
+                if self.n > self.warmup and v > self.baseline + self.k_on * self.noise:
+                    self.active = {"onset": idx, "peak": v, "peak_sample": idx, "area": 0.0, "confirmed": False}
+                else:
+                    continue
+
+            ev = self.active
+            ev["area"] += v - self.baseline
+            if v > ev["peak"]:
+                ev["peak"], ev["peak_sample"] = v, idx
+            length = idx - ev["onset"] + 1
+
+            if not ev["confirmed"] and length >= self.min_len:
+                ev["confirmed"] = True
+                events.append({"kind": "onset", "onset": ev["onset"]})
+
+            if v < self.baseline + self.k_off * self.noise or length >= self.max_len:
+                if ev["confirmed"]:
+                    events.append({
+                        "kind": "offset",
+                        "onset": ev["onset"],
+                        "offset": idx,
+                        "peak": ev["peak"],
+                        "peak_sample": ev["peak_sample"],
+                        "duration": length / self.fs,
+                        "area": ev["area"] / self.fs,
+                    })
+                self.active = None
+        return events
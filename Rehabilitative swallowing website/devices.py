@@ -0,0 +1,62 @@
+# board registry: one server process running several boards (e.g. a ganglion dongle per patient). each device has
+# its own Acquisition (reader thread, filter + detector state, subscribers) and its own recordings. the boards
+# come from EMG_DEVICES (see backends.py); the routes are /devices/<id>/..., and the plain /ws etc. use the
+# first device, so a single-board setup works as before
+import asyncio
+
+from stream import Acquisition
+
+
+class Device:
+    def __init__(self, device_id, board, chunk_samples=20, interval_ms=50, fill_gaps=True):
+        self.id = device_id
+        self.board = board
+        self.fs = board.fs
+        self.channels = board.channels
+        self.acq = Acquisition(board, board.fs, board.channels, chunk_samples, interval_ms, name=device_id,
+                               fill_gaps=fill_gaps)
+
+    def info(self):
+        return {"id": self.id, "backend": type(self.board).__name__, "fs": self.fs, "channels": len(self.channels),
+                "clients": len(self.acq.subscribers), "recordings": list(self.acq.recordings), **self.acq.status()}
+
+
+class Devices:
+    def __init__(self, boards, chunk_samples=20, interval_ms=50, fill_gaps=True):
+        # boards: {device id: backend}, in order; the first one is the default device
+        if not boards:
+            raise ValueError("no boards configured")
+        self.devices = {i: Device(i, b, chunk_samples, interval_ms, fill_gaps) for i, b in boards.items()}
+        self.default = next(iter(self.devices.values()))
+
+    def __len__(self):
+        return len(self.devices)
+
+    def __iter__(self):
+        return iter(self.devices.values())
+
+    def get(self, device_id):
+        return self.devices.get(device_id)
+
+    def start(self):
+        for d in self:
+            d.acq.start()
+
+    async def stop(self):
+        await asyncio.gather(*(d.acq.stop() for d in self))
+        for d in self:
+            try:
+                d.board.stop()
+            except Exception as e:
+                print(f"{d.id}: stop failed ({e})")
+
+    async def detach(self, session_id):
+        # stop feeding a recording, whichever board it's on (waits for a write to it that's under way)
+        await asyncio.gather(*(d.acq.detach(session_id) for d in self if session_id in d.acq.recordings))
+
+    def status(self):
+        # all boards together, for /ready: ready when every board streams, state/last_error of the first that doesn't
+        states = {d.id: d.acq.status() for d in self}
+        waiting = [s for s in states.values() if not s["ready"]]
+        first = waiting[0] if waiting else self.default.acq.status()
+        return {"ready": not waiting, "state": first["state"], "last_error": first["last_error"], "devices": states}
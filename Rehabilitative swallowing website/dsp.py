@@ -0,0 +1,77 @@
+import numpy as np
+from scipy import signal
+
+# EMG chain (same bands as plottingV3.py / server.py)
+BAND = (40.0, 100.0)   # bandpass, Hz
+NOTCH = 60.0           # power line noise (60 Hz in US)
+ORDER = 4
+ENV_MS = 50            # moving average window for the envelope
+
+
+def design(fs, band=BAND, notch=NOTCH, order=ORDER):
+    # notch + bandpass as one cascade of second-order sections
+    hi = min(band[1], fs/2 - 1.0)
+    sections = []
+    if notch is not None and notch + 2.0 < fs / 2:
+        # same 58-62 Hz band that DataFilter.remove_environmental_noise cuts
+        sections.append(signal.butter(2, [notch - 2.0, notch + 2.0], btype="bandstop", fs=fs, output="sos"))
+    sections.append(signal.butter(order, [band[0], hi], btype="bandpass", fs=fs, output="sos"))
+    return np.vstack(sections)
+
+
+def env_window(fs, env_ms=ENV_MS):
+    return max(1, int(env_ms / 1000.0 * fs))
+
+
+class StreamingFilter:
+    # notch -> bandpass -> rectify -> moving average envelope for (chunk, C) blocks.
+    # filter state and the envelope tail are carried over between chunks, so feeding a recording
+    # chunk by chunk gives the same output as filtering it in one go (offline() below, checked in tests/test_dsp.py)
+    def __init__(self, fs, n_channels, band=BAND, notch=NOTCH, order=ORDER, env_ms=ENV_MS):
+        self.fs = fs
+        self.n_channels = n_channels
+        self.sos = design(fs, band, notch, order)
+        self.win = env_window(fs, env_ms)
+        self.reset()
+
+    def reset(self):
+        self.zi = None  # (n_sections, 2, C), set from the first sample we see
+        self.tail = np.zeros((self.win - 1, self.n_channels))  # last win-1 rectified samples
+
+    def process(self, raw):
+        # raw: (chunk, C) -> (filtered, envelope), both (chunk, C) float64
+        raw = np.asarray(raw, dtype=np.float64)
+        if raw.shape[0] == 0:
+            return raw.copy(), raw.copy()
+
+        if self.zi is None:
+            # start the filters in steady state for the first sample's DC offset,
+            # otherwise the electrode offset rings through the bandpass for the first second
+            self.zi = signal.sosfilt_zi(self.sos)[:, :, None] * raw[0][None, None, :]
+
+        y, self.zi = signal.sosfilt(self.sos, raw, axis=0, zi=self.zi)
+
+        rect = np.abs(y)
+        ext = np.concatenate([self.tail, rect], axis=0)
+        csum = np.cumsum(ext, axis=0)
+        env = csum[self.win - 1:].copy()
+        env[1:] -= csum[:-self.win]
+        env /= self.win
+        if self.win > 1:
+            self.tail = ext[-(self.win - 1):]
+
+        return y, env
+
+
+def offline(raw, fs, band=BAND, notch=NOTCH, order=ORDER, env_ms=ENV_MS):
+    # reference: filter a whole (N, C) recording at once
+    raw = np.asarray(raw, dtype=np.float64)
+    sos = design(fs, band, notch, order)
+    zi = signal.sosfilt_zi(sos)[:, :, None] * raw[0][None, None, :]
+    y, _ = signal.sosfilt(sos, raw, axis=0, zi=zi)
+
+    win = env_window(fs, env_ms)
+    kernel = np.ones(win) / win
+    env = np.stack([np.convolve(np.abs(y[:, ci]), kernel)[:len(y)] for ci in range(y.shape[1])], axis=1)
+    return y, env
+
@@ -0,0 +1,240 @@
+# streaming export of saved sessions: csv, edf and parquet, one block of rows at a time so memory stays
+# flat however long the session is and the first bytes go out straight away (server.py /export/<id>).
+# parquet needs pyarrow (pip install pyarrow), csv and edf don't need anything extra
+import io
+import json
+from datetime import datetime
+
+import numpy as np
+
+import pyramid
+import storage
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # parquet export is optional
+    pa = pq = None
+
+FORMATS = ("csv", "edf", "parquet")
+BLOCK_ROWS = 1 << 14
+MEDIA_TYPES = {"csv": "text/csv", "edf": "application/octet-stream", "parquet": "application/vnd.apache.parquet"}
+# meta fields copied into the exports. the rest (gaps, env_lead, ...) are lists the server keeps for itself
+META_FIELDS = ("label", "notes", "duration", "saved_at", "device", "channels", "missing_samples")
+
+
+def start_time(session_id):
+    # session ids are the connect time (server.py), e.g. 20260216_123829_637347
+    try:
+        return datetime.strptime(session_id, "%Y%m%d_%H%M%S_%f")
+    except ValueError:
+        return None
+
+
+def channel_labels(meta, n_channels):
+    labels = meta.get("channel_labels")
+    if isinstance(labels, list) and len(labels) == n_channels:
+        return [str(x) for x in labels]
+    return [f"ch{i + 1}" for i in range(n_channels)]
+
+
+def describe(data_dir, session_id, fs):
+    # everything an export carries besides the samples: (raw, env, board timestamps or None, info)
+    meta = storage.read_meta(data_dir, session_id)
+    raw, env = storage.open_session(data_dir, session_id)
+    times = storage.open_times(data_dir, session_id)
+    fs = meta.get("fs", fs)
+    t0 = start_time(session_id)
+    return raw, env, times, {
+        **{k: meta[k] for k in META_FIELDS if k in meta},
+        "session_id": session_id,
+        "fs": fs,
+        "n_samples": raw.shape[0],
+        "channel_labels": channel_labels(meta, raw.shape[1]),
+        "start_time": t0.isoformat() if t0 else None,
+        "timestamps": times is not None,
+        "units": "uV",
+    }
+
+
+def _blocks(raw, env, times):
+    for i in range(0, raw.shape[0], BLOCK_ROWS):
+        t = np.asarray(times[i:i + BLOCK_ROWS]).reshape(-1) if times is not None else None
+        yield i, np.asarray(raw[i:i + BLOCK_ROWS]), np.asarray(env[i:i + BLOCK_ROWS]), t
+
+
+# csv: "# key: value" metadata lines, then time_s, sample, [timestamp,] raw_<label>..., env_<label>...
+# (timestamp: the board's clock for the sample, unix s, for sessions recorded with timestamps)
+
+def iter_csv(raw, env, times, info):
+    head = io.StringIO()
+    for k, v in info.items():
+        head.write(f"# {k}: {json.dumps(v)}\n")
+    labels = info["channel_labels"]
+    stamp = ["timestamp"] if times is not None else []
+    head.write(",".join(["time_s", "sample"] + stamp + [f"raw_{x}" for x in labels] + [f"env_{x}" for x in labels]) + "\n")
+    yield head.getvalue().encode("utf-8")
+
+    fs = info["fs"]
+    c = raw.shape[1]
+    fmt = ",".join(["%.6f", "%d"] + ["%.6f"] * len(stamp) + ["%.6g"] * (2 * c))
+    for i, r, e, t in _blocks(raw, env, times):
+        idx = np.arange(i, i + r.shape[0])
+        block = np.column_stack([idx / fs, idx] + ([t] if t is not None else []) + [r, e])
+        out = io.StringIO()
+        np.savetxt(out, block, fmt=fmt)
+        yield out.getvalue().encode("utf-8")
+
+
+# edf (plain EDF, 16 bit): one data record per second, raw and env of every channel as separate signals
+
+def _field(value, width):
+    return str(value)[:width].ljust(width).encode("ascii", "replace")
+
+
+def _edf_number(x, width=8):
+    # edf numbers are ascii in 8 characters
+    s = f"{x:.6g}"
+    if len(s) > width:
+        s = f"{x:.{max(0, width - 6)}e}" if abs(x) >= 1 else f"{x:.{width - 2}f}"
+    return s[:width]
+
+
+def _physical_range(data_dir, session_id, stream, full):
+    # global min/max per channel, from the coarsest pyramid level when there is one (no full scan)
+    lv = pyramid.read_level(data_dir, session_id, stream, pyramid.FACTORS[-1])
+    if lv is not None:
+        return np.asarray(lv[:, 0].min(axis=0)), np.asarray(lv[:, 1].max(axis=0))
+    lo = np.full(full.shape[1], np.inf)
+    hi = np.full(full.shape[1], -np.inf)
+    for i in range(0, full.shape[0], BLOCK_ROWS):
+        block = np.asarray(full[i:i + BLOCK_ROWS])
+        lo = np.minimum(lo, block.min(axis=0))
+        hi = np.maximum(hi, block.max(axis=0))
+    return lo, hi
+
+
+def iter_edf(raw, env, info, data_dir):
+    fs = int(round(info["fs"]))  # samples per 1 s record
+    n, c = raw.shape
+    n_records = max(1, -(-n // fs))
+    labels = info["channel_labels"]
+
+    ranges = [_physical_range(data_dir, info["session_id"], s, a) for s, a in (("raw", raw), ("env", env))]
+    pmin = np.concatenate([r[0] for r in ranges])
+    pmax = np.concatenate([r[1] for r in ranges])
+    pmin = np.where(np.isfinite(pmin), pmin, -1.0)
+    pmax = np.where(np.isfinite(pmax), pmax, 1.0)
+    pmax = np.where(pmax > pmin, pmax, pmin + 1.0)  # flat channel
+    # scale with the numbers as written to the header (8 characters), so readers decode exactly what we encoded
+    pmin = np.array([float(_edf_number(x)) for x in pmin])
+    pmax = np.array([float(_edf_number(x)) for x in pmax])
+    dmin, dmax = -32768, 32767
+    gain = (pmax - pmin) / (dmax - dmin)
+
+    names = [f"raw {x}" for x in labels] + [f"env {x}" for x in labels]
+    ns = len(names)
+    t0 = start_time(info["session_id"]) or datetime(1985, 1, 1)
+    recording = f"Startdate {t0:%d-%b-%Y}".upper() + " " + (info.get("label") or info["session_id"]).replace(" ", "_")
+
+    head = b"".join([
+        _field("0", 8),
+        _field("X X X X", 80),       # patient (not stored here)
+        _field(recording, 80),
+        _field(f"{t0:%d.%m.%y}", 8),
+        _field(f"{t0:%H.%M.%S}", 8),
+        _field(256 * (ns + 1), 8),
+        _field("", 44),
+        _field(n_records, 8),
+        _field(1, 8),                 # record duration, s
+        _field(ns, 4),
+        b"".join(_field(x, 16) for x in names),
+        b"".join(_field("surface EMG" if x.startswith("raw") else "EMG envelope", 80) for x in names),
+        b"".join(_field("uV", 8) for _ in names),
+        b"".join(_field(_edf_number(x), 8) for x in pmin),
+        b"".join(_field(_edf_number(x), 8) for x in pmax),
+        b"".join(_field(dmin, 8) for _ in names),
+        b"".join(_field(dmax, 8) for _ in names),
+        b"".join(_field("bandpass 40-100Hz notch 60Hz" if x.startswith("raw") else "rectified, 50 ms moving average", 80) for x in names),
+        b"".join(_field(fs, 8) for _ in names),
+        b"".join(_field("", 32) for _ in names),
+    ])
+    yield head
+
+    # whole records per block, the last one padded
+    rec_per_block = max(1, BLOCK_ROWS // fs)
+    for r0 in range(0, n_records, rec_per_block):
+        r1 = min(r0 + rec_per_block, n_records)
+        s, e = r0 * fs, min(r1 * fs, n)
+        block = np.zeros(((r1 - r0) * fs, 2 * c))
+        block[:e - s, :c] = raw[s:e]
+        block[:e - s, c:] = env[s:e]
+        if e - s < block.shape[0]:
+            block[e - s:] = pmin  # padding decodes to the minimum, not to a fake spike
+        digital = np.clip(np.round((block - pmin) / gain + dmin), dmin, dmax).astype("<i2")
+        # (records * fs, signals) -> per record: signal 0's fs samples, signal 1's, ...
+        yield digital.reshape(r1 - r0, fs, ns).transpose(0, 2, 1).tobytes()
+
+
+# parquet: one row group per block, session metadata in the schema
+
+class _Sink(io.RawIOBase):
+    # file-like object pyarrow writes into; we hand out what it wrote after every row group
+    def __init__(self):
+        self.chunks = []
+        self.pos = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.chunks.append(bytes(b))
+        self.pos += len(b)
+        return len(b)
+
+    def tell(self):
+        return self.pos
+
+    def take(self):
+        out = b"".join(self.chunks)
+        self.chunks = []
+        return out
+
+
+def iter_parquet(raw, env, times, info):
+    labels = info["channel_labels"]
+    fields = [pa.field("time_s", pa.float64()), pa.field("sample", pa.int64())]
+    fields += [pa.field("timestamp", pa.float64())] if times is not None else []
+    fields += [pa.field(f"raw_{x}", pa.float32()) for x in labels]
+    fields += [pa.field(f"env_{x}", pa.float32()) for x in labels]
+    schema = pa.schema(fields, metadata={"session": json.dumps(info)})
+
+    sink = _Sink()
+    fs = info["fs"]
+    with pq.ParquetWriter(sink, schema) as writer:
+        for i, r, e, t in _blocks(raw, env, times):
+            idx = np.arange(i, i + r.shape[0])
+            cols = [pa.array(idx / fs), pa.array(idx)] + ([pa.array(t)] if t is not None else [])
+            cols += [pa.array(r[:, k].astype(np.float32)) for k in range(r.shape[1])]
+            cols += [pa.array(e[:, k].astype(np.float32)) for k in range(e.shape[1])]
+            writer.write_table(pa.Table.from_arrays(cols, schema=schema))
+            chunk = sink.take()
+            if chunk:
+                yield chunk
+    yield sink.take()
+
+
+def export(data_dir, session_id, fmt, fs):
+    # byte iterator for a StreamingResponse. raises ValueError for a bad format, LookupError if there's no session
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    if fmt == "parquet" and pa is None:
+        raise ValueError("parquet export needs pyarrow (pip install pyarrow)")
+    if storage.open_session(data_dir, session_id) is None:
+        raise LookupError(session_id)
+    raw, env, times, info = describe(data_dir, session_id, fs)
+    if fmt == "csv":
+        return iter_csv(raw, env, times, info)
+    if fmt == "edf":
+        return iter_edf(raw, env, info, data_dir)  # edf has no per-sample time, just the start time in its header
+    return iter_parquet(raw, env, times, info)
@@ -0,0 +1,134 @@
+# calibrated biofeedback for the exercises. a calibration records a few maximal-effort swallows of one patient and
+# stores where their envelope rests and how high it goes (data/calibration/<patient>.json). with a calibration
+# active on a board, every read of the board (polled every INTERVAL_MS, faster than the display frames) produces a
+# small "feedback" message: effort as a fraction of the patient's max and whether it's over the target, sent ahead
+# of any queued data (stream.py). the page echoes each one back once it's on screen, so the latency from the
+# board's timestamp of the newest sample to the screen is measured continuously (an upper bound: it includes the
+# way back)
+import json
+import re
+import time
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from metrics import METRICS
+
+TARGET = 0.6            # default target, fraction of the calibrated max effort
+REARM = 0.8             # after a hit, effort has to drop below REARM * target before the next one counts
+MIN_SWALLOWS = 3        # maximal-effort swallows a calibration needs
+INTERVAL_MS = 20        # board poll interval while feedback is on
+LATENCY_BUDGET_S = 0.1  # feedback slower than this counts as late
+LATENCY_WINDOW = 500    # latest measurements kept for the percentiles in /devices/<id>/feedback
+PATIENT_RE = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+
+def check_patient(patient):
+    # patient ids end up in file names
+    if not isinstance(patient, str) or not PATIENT_RE.fullmatch(patient):
+        raise ValueError("patient must be 1-64 letters, digits, '-' or '_'")
+    return patient
+
+
+def calibration_path(data_dir, patient):
+    return Path(data_dir) / "calibration" / f"{check_patient(patient)}.json"
+
+
+def load_calibration(data_dir, patient):
+    path = calibration_path(data_dir, patient)
+    return json.loads(path.read_text(encoding="utf-8")) if path.exists() else None
+
+
+def save_calibration(data_dir, cal):
+    path = calibration_path(data_dir, cal["patient"])
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(cal, indent=2), encoding="utf-8")
+    return path
+
+
+class Calibrator:
+    # collects the swallows the detector finds while a patient swallows as hard as they can.
+    # fed on the board's thread, right after the detector
+    def __init__(self, patient, channel, fs):
+        self.patient = check_patient(patient)
+        self.channel = channel
+        self.fs = fs
+        self.peaks = []  # envelope peak of each swallow
+        self.rest = []   # detector baseline when it ended (the baseline doesn't move during a swallow)
+
+    def add(self, events, baseline):
+        for ev in events:
+            if ev["kind"] == "offset":
+                self.peaks.append(float(ev["peak"]))
+                self.rest.append(float(baseline))
+
+    def finish(self):
+        if len(self.peaks) < MIN_SWALLOWS:
+            raise ValueError(f"{len(self.peaks)} swallows recorded, calibration needs at least {MIN_SWALLOWS}")
+        # median of the stronger half, so one unusually hard swallow (or an artifact) doesn't set the bar
+        peaks = np.sort(self.peaks)
+        rest = float(np.median(self.rest))
+        top = float(np.median(peaks[len(peaks) // 2:]))
+        if top <= rest:
+            raise ValueError("swallows don't rise above rest, check the electrodes and calibrate again")
+        return {"patient": self.patient, "channel": self.channel, "fs": self.fs, "rest": rest, "max": top,
+                "swallows": len(peaks), "peaks": [round(p, 3) for p in self.peaks],
+                "created": datetime.now().isoformat(timespec="seconds")}
+
+
+class Feedback:
+    # normalized effort of one calibrated patient: 0 at rest, 1 at their calibrated max
+    def __init__(self, cal, target=None):
+        self.cal = cal
+        self.patient = cal["patient"]
+        self.channel = cal["channel"]
+        self.rest = cal["rest"]
+        self.scale = cal["max"] - cal["rest"]
+        self.target = target or TARGET
+        self.seq = 0
+        self.hits = 0       # times effort reached the target
+        self.armed = True   # False while still over the target (no new hit until it dropped below REARM * target)
+
+    def process(self, env, t):
+        # env: (chunk, C) envelope, t: time of its newest sample. returns the feedback message fields
+        e = (np.asarray(env)[:, self.channel] - self.rest) / self.scale
+        for v in e.tolist():
+            if self.armed and v >= self.target:
+                self.hits += 1
+                self.armed = False
+            elif not self.armed and v < REARM * self.target:
+                self.armed = True
+        self.seq += 1
+        return {"type": "feedback", "seq": self.seq, "effort": round(max(0.0, float(e[-1])), 3),
+                "peak": round(max(0.0, float(e.max())), 3), "target": self.target, "hit": not self.armed,
+                "hits": self.hits, "t": t}
+
+    def info(self):
+        return {"patient": self.patient, "target": self.target, "hits": self.hits, "calibration": self.cal}
+
+
+class Latency:
+    # feedback latency of one board, from the board's timestamp of the newest sample to
+    # "sent": the message written to a client's socket, "shown": the page's echo arriving back
+    def __init__(self, device):
+        self.device = device
+        self.recent = {"sent": deque(maxlen=LATENCY_WINDOW), "shown": deque(maxlen=LATENCY_WINDOW)}
+        self.late = {"sent": 0, "shown": 0}
+
+    def add(self, kind, t):
+        s = time.time() - t
+        self.recent[kind].append(s)
+        if s > LATENCY_BUDGET_S:
+            self.late[kind] += 1
+        METRICS.observe("emg_feedback_latency_seconds", s, device=self.device, kind=kind)
+
+    def summary(self):
+        out = {"budget_ms": LATENCY_BUDGET_S * 1e3}
+        for kind, recent in self.recent.items():
+            a = np.asarray(recent) * 1e3
+            out[kind] = {"n": len(a), "late": self.late[kind],
+                         **{p: round(float(np.percentile(a, q)), 1) if len(a) else None
+                            for p, q in (("p50_ms", 50), ("p95_ms", 95), ("max_ms", 100))}}
+        return out
@@ -0,0 +1,85 @@
+import json
+import struct
+
+import numpy as np
+
+# websocket data frames. the client picks the format when it connects (/ws?format=binary),
+# json stays the default so older pages keep working.
+#
+# binary frame, little endian:
+#   u8  version
+#   u8  dtype         (1 = float32)
+#   u16 n_channels    channels in this frame (the ones the client subscribed to)
+#   u32 seq
+#   u32 n_samples     rows in this frame
+#   u64 start         index of the first sample in this frame
+#   u32 span          stream samples the rows cover; == n_samples unless the frame was min/max
+#                     decimated (target display rate or a slow client), then each row stands for
+#                     span / n_samples samples
+#   u8  streams       which payloads follow: 1 = raw, 2 = env
+#   3 bytes padding
+#   f64 t_first       board timestamp (unix seconds, host clock) of the first / last sample in this frame,
+#   f64 t_last        nan when the board has none. now - t_last is how far behind the board the client is
+#   raw  float32[n_samples * n_channels]   if streams & 1, row-major (sample by sample, channels interleaved)
+#   env  float32[n_samples * n_channels]   if streams & 2
+# the header is 44 bytes so the payloads can be viewed directly as Float32Array in the browser
+HEADER = struct.Struct("<BBHIIQIB3xdd")
+VERSION = 4
+DTYPE_F32 = 1
+RAW = 1
+ENV = 2
+
+FORMATS = ("json", "binary")
+
+
+def encode_binary(seq, start, raw, env, span=None, times=None):
+    # raw or env can be None when the client didn't ask for that stream. times: (t_first, t_last) or None
+    parts = [a for a in (raw, env) if a is not None]
+    n, c = parts[0].shape
+    streams = (RAW if raw is not None else 0) | (ENV if env is not None else 0)
+    t_first, t_last = times if times is not None else (float("nan"), float("nan"))
+    out = bytearray(HEADER.size + len(parts) * n * c * 4)
+    HEADER.pack_into(out, 0, VERSION, DTYPE_F32, c, seq & 0xFFFFFFFF, n, start, n if span is None else span, streams,
+                     t_first, t_last)
+    body = np.frombuffer(out, dtype="<f4", offset=HEADER.size).reshape(len(parts), n, c)
+    for i, a in enumerate(parts):
+        body[i] = a
+    return bytes(out)
+
+
+def decode_binary(buf):
+    version, dtype, c, seq, n, start, span, streams, t_first, t_last = HEADER.unpack_from(buf, 0)
+    if version != VERSION or dtype != DTYPE_F32:
+        raise ValueError(f"unsupported frame (version {version}, dtype {dtype})")
+    k = bin(streams).count("1")
+    body = np.frombuffer(buf, dtype="<f4", count=k * n * c, offset=HEADER.size).reshape(k, n, c)
+    raw = body[0] if streams & RAW else None
+    env = body[k - 1] if streams & ENV else None
+    return seq, start, raw, env, span, (t_first, t_last)
+
+
+def encode_json(seq, start, raw, env, span=None, times=None):
+    msg = {"type": "data", "seq": seq, "start": start}
+    if times is not None and times[0] == times[0]:  # not nan
+        msg["t0"], msg["t1"] = times
+    if raw is not None:
+        msg["raw"] = raw.tolist()
+    if env is not None:
+        msg["env"] = env.tolist()
+    n = (raw if raw is not None else env).shape[0]
+    if span is not None and span != n:
+        msg["span"] = span
+    return json.dumps(msg)
+
+
+def encode(fmt, seq, start, raw, env, span=None, times=None):
+    if fmt == "binary":
+        return encode_binary(seq, start, raw, env, span, times)
+    return encode_json(seq, start, raw, env, span, times)
+
+
+def frame_bytes(fmt, n, c, n_streams=2):
+    # rough size of an encoded frame, used to decide how much a slow client can take
+    if fmt == "binary":
+        return HEADER.size + n_streams * n * c * 4
+    return 90 + n_streams * n * c * 20  # json floats are ~20 characters each
@@ -1,8 +1,39 @@
+import json
 import subprocess
 import sys
 import time
+import urllib.error
+import urllib.request
 import webbrowser
 
+URL = "http://127.0.0.1:8000"
+READY_TIMEOUT_S = 30   # give up waiting for the board after this long (the page still works, it'll show the state)
+
+def wait_ready(p):
+    # poll /ready until the board is streaming. the server answers within a second or so,
+    # the board can take longer (bluetooth) or not come up at all
+    deadline = time.time() + READY_TIMEOUT_S
+    state = None
+    while time.time() < deadline:
+        if p.poll() is not None:
+            return False, "server exited"
+        try:
+            with urllib.request.urlopen(URL + "/ready", timeout=1) as r:
+                return True, json.load(r)["state"]
+        except urllib.error.HTTPError as e:  # 503: server up, board not yet
+            try:
+                info = json.load(e)
+            except ValueError:  # some other error page (plain text 500...), keep polling
+                time.sleep(0.2)
+                continue
+            if info["state"] != state:
+                state = info["state"]
+                print(f"board: {state}" + (f" ({info['last_error']})" if info.get("last_error") else ""))
+        except OSError:
+            pass  # not listening yet
+        time.sleep(0.2)
+    return False, state or "server not responding"
+
 def main():
     # start the server in the background
     p = subprocess.Popen([sys.executable, "-m", "uvicorn",
@@ -11,11 +42,14 @@ def main():
                          stdout=subprocess.DEVNULL,
                          stderr=subprocess.DEVNULL)
 
-    # give it a moment to start
-    time.sleep(1.0)
+    ok, state = wait_ready(p)
+    if not ok:
+        print(f"board not ready ({state}), opening the page anyway")
+        if p.poll() is not None:
+            sys.exit(p.returncode)
 
     # open the UI
-    webbrowser.open("http://127.0.0.1:8000")
+    webbrowser.open(URL)
 
     # keep launcher alive until server exits
     try:
@@ -0,0 +1,166 @@
+# counters, latency histograms and gauges for the streaming path, served as prometheus text at /metrics
+# (and as json at /metrics?format=json). cheap enough for the hot path: a perf_counter() pair, a bisect
+# and a few additions under a lock per observation.
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# seconds, 50 us .. 2.5 s
+BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def _key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _fmt_labels(key, extra=()):
+    items = list(key) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{str(v)}"' for k, v in items) + "}"
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, v):
+        self.counts[bisect_left(self.buckets, v)] += 1
+        self.sum += v
+        self.count += 1
+
+    def quantile(self, q):
+        # upper bound of the bucket holding the q-th observation (good enough for a debug view)
+        if not self.count:
+            return None
+        target = q * self.count
+        acc = 0
+        for b, c in zip(self.buckets + (float("inf"),), self.counts):
+            acc += c
+            if acc >= target:
+                return b
+        return float("inf")
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}    # name -> {labels key: value}
+        self.histograms = {}  # name -> {labels key: Histogram}
+        self.gauges = {}      # name -> fn() returning a number or {labels dict as tuple: value}
+        self.help = {}
+
+    def describe(self, name, text):
+        self.help[name] = text
+
+    def inc(self, name, value=1, **labels):
+        k = _key(labels)
+        with self._lock:
+            fam = self.counters.setdefault(name, {})
+            fam[k] = fam.get(k, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        k = _key(labels)
+        with self._lock:
+            fam = self.histograms.setdefault(name, {})
+            h = fam.get(k)
+            if h is None:
+                h = fam[k] = Histogram()
+            h.observe(seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t0, **labels)
+
+    def gauge(self, name, fn, text=""):
+        # fn is called at scrape time: return a number, or a dict {labels key: value}
+        self.gauges[name] = fn
+        if text:
+            self.help[name] = text
+
+    def _gauge_values(self, fn):
+        try:
+            v = fn()
+        except Exception:
+            return {}
+        return v if isinstance(v, dict) else {(): v}
+
+    def render(self):
+        # prometheus text exposition format
+        lines = []
+        with self._lock:
+            counters = {n: dict(f) for n, f in self.counters.items()}
+            hists = {n: {k: (list(h.counts), h.sum, h.count, h.buckets) for k, h in f.items()}
+                     for n, f in self.histograms.items()}
+        for name, fam in sorted(counters.items()):
+            if name in self.help:
+                lines.append(f"# HELP {name} {self.help[name]}")
+            lines.append(f"# TYPE {name} counter")
+            for k, v in fam.items():
+                lines.append(f"{name}{_fmt_labels(k)} {v}")
+        for name, fn in sorted(self.gauges.items()):
+            if name in self.help:
+                lines.append(f"# HELP {name} {self.help[name]}")
+            lines.append(f"# TYPE {name} gauge")
+            for k, v in self._gauge_values(fn).items():
+                lines.append(f"{name}{_fmt_labels(k)} {v}")
+        for name, fam in sorted(hists.items()):
+            if name in self.help:
+                lines.append(f"# HELP {name} {self.help[name]}")
+            lines.append(f"# TYPE {name} histogram")
+            for k, (counts, total, n, buckets) in fam.items():
+                acc = 0
+                for b, c in zip(buckets, counts):
+                    acc += c
+                    lines.append(f"{name}_bucket{_fmt_labels(k, [('le', b)])} {acc}")
+                lines.append(f"{name}_bucket{_fmt_labels(k, [('le', '+Inf')])} {n}")
+                lines.append(f"{name}_sum{_fmt_labels(k)} {total}")
+                lines.append(f"{name}_count{_fmt_labels(k)} {n}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        # json debug view: counters, gauges, and count/mean/p50/p99 (bucket bounds, ms) per histogram
+        def label_str(k):
+            return ",".join(f"{a}={b}" for a, b in k) or "_"
+
+        with self._lock:
+            out = {
+                "counters": {n: {label_str(k): v for k, v in f.items()} for n, f in self.counters.items()},
+                "histograms": {
+                    n: {label_str(k): {
+                        "count": h.count,
+                        "mean_ms": h.sum / h.count * 1e3 if h.count else None,
+                        "p50_ms": (h.quantile(0.5) or 0) * 1e3 if h.count else None,
+                        "p99_ms": (h.quantile(0.99) or 0) * 1e3 if h.count else None,
+                    } for k, h in f.items()}
+                    for n, f in self.histograms.items()
+                },
+            }
+        out["gauges"] = {n: {label_str(k): v for k, v in self._gauge_values(fn).items()} for n, fn in self.gauges.items()}
+        return out
+
+
+METRICS = Metrics()
+METRICS.describe("emg_stage_seconds", "time spent per streaming stage")
+METRICS.describe("emg_samples_acquired_total", "samples read from each board")
+METRICS.describe("emg_samples_sent_total", "samples sent to websocket clients (summed over clients)")
+METRICS.describe("emg_samples_dropped_total", "samples dropped from a slow client's display queue")
+METRICS.describe("emg_samples_duplicated_total", "samples a client was sent more than once")
+METRICS.describe("emg_messages_sent_total", "websocket messages sent")
+METRICS.describe("emg_frames_total", "display frames sent per rate mode (full, coalesced, decimated)")
+METRICS.describe("emg_board_reconnects_total", "times the board session was re-established after a drop")
+METRICS.describe("emg_events_total", "swallow detector events")
+METRICS.describe("emg_request_seconds", "duration of save/load endpoints")
+METRICS.describe("emg_feedback_latency_seconds",
+                 "board timestamp of the newest sample to the feedback message sent / shown (echoed back by the page)")
+for _name in ("emg_samples_sent_total", "emg_samples_dropped_total", "emg_samples_duplicated_total",
+              "emg_messages_sent_total"):
+    METRICS.inc(_name, 0)  # show up as 0 before anything happens (per-board counters: see stream.Acquisition)
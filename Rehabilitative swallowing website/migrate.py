@@ -0,0 +1,78 @@
+# convert sessions saved as data/raw_<id>.npy + env_<id>.npy into compressed data/session_<id>.emgc files
+# (chunked.py). each file is checked against the .npy pair before those are deleted, the server keeps serving
+# either format meanwhile, and the workers run at low priority so it can be left running next to a recording.
+# the viewer's min/max levels (pyramid.py) are rebuilt compressed too, they're counted in the sizes.
+#   python migrate.py --workers 2
+#   python migrate.py --keep-npy --with-env
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import pyramid
+import storage
+
+DATA_DIR = Path(__file__).parent / "data"
+
+
+def _low_priority():
+    if hasattr(os, "nice"):
+        os.nice(10)
+
+
+def _size(data_dir, session_id):
+    return sum(p.stat().st_size for p in storage.session_files(data_dir, session_id) + pyramid.files(data_dir, session_id))
+
+
+def needs_migration(data_dir, session_id):
+    return not storage.chunked_path(data_dir, session_id).exists() or \
+        any(p.suffix == ".npy" for p in pyramid.files(data_dir, session_id))
+
+
+def migrate_session(data_dir, session_id, with_env, keep_npy):
+    # returns (bytes before, bytes after), session files and pyramid levels
+    before = _size(data_dir, session_id)
+    if not storage.chunked_path(data_dir, session_id).exists():
+        storage.to_chunked(data_dir, session_id, with_env=with_env, keep_npy=keep_npy)
+    pyramid.build(data_dir, session_id)
+    return before, _size(data_dir, session_id)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="convert saved .npy sessions to the compressed chunked format")
+    ap.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    ap.add_argument("--with-env", action="store_true", default=None,
+                    help="store the envelope too (default: only when it can't be recomputed from raw)")
+    ap.add_argument("--keep-npy", action="store_true", help="don't delete the .npy files afterwards")
+    ap.add_argument("--data-dir", type=Path, default=DATA_DIR)
+    args = ap.parse_args()
+
+    todo = [sid for sid in storage.session_ids(args.data_dir) if needs_migration(args.data_dir, sid)]
+    print(f"{len(todo)} sessions to convert in {args.data_dir}")
+    if not todo:
+        return
+
+    t0 = time.perf_counter()
+    total_before = total_after = 0
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_low_priority) as pool:
+        futures = {pool.submit(migrate_session, args.data_dir, sid, args.with_env, args.keep_npy): sid
+                   for sid in todo}
+        for k, fut in enumerate(as_completed(futures), 1):
+            sid = futures[fut]
+            try:
+                before, after = fut.result()
+            except Exception as e:
+                print(f"[{k}/{len(todo)}] {sid}: failed ({e})")
+                continue
+            total_before += before
+            total_after += after
+            print(f"[{k}/{len(todo)}] {sid}: {before / 1e6:.2f} MB -> {after / 1e6:.2f} MB ({after / before:.0%})")
+
+    if total_before:
+        print(f"done in {time.perf_counter() - t0:.2f} s: {total_before / 1e6:.2f} MB -> {total_after / 1e6:.2f} MB "
+              f"({total_after / total_before:.0%})")
+
+
+if __name__ == "__main__":
+    main()
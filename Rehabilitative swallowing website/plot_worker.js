@@ -0,0 +1,197 @@
+// live trace drawing for index.html. normally runs as a Web Worker on OffscreenCanvases (the page hands the
+// trace canvases over), browsers without OffscreenCanvas load this as a plain script and use the same Plotter
+// on the main thread. samples go into preallocated Float32Array rings straight from the binary frames
+// (frames.py), and the traces are redrawn at most once per animation frame, only when something new arrived.
+// the grid and tick labels live on a separate canvas underneath that the page draws once.
+const PAD_LEFT = 50;   // space for y-axis labels (same as the axes layer)
+const PAD_BOTTOM = 20;
+const HEADER_BYTES = 44;
+const STATS_MS = 1000;
+
+const nextFrame = self.requestAnimationFrame ? (f) => self.requestAnimationFrame(f) : (f) => setTimeout(f, 16);
+
+class Trace {
+  constructor(canvas, ymin, ymax, len) {
+    this.canvas = canvas;
+    this.ctx = canvas.getContext("2d");
+    this.ymin = ymin;
+    this.ymax = ymax;
+    this.resize(len);
+  }
+
+  resize(len) {
+    this.buf = new Float32Array(len);
+    this.w = 0;      // next write position
+    this.count = 0;  // valid samples, up to len
+  }
+
+  // channel 0 of a frame payload (rows of `stride` values), each row repeated `rep` times
+  // (decimated frames: a row stands for several samples)
+  push(src, stride, n, rep) {
+    const buf = this.buf, len = buf.length;
+    let w = this.w;
+    for (let i = 0; i < n; i++) {
+      const v = src[i * stride];
+      for (let r = 0; r < rep; r++) {
+        buf[w] = v;
+        if (++w === len) w = 0;
+      }
+    }
+    this.w = w;
+    this.count = Math.min(len, this.count + n * rep);
+  }
+
+  draw() {
+    const ctx = this.ctx, canvas = this.canvas, buf = this.buf, len = buf.length, n = this.count;
+    ctx.clearRect(0, 0, canvas.width, canvas.height);
+    if (n < 2) return;
+
+    const plotW = canvas.width - PAD_LEFT;
+    const plotH = canvas.height - PAD_BOTTOM;
+    const scale = plotH / (this.ymax - this.ymin);
+    const y0 = plotH + this.ymin * scale;  // y = y0 - v * scale
+    const first = (this.w - n + len) % len;
+
+    ctx.strokeStyle = "black";
+    ctx.beginPath();
+    if (n <= 2 * plotW) {
+      for (let i = 0; i < n; i++) {
+        let j = first + i;
+        if (j >= len) j -= len;
+        const x = PAD_LEFT + (i / (n - 1)) * plotW;
+        const y = y0 - buf[j] * scale;
+        if (i === 0) ctx.moveTo(x, y);
+        else ctx.lineTo(x, y);
+      }
+    } else {
+      // more samples than pixels: one vertical min..max stroke per pixel column, so bursts keep their height
+      for (let px = 0; px < plotW; px++) {
+        const a = Math.floor(px * n / plotW), b = Math.floor((px + 1) * n / plotW);
+        let lo = Infinity, hi = -Infinity;
+        for (let i = a; i < b; i++) {
+          let j = first + i;
+          if (j >= len) j -= len;
+          const v = buf[j];
+          if (v < lo) lo = v;
+          if (v > hi) hi = v;
+        }
+        const x = PAD_LEFT + px + 0.5;
+        if (px === 0) ctx.moveTo(x, y0 - hi * scale);
+        else ctx.lineTo(x, y0 - hi * scale);
+        ctx.lineTo(x, y0 - lo * scale);
+      }
+    }
+    ctx.stroke();
+  }
+}
+
+class Plotter {
+  // canvases: {raw, env}, ranges: {raw: [ymin, ymax], env: [...]}, post(msg) reports back to the page:
+  //   {type: "drawn", seq}  after the frame holding `seq` is on screen (the page acks it to the server)
+  //   {type: "stats", ...}  draw time / frame rate, and how far behind the board what's on screen is
+  //                         (board timestamp of the newest sample drawn vs now; same clock if the server is local)
+  constructor(canvases, ranges, len, post) {
+    this.traces = {
+      raw: new Trace(canvases.raw, ranges.raw[0], ranges.raw[1], len),
+      env: new Trace(canvases.env, ranges.env[0], ranges.env[1], len),
+    };
+    this.post = post;
+    this.scheduled = false;
+    this.seq = null;
+    this.tLast = NaN;  // board timestamp (unix s) of the newest sample received
+    this.statsT0 = performance.now();
+    this.draws = 0;
+    this.drawSum = 0;
+    this.drawMax = 0;
+    this.lagSum = 0;
+    this.lagMax = 0;
+    this.lagN = 0;
+  }
+
+  handle(m) {
+    if (m.type === "reset") {
+      this.traces.raw.resize(m.len);
+      this.traces.env.resize(m.len);
+      this.seq = null;
+      this.schedule();
+    } else if (m.type === "frame") {
+      this.frame(m.buf);
+    } else if (m.type === "rows") { // json fallback, already channel 0 only
+      if (m.raw) this.traces.raw.push(m.raw, 1, m.raw.length, m.rep);
+      if (m.env) this.traces.env.push(m.env, 1, m.env.length, m.rep);
+      this.seq = m.seq;
+      if (m.t1 !== undefined) this.tLast = m.t1;
+      this.schedule();
+    }
+  }
+
+  // binary data frame (frames.py): 44 byte header, then float32 raw and/or env, channels interleaved
+  frame(buf) {
+    const dv = new DataView(buf);
+    const nCh = dv.getUint16(2, true);
+    const seq = dv.getUint32(4, true);
+    const n = dv.getUint32(8, true);
+    const span = dv.getUint32(20, true); // samples covered, > n when decimated
+    const streams = dv.getUint8(24);     // 1 = raw, 2 = env (whatever we subscribed to)
+    const tLast = dv.getFloat64(36, true); // board time of the last sample, NaN if the board has none
+    const rep = Math.max(1, Math.round(span / n));
+    let off = HEADER_BYTES;
+    if (streams & 1) {
+      this.traces.raw.push(new Float32Array(buf, off, n * nCh), nCh, n, rep);
+      off += n * nCh * 4;
+    }
+    if (streams & 2) this.traces.env.push(new Float32Array(buf, off, n * nCh), nCh, n, rep);
+    this.seq = seq;
+    if (!Number.isNaN(tLast)) this.tLast = tLast;
+    this.schedule();
+  }
+
+  schedule() {
+    // however many frames arrive in between, we draw once per display refresh
+    if (this.scheduled) return;
+    this.scheduled = true;
+    nextFrame(() => this.render());
+  }
+
+  render() {
+    this.scheduled = false;
+    const t0 = performance.now();
+    this.traces.raw.draw();
+    this.traces.env.draw();
+    const t1 = performance.now();
+
+    const dt = t1 - t0;
+    this.draws++;
+    this.drawSum += dt;
+    if (dt > this.drawMax) this.drawMax = dt;
+    if (this.seq !== null) this.post({ type: "drawn", seq: this.seq });
+    if (!Number.isNaN(this.tLast)) {
+      const lag = Date.now() - this.tLast * 1000;
+      this.lagSum += lag;
+      this.lagN++;
+      if (lag > this.lagMax) this.lagMax = lag;
+    }
+
+    if (t1 - this.statsT0 >= STATS_MS) {
+      this.post({ type: "stats", drawMs: this.drawSum / this.draws, maxMs: this.drawMax,
+                  fps: this.draws * 1000 / (t1 - this.statsT0),
+                  lagMs: this.lagN ? this.lagSum / this.lagN : null, lagMaxMs: this.lagN ? this.lagMax : null });
+      this.statsT0 = t1;
+      this.draws = 0;
+      this.drawSum = 0;
+      this.drawMax = 0;
+      this.lagSum = 0;
+      this.lagMax = 0;
+      this.lagN = 0;
+    }
+  }
+}
+
+if (typeof WorkerGlobalScope !== "undefined" && self instanceof WorkerGlobalScope) {
+  let plotter = null;
+  self.onmessage = (ev) => {
+    const m = ev.data;
+    if (m.type === "init") plotter = new Plotter(m.canvases, m.ranges, m.len, (msg) => self.postMessage(msg));
+    else if (plotter) plotter.handle(m);
+  };
+}
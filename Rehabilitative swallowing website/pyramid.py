@@ -0,0 +1,136 @@
+# min/max mipmaps for saved sessions, so the viewer never has to scan every sample.
+# each level is (N / factor, 2, C): [:, 0] = min, [:, 1] = max, stored compressed like the sessions themselves
+# (chunked.py, rows of 2 * C) in data/pyr<factor>_<raw|env>_<id>.emgc. sessions from before that have float64
+# data/pyr<factor>_<raw|env>_<id>.npy files, which are still read; rebuilding replaces them
+# backfill existing sessions: python pyramid.py [--force]
+import sys
+from pathlib import Path
+
+import numpy as np
+
+import chunked
+import storage
+
+FACTORS = (4, 16, 64, 256)   # samples per bucket at each level
+STREAMS = ("raw", "env")
+BLOCK_ROWS = 1 << 16         # rows read per step while building
+
+
+def level_path(data_dir, session_id, stream, factor):
+    return Path(data_dir) / f"pyr{factor}_{stream}_{session_id}.emgc"
+
+
+def npy_level_path(data_dir, session_id, stream, factor):
+    return Path(data_dir) / f"pyr{factor}_{stream}_{session_id}.npy"
+
+
+def files(data_dir, session_id):
+    # every level file a session has, either format
+    paths = [p(data_dir, session_id, st, f) for p in (level_path, npy_level_path) for st in STREAMS for f in FACTORS]
+    return [p for p in paths if p.exists()]
+
+
+def read_level(data_dir, session_id, stream, factor, i0=0, i1=None):
+    # rows [i0, i1) of a level as a (k, 2, C) array, None if it hasn't been built
+    path = level_path(data_dir, session_id, stream, factor)
+    if path.exists():
+        lv = chunked.open_session(path).raw
+        return np.asarray(lv[i0:i1]).reshape(-1, 2, lv.shape[1] // 2)
+    path = npy_level_path(data_dir, session_id, stream, factor)
+    if path.exists():
+        return np.load(path, mmap_mode="r")[i0:i1]
+    return None
+
+
+def _reduce(lo, hi, k):
+    # min of lo / max of hi over groups of k rows (last group may be shorter)
+    n = lo.shape[0]
+    out = np.empty((-(-n // k), 2) + lo.shape[1:], dtype=np.float64)
+    for i in range(0, n, BLOCK_ROWS * k):
+        a, b = lo[i:i + BLOCK_ROWS * k], hi[i:i + BLOCK_ROWS * k]
+        starts = np.arange(0, a.shape[0], k)
+        j = i // k
+        out[j:j + len(starts), 0] = np.minimum.reduceat(a, starts, axis=0)
+        out[j:j + len(starts), 1] = np.maximum.reduceat(b, starts, axis=0)
+    return out
+
+
+def build(data_dir, session_id):
+    # each level is built from the one below it, so the raw file is only read once
+    arrays = storage.open_session(data_dir, session_id)
+    if arrays is None:
+        return False
+    for stream, full in zip(STREAMS, arrays):
+        lo = hi = full
+        prev = 1
+        for f in FACTORS:
+            level = _reduce(lo, hi, f // prev)
+            chunked.write(level_path(data_dir, session_id, stream, f), level.reshape(len(level), -1))
+            npy_level_path(data_dir, session_id, stream, f).unlink(missing_ok=True)
+            lo, hi = level[:, 0], level[:, 1]
+            prev = f
+    return True
+
+
+def remove(data_dir, session_id):
+    for path in files(data_dir, session_id):
+        path.unlink(missing_ok=True)
+
+
+def _combine(lv, points):
+    # (m, 2, C) level rows -> ~points interleaved min/max rows; returns (bucket offsets in level rows, values)
+    m, _, c = lv.shape
+    n_buckets = max(1, points // 2)
+    g = -(-m // n_buckets)
+    starts = np.arange(0, m, g)
+    lo = np.minimum.reduceat(lv[:, 0], starts, axis=0)
+    hi = np.maximum.reduceat(lv[:, 1], starts, axis=0)
+
+    y = np.empty((2 * len(starts), c), dtype=np.float64)
+    y[0::2] = lo
+    y[1::2] = hi
+    x = np.repeat(starts, 2)
+    x[1::2] = np.minimum(starts + g // 2, m - 1)
+    return x, y
+
+
+def reduce_window(data_dir, session_id, stream, full, s, e, points, chans=None):
+    # min/max view of samples [s, e) of a session stream with ~points rows.
+    # uses the coarsest level that still has >= points buckets in the window, so the cost is O(points)
+    # whatever the zoom; falls back to scanning `full` (memory-mapped (N, C)) when no level fits/exists.
+    # returns (x, y): x = absolute sample indices, y = (len(x), len(chans))
+    for f in reversed(FACTORS):
+        if (e - s) // f < points:
+            continue
+        i0, i1 = s // f, -(-e // f)
+        block = read_level(data_dir, session_id, stream, f, i0, i1)
+        if block is None:
+            continue
+        if chans is not None:
+            block = block[:, :, chans]
+        x, y = _combine(block, points)
+        return (x + i0) * f, y
+
+    w = full[s:e]
+    if chans is not None:
+        w = w[:, chans]
+    x, y = storage.minmax(w, points)
+    return x + s, y
+
+
+def main():
+    # backfill pyramids for every session already in data/
+    force = "--force" in sys.argv
+    data_dir = Path(__file__).parent / "data"
+    ids = storage.session_ids(data_dir)
+    for sid in ids:
+        done = all(level_path(data_dir, sid, st, f).exists() for st in STREAMS for f in FACTORS)
+        if done and not force:
+            print(f"{sid}: up to date")
+            continue
+        build(data_dir, sid)
+        print(f"{sid}: built")
+
+
+if __name__ == "__main__":
+    main()
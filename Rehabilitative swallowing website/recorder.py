@@ -0,0 +1,290 @@
+import json
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+from numpy.lib import format as npy_format
+
+DTYPE = np.dtype("<f8")  # same as the raw_/env_ files we already have
+
+
+class NpyAppender:
+    # .npy file that grows one chunk at a time. the header is written up front with 0 rows and
+    # rewritten in place on close (numpy pads the header so the row count can grow without moving data)
+    def __init__(self, path, n_channels):
+        self.path = Path(path)
+        self.n_channels = n_channels
+        self.rows = 0
+        self.f = open(self.path, "wb")
+        self._write_header()
+        self.data_offset = self.f.tell()
+
+    def _write_header(self):
+        header = {"descr": npy_format.dtype_to_descr(DTYPE), "fortran_order": False, "shape": (self.rows, self.n_channels)}
+        npy_format.write_array_header_1_0(self.f, header)
+
+    @classmethod
+    def reopen(cls, path):
+        # pick up a file whose writer died before close() (server killed mid-session):
+        # the row count comes from the file size, a half-written last row is cut off
+        self = cls.__new__(cls)
+        self.path = Path(path)
+        self.f = open(self.path, "r+b")
+        npy_format.read_magic(self.f)
+        shape, _, _ = npy_format.read_array_header_1_0(self.f)
+        self.data_offset = self.f.tell()
+        self.n_channels = shape[1]
+        row_bytes = self.n_channels * DTYPE.itemsize
+        size = self.f.seek(0, os.SEEK_END)
+        self.rows = (size - self.data_offset) // row_bytes
+        self.truncate(self.rows)
+        return self
+
+    def truncate(self, rows):
+        self.rows = min(self.rows, rows)
+        self.f.truncate(self.data_offset + self.rows * self.n_channels * DTYPE.itemsize)
+        self.f.seek(0, os.SEEK_END)
+
+    def append(self, block):
+        block = np.ascontiguousarray(block, dtype=DTYPE)
+        self.f.write(block.tobytes())
+        self.rows += block.shape[0]
+
+    def close(self):
+        if self.f.closed:
+            return
+        self.f.flush()
+        self.f.seek(0)
+        self._write_header()
+        if self.f.tell() != self.data_offset:  # should never happen, would corrupt the file
+            raise RuntimeError(f"npy header for {self.path.name} changed size")
+        self.f.close()
+
+
+class SessionRecorder:
+    # writes raw and envelope chunks to disk while streaming, so memory stays flat however long the session is.
+    # files live in data/pending/ until save() renames them to data/raw_<id>.npy and data/env_<id>.npy, with the
+    # board timestamp of every sample in data/ts_<id>.npy (N, 1) (nan where the board had none) and the samples as
+    # the board sent them, before any filtering, in data/board_<id>.npy (raw is the bandpassed signal).
+    # data/pending/<id>.json keeps what's needed to pick the session up again after a restart (recover())
+    def __init__(self, data_dir, session_id, n_channels, fs=None, device=None):
+        self.data_dir = Path(data_dir)
+        self.session_id = session_id
+        pending_dir = self.data_dir / "pending"
+        pending_dir.mkdir(parents=True, exist_ok=True)
+        self.raw = NpyAppender(pending_dir / f"raw_{session_id}.npy", n_channels)
+        self.env = NpyAppender(pending_dir / f"env_{session_id}.npy", n_channels)
+        self.times = NpyAppender(pending_dir / f"ts_{session_id}.npy", 1)
+        self.board = NpyAppender(pending_dir / f"board_{session_id}.npy", n_channels)
+
+        self.fs = fs
+        self.device = device      # id of the board it records (devices.py)
+        self.first_sample = None  # stream index of our first row
+        self.env_lead = None      # the envelope filter's last win - 1 rectified samples before it (chunked.py)
+        self.events = []          # completed swallow events, in session sample indices
+        self.gaps = []            # samples lost before row `start` (timing.py), in session sample indices
+        self.created = time.time()
+        self.ended = None         # when the stream stopped feeding us (None = still live)
+        self.recovered = False    # picked up from a previous run
+        self._write_state()
+
+    @property
+    def state_path(self):
+        return self.data_dir / "pending" / f"{self.session_id}.json"
+
+    def _write_state(self):
+        state = {"session_id": self.session_id, "n_channels": self.raw.n_channels, "fs": self.fs, "device": self.device,
+                 "created": self.created, "ended": self.ended, "first_sample": self.first_sample,
+                 "env_lead": self.env_lead,
+                 "events": self.events, "gaps": self.gaps}
+        tmp = self.state_path.with_suffix(".json.part")
+        tmp.write_text(json.dumps(state), encoding="utf-8")
+        os.replace(tmp, self.state_path)
+
+    @classmethod
+    def recover(cls, data_dir, session_id):
+        # a pending session left over from a previous run (saved state if it ended cleanly, else just the files)
+        self = cls.__new__(cls)
+        self.data_dir = Path(data_dir)
+        self.session_id = session_id
+        pending_dir = self.data_dir / "pending"
+        try:
+            state = json.loads(self.state_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            state = {}
+        self.raw = NpyAppender.reopen(pending_dir / f"raw_{session_id}.npy")
+        self.env = NpyAppender.reopen(pending_dir / f"env_{session_id}.npy")
+        ts_path = pending_dir / f"ts_{session_id}.npy"
+        self.times = NpyAppender.reopen(ts_path) if ts_path.exists() else None  # older pending sessions have none
+        board_path = pending_dir / f"board_{session_id}.npy"
+        self.board = NpyAppender.reopen(board_path) if board_path.exists() else None  # same
+        files = [f for f in (self.raw, self.env, self.times, self.board) if f is not None]
+        rows = min(f.rows for f in files)  # a crash can leave one a chunk ahead
+        for f in files:
+            f.truncate(rows)
+
+        self.fs = state.get("fs")
+        self.device = state.get("device")
+        self.first_sample = state.get("first_sample")
+        self.env_lead = state.get("env_lead")
+        self.events = state.get("events", [])
+        self.gaps = state.get("gaps", [])
+        self.created = state.get("created", self.raw.path.stat().st_mtime)
+        self.ended = state.get("ended") or self.raw.path.stat().st_mtime
+        self.recovered = True
+        self.close()
+        return self
+
+    @property
+    def duration(self):
+        return self.n_samples / self.fs if self.fs else None
+
+    def info(self):
+        return {"session_id": self.session_id, "device": self.device, "n_samples": self.n_samples, "duration": self.duration,
+                "bytes": self.nbytes, "live": self.ended is None, "created": self.created, "ended": self.ended,
+                "recovered": self.recovered, "events": len(self.events), "gaps": len(self.gaps),
+                "missing_samples": self.missing_samples}
+
+    @property
+    def n_samples(self):
+        return self.raw.rows
+
+    @property
+    def missing_samples(self):
+        return sum(g["missing"] for g in self.gaps)
+
+    @property
+    def nbytes(self):
+        # size of the pending files so far (the data itself is on disk, not in RAM)
+        rows = (self.raw.rows + self.env.rows + (self.board.rows if self.board is not None else 0)) * self.raw.n_channels
+        return (rows + (self.times.rows if self.times is not None else 0)) * DTYPE.itemsize
+
+    def _extra(self):
+        # files older pending sessions may not have
+        return [f for f in (self.times, self.board) if f is not None]
+
+    def append(self, raw, env, start=None, times=None, board=None, env_lead=None):
+        # board: the unfiltered samples raw was filtered from (nan if not given).
+        # env_lead: dsp.StreamingFilter.tail before this chunk, kept from the first one
+        if self.first_sample is None:
+            self.first_sample = start if start is not None else 0
+            self.env_lead = None if env_lead is None else np.asarray(env_lead).tolist()
+        self.raw.append(raw)
+        self.env.append(env)
+        if self.times is not None:
+            self.times.append(np.full((raw.shape[0], 1), np.nan) if times is None else np.reshape(times, (-1, 1)))
+        if self.board is not None:
+            self.board.append(np.full(raw.shape, np.nan) if board is None else board)
+
+    def add_events(self, events):
+        # keep finished events that started after the recording did
+        for ev in events:
+            if ev["kind"] != "offset" or self.first_sample is None or ev["onset"] < self.first_sample:
+                continue
+            out = {k: v for k, v in ev.items() if k != "kind"}
+            for k in ("onset", "offset", "peak_sample"):
+                out[k] -= self.first_sample
+            self.events.append(out)
+
+    def add_gaps(self, gaps):
+        # gaps in stream sample indices (stream.Acquisition), from the first row on
+        for g in gaps:
+            if self.first_sample is None or g["start"] < self.first_sample:
+                continue
+            self.gaps.append({**g, "start": g["start"] - self.first_sample})
+
+    def close(self):
+        # stream ended: finish the files and free the handles. save()/discard() still work afterwards
+        if self.ended is None:
+            self.ended = time.time()
+        self.raw.close()
+        self.env.close()
+        for f in self._extra():
+            f.close()
+        self._write_state()
+
+    def save(self):
+        self.raw.close()
+        self.env.close()
+        os.replace(self.raw.path, self.data_dir / f"raw_{self.session_id}.npy")
+        os.replace(self.env.path, self.data_dir / f"env_{self.session_id}.npy")
+        for f, prefix in ((self.times, "ts"), (self.board, "board")):
+            if f is not None:
+                f.close()
+                os.replace(f.path, self.data_dir / f"{prefix}_{self.session_id}.npy")
+        events_path = self.data_dir / f"events_{self.session_id}.json"
+        events_path.write_text(json.dumps(self.events, indent=2), encoding="utf-8")
+        self.state_path.unlink(missing_ok=True)
+
+    def discard(self):
+        self.raw.close()
+        self.env.close()
+        self.raw.path.unlink(missing_ok=True)
+        self.env.path.unlink(missing_ok=True)
+        for f in self._extra():
+            f.close()
+            f.path.unlink(missing_ok=True)
+        self.state_path.unlink(missing_ok=True)
+
+
+class PendingSessions:
+    # recordings waiting for save or discard, by session id. all on disk (data/pending/). sessions nobody saved
+    # expire after ttl_s, that's the only way one is dropped without being asked to: max_bytes is a warning
+    # level for the spool (over_budget), it never deletes a recording. recover() picks up what a previous run left behind
+    def __init__(self, data_dir, max_bytes=2 * 2**30, ttl_s=24 * 3600):
+        self.data_dir = Path(data_dir)
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self.sessions = {}
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def __contains__(self, session_id):
+        return session_id in self.sessions
+
+    def __setitem__(self, session_id, rec):
+        self.sessions[session_id] = rec
+
+    def get(self, session_id):
+        return self.sessions.get(session_id)
+
+    def pop(self, session_id, default=None):
+        return self.sessions.pop(session_id, default)
+
+    def values(self):
+        return list(self.sessions.values())
+
+    @property
+    def nbytes(self):
+        return sum(r.nbytes for r in self.sessions.values())
+
+    def recover(self):
+        # returns the ids picked up from data/pending/
+        found = []
+        pending_dir = self.data_dir / "pending"
+        for path in sorted(pending_dir.glob("raw_*.npy")):
+            sid = path.stem[len("raw_"):]
+            if sid in self.sessions:
+                continue
+            try:
+                self.sessions[sid] = SessionRecorder.recover(self.data_dir, sid)
+            except (OSError, ValueError) as e:
+                print(f"pending session {sid} could not be recovered: {e}")
+                continue
+            found.append(sid)
+        return found
+
+    @property
+    def over_budget(self):
+        return self.nbytes > self.max_bytes
+
+    def evict(self, now=None):
+        # drops finished recordings older than the TTL, returns their ids. live ones are never evicted
+        now = time.time() if now is None else now
+        evicted = [r for r in self.sessions.values() if r.ended is not None and now - r.ended > self.ttl_s]
+        for r in evicted:
+            self.sessions.pop(r.session_id, None)
+            r.discard()
+        return [r.session_id for r in evicted]
@@ -0,0 +1,112 @@
+# re-run the DSP chain over every saved session, e.g. after changing filter bands or the envelope window.
+# envelopes go to data/cache/<params hash>/env_<id>.npy, so reruns with the same parameters skip finished sessions.
+# sessions recorded with the board samples (storage.open_board) are filtered from those. older ones only kept the
+# signal after the 40-100 Hz bandpass, so for them this filters that again: bands outside it can't come back
+#   python reprocess.py --band 20 80 --env-ms 100 --workers 4
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import dsp
+import storage
+from catalog import DEFAULT_FS
+from recorder import NpyAppender
+
+DATA_DIR = Path(__file__).parent / "data"
+BLOCK_ROWS = 1 << 16
+
+
+def params_key(params):
+    # short stable hash of the filter parameters
+    blob = json.dumps(params, sort_keys=True).encode("utf-8")
+    return hashlib.sha1(blob).hexdigest()[:12]
+
+
+def cache_dir(data_dir, params):
+    return Path(data_dir) / "cache" / params_key(params)
+
+
+def is_done(data_dir, session_id, params):
+    out = cache_dir(data_dir, params) / f"env_{session_id}.npy"
+    src = storage.session_files(data_dir, session_id)
+    return out.exists() and all(out.stat().st_mtime >= p.stat().st_mtime for p in src)
+
+
+def process_session(data_dir, session_id, params):
+    # stream one session through a fresh StreamingFilter block by block; returns (samples processed, whether the input
+    # was already bandpassed)
+    raw = storage.open_board(data_dir, session_id)
+    prefiltered = raw is None
+    if prefiltered:
+        raw, _ = storage.open_session(data_dir, session_id)
+    fs = storage.read_meta(data_dir, session_id).get("fs", DEFAULT_FS)
+    filt = dsp.StreamingFilter(fs, raw.shape[1], band=tuple(params["band"]), notch=params["notch"],
+                               order=params["order"], env_ms=params["env_ms"])
+
+    out_dir = cache_dir(data_dir, params)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    tmp = out_dir / f"env_{session_id}.npy.part"
+    out = NpyAppender(tmp, raw.shape[1])
+    try:
+        for i in range(0, raw.shape[0], BLOCK_ROWS):
+            _, env = filt.process(raw[i:i + BLOCK_ROWS])
+            out.append(env)
+    finally:
+        out.close()
+    os.replace(tmp, out_dir / f"env_{session_id}.npy")  # only finished files get the real name
+    return raw.shape[0], prefiltered
+
+
+def main():
+    ap = argparse.ArgumentParser(description="reprocess saved sessions with new DSP parameters")
+    ap.add_argument("--band", nargs=2, type=float, default=list(dsp.BAND), metavar=("LO", "HI"))
+    ap.add_argument("--notch", type=float, default=dsp.NOTCH, help="power line frequency, 0 to disable")
+    ap.add_argument("--order", type=int, default=dsp.ORDER)
+    ap.add_argument("--env-ms", type=float, default=dsp.ENV_MS)
+    ap.add_argument("--workers", type=int, default=os.cpu_count())
+    ap.add_argument("--force", action="store_true", help="redo sessions that are already cached")
+    ap.add_argument("--data-dir", type=Path, default=DATA_DIR)
+    args = ap.parse_args()
+
+    params = {"band": args.band, "notch": args.notch or None, "order": args.order, "env_ms": args.env_ms}
+    out_dir = cache_dir(args.data_dir, params)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    (out_dir / "params.json").write_text(json.dumps(params, indent=2), encoding="utf-8")
+
+    ids = storage.session_ids(args.data_dir)
+    todo = [sid for sid in ids if args.force or not is_done(args.data_dir, sid, params)]
+    print(f"{len(ids)} sessions, {len(ids) - len(todo)} already cached in {out_dir}")
+    if not todo:
+        return
+
+    t0 = time.perf_counter()
+    total = 0
+    legacy = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(process_session, args.data_dir, sid, params): sid for sid in todo}
+        for k, fut in enumerate(as_completed(futures), 1):
+            sid = futures[fut]
+            try:
+                n, prefiltered = fut.result()
+            except Exception as e:
+                print(f"[{k}/{len(todo)}] {sid}: failed ({e})")
+                continue
+            total += n
+            legacy += prefiltered
+            dt = time.perf_counter() - t0
+            note = " (pre-filtered, no board samples)" if prefiltered else ""
+            print(f"[{k}/{len(todo)}] {sid}: {n} samples{note}  ({total / dt:,.0f} samples/s overall)")
+
+    dt = time.perf_counter() - t0
+    print(f"done: {total} samples in {dt:.2f} s ({total / dt:,.0f} samples/s)")
+    if legacy:
+        print(f"{legacy} session(s) only have the signal already bandpassed {dsp.BAND[0]:g}-{dsp.BAND[1]:g} Hz while "
+              f"recording: their envelopes are that signal filtered again, not the new band on the original samples")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,18 +5,34 @@ from datetime import datetime
 
 import numpy as np
 from fastapi import FastAPI, WebSocket, HTTPException, Body
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 
-from brainflow.board_shim import BoardShim, BrainFlowInputParams, BoardIds
-from brainflow.data_filter import DataFilter, FilterTypes, DetrendOperations, NoiseTypes, AggOperations
+from stream import serve_client
+from devices import Devices
+from recorder import SessionRecorder, PendingSessions
+import storage
+import pyramid
+from catalog import Catalog, DEFAULT_FS
+import frames
+from metrics import METRICS
+import backends
+import export
+import analytics
+import spectrogram
+import feedback
 
 # PARAMETERS
-BOARD_ID = BoardIds.GANGLION_BOARD.value
+# board: EMG_BACKEND=ganglion|ganglion_ble|synthetic|replay (see backends.py), ganglion on COM4 by default
+# several boards: EMG_DEVICES="left=ganglion:COM4,right=ganglion:COM5", served at /devices/<id>/ws (devices.py)
 WINDOW_SECONDS = 5          # for client display (client can choose too)
-CHUNK_SAMPLES = 20          # samples per websocket message (smaller = lower latency)
-SEND_INTERVAL_MS = 50       # how often to send (pacing)
-PORT = "COM4"
+CHUNK_SAMPLES = 20          # min samples per websocket message (smaller = lower latency)
+SEND_INTERVAL_MS = 50       # how often the board is polled (pacing)
+FILL_GAPS = True            # fill in short runs of lost samples (up to timing.FILL_MAX_S), longer ones are only counted
+PENDING_MAX_BYTES = 2 * 2**30   # unsaved recordings in data/pending/ above this get a warning (nothing is dropped)
+PENDING_TTL_S = 24 * 3600       # unsaved recordings older than this are dropped
+PENDING_SWEEP_S = 60
+SAVE_CHUNKED = True         # saved sessions become compressed data/session_<id>.emgc files (chunked.py)
 
 app = FastAPI()
 
@@ -27,135 +43,388 @@ app.mount("/static", StaticFiles(directory=str(SITE_DIR)), name="static")
 DATA_DIR = Path(__file__).parent / "data"
 DATA_DIR.mkdir(exist_ok=True)
 
-def init_board():
-    BoardShim.enable_dev_board_logger()
-    params = BrainFlowInputParams()
-    params.serial_port = PORT
-    board = BoardShim(BOARD_ID, params)
-
-    fs = BoardShim.get_sampling_rate(BOARD_ID)
-    channels = BoardShim.get_emg_channels(BOARD_ID)
-    if not channels: # if emg_channels is empty use exg channels
-        channels = BoardShim.get_exg_channels(BOARD_ID)
-
-    board.prepare_session()
-    board.start_stream(45000)
-
-    return board, fs, channels
-
-
-board, fs, channels = init_board()
-print("BOARD INIT OK")
+# sqlite index of saved sessions, built from data/ the first time (on startup, not at import)
+CATALOG_PATH = DATA_DIR / "sessions.db"
+catalog_is_new = not CATALOG_PATH.exists()
+catalog = Catalog(CATALOG_PATH)
+
+# nothing connects here: fs/channels come from the board descriptions, each device's acquisition task
+# opens its board in the background and keeps it open (see /ready)
+devices = Devices(backends.devices_from_env(), CHUNK_SAMPLES, SEND_INTERVAL_MS, FILL_GAPS)
+fs = devices.default.fs  # the default board's rate. saved sessions without an fs in their meta are DEFAULT_FS
+
+async def sweep_pending():
+    while True:
+        await asyncio.sleep(PENDING_SWEEP_S)
+        for sid in app.state.pending.evict():
+            print(f"pending session {sid} expired, discarded")
+        if app.state.pending.over_budget:
+            print(f"unsaved recordings take {app.state.pending.nbytes / 2**30:.2f} GB in data/pending/ "
+                  f"(over {PENDING_MAX_BYTES / 2**30:.2f} GB), save or discard them")
+
+@app.on_event("startup")
+async def startup_event():
+    # recordings waiting for save/discard, including ones left over from the last run
+    # (made here rather than at import so a changed DATA_DIR, e.g. the benchmark's, is picked up)
+    app.state.pending = PendingSessions(DATA_DIR, PENDING_MAX_BYTES, PENDING_TTL_S)
+    recovered = await asyncio.to_thread(app.state.pending.recover)
+    if recovered:
+        print(f"recovered {len(recovered)} unsaved session(s): {', '.join(recovered)}")
+    app.state.sweeper = asyncio.create_task(sweep_pending())
+    devices.start()
+    if catalog_is_new:
+        await asyncio.to_thread(catalog.rebuild, DATA_DIR)
+
+# gauges are read at scrape time
+METRICS.gauge("emg_board_up", lambda: {(("device", d.id),): int(d.acq.state == "streaming") for d in devices},
+              "1 while the board is streaming")
+METRICS.gauge("emg_client_queue_depth", lambda: {k: v for d in devices for k, v in d.acq.queue_depths().items()},
+              "messages waiting in each client's send queue")
+METRICS.gauge("emg_pending_sessions", lambda: len(app.state.pending), "recorded sessions not yet saved or discarded")
+METRICS.gauge("emg_pending_session_bytes", lambda: app.state.pending.nbytes,
+              "size of unsaved recordings (spooled to data/pending/)")
 
 @app.get("/")
 def root():
     html = (SITE_DIR / "index.html").read_text(encoding="utf-8")
     return HTMLResponse(html)
 
-app.state.pending = {}
-
 @app.websocket("/ws")
-async def ws(websocket: WebSocket):
+async def ws(websocket: WebSocket, format: str = "json"):
+    await stream_device(websocket, devices.default, format)
+
+@app.websocket("/devices/{device_id}/ws")
+async def ws_device(websocket: WebSocket, device_id: str, format: str = "json"):
+    device = devices.get(device_id)
+    if device is None:
+        await websocket.close(code=1008)  # unknown device
+        return
+    await stream_device(websocket, device, format)
+
+async def stream_device(websocket, device, format):
     await websocket.accept()
+    fmt = format if format in frames.FORMATS else "json"  # data frame format, see frames.py
+    acq = device.acq
 
     session_id = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
 
-    raw_log, env_log = [], []
-    app.state.pending[session_id] = (raw_log, env_log)
-
-    n_channels = len(channels)
-    await websocket.send_text(json.dumps({"type": "meta", "fs": fs, "channels": n_channels, "session_id": session_id}))
+    # chunks go straight to data/pending/ while streaming
+    n_channels = len(device.channels)
+    rec = SessionRecorder(DATA_DIR, session_id, n_channels, device.fs, device.id)
+    app.state.pending[session_id] = rec
 
-    roll_period = max(1, int(0.05 * fs))  # 50 ms window in samples
+    await websocket.send_text(json.dumps({"type": "meta", "fs": device.fs, "channels": n_channels, "session_id": session_id,
+                                          "format": fmt, "device": device.id, "board": acq.state,
+                                          "pending_full": app.state.pending.over_budget}))
 
-    # Continuous stream: always send the latest CHUNK_SAMPLES per channel
+    # every chunk read from the board from now on is recorded for this session and queued for this client
+    client = acq.subscribe(session_id, fmt)
+    acq.recordings[session_id] = rec
     try:
-        while True:
-            data = board.get_current_board_data(CHUNK_SAMPLES)  # shape: (rows, CHUNK_SAMPLES)
-
-            raw = np.stack([data[ch, :] for ch in channels], axis=1).astype(np.float64, copy=True)  # (chunk, C)
-
-            # Process per channel (from plottingV3.py)
-            env = np.empty_like(raw)
-            for ci in range(raw.shape[1]):
-                y = raw[:, ci].copy()
-
-                DataFilter.detrend(y, DetrendOperations.CONSTANT.value)
-                DataFilter.remove_environmental_noise(y, fs, NoiseTypes.SIXTY.value)
-                DataFilter.perform_bandpass(y, fs, 40.0, min(100.0, fs/2 - 1.0), 4, FilterTypes.BUTTERWORTH.value, 0)
-
-                raw[:, ci] = y
-                y_rect = np.abs(y)
-                DataFilter.perform_rolling_filter(y_rect, roll_period, AggOperations.MEAN.value)
-                env[:, ci] = y_rect
-
-            # store data
-            raw_log.append(raw.copy())
-            env_log.append(env.copy())
-
-            # await websocket.send_text(json.dumps({"type": "data", "y": y.tolist()}))
-            # send both raw and envelope
-            await websocket.send_text(json.dumps({"type": "data", "raw": raw.tolist(), "env": env.tolist()}))
-            await asyncio.sleep(SEND_INTERVAL_MS / 1000.0)
-
+        await serve_client(websocket, client)
     finally:
-        # client disconnected or server stop
-        # if raw_log: np.save(raw_path, np.concatenate(raw_log, axis=0))
-        # if env_log: np.save(env_path, np.concatenate(env_log, axis=0))
-        pass
+        # client disconnected or server stop. the files are finished and wait in data/pending/ for save/discard
+        await acq.detach(session_id)
+        acq.unsubscribe(client)
+        if session_id in app.state.pending:
+            rec.close()
 
 # options for data (saving, discarding, adding metadata)
 
 @app.post("/save/{session_id}")
-def save(session_id: str):
-    raw_log, env_log = app.state.pending.pop(session_id)
-    np.save(DATA_DIR / f"raw_{session_id}.npy", np.concatenate(raw_log, axis=0))
-    np.save(DATA_DIR / f"env_{session_id}.npy", np.concatenate(env_log, axis=0))
+async def save(session_id: str):
+    rec = app.state.pending.pop(session_id, None)
+    if rec is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    await devices.detach(session_id)  # in case the stream is still open
+    with METRICS.timer("emg_request_seconds", endpoint="save"):
+        rec.save()  # finalize + rename into data/
+        session_fs = rec.fs or DEFAULT_FS  # a session recovered from an older run keeps its own rate
+        fields = {"fs": session_fs, "channels": rec.raw.n_channels, "gaps": rec.gaps,
+                  "missing_samples": rec.missing_samples}
+        if rec.device is not None:
+            fields["device"] = rec.device
+        if rec.env_lead is not None:
+            fields["env_lead"] = rec.env_lead  # lets the compressed file recompute the envelope (chunked.py)
+        storage.update_meta(DATA_DIR, session_id, fields)
+        await asyncio.to_thread(pyramid.build, DATA_DIR, session_id)  # min/max levels for the viewer
+        await asyncio.to_thread(catalog.add, DATA_DIR, session_id, session_fs)
+        catalog.set_events(session_id, rec.events)
+        if SAVE_CHUNKED:
+            try:
+                await asyncio.to_thread(storage.to_chunked, DATA_DIR, session_id, session_fs)
+            except (ValueError, OSError) as e:  # the .npy files are still there and still work
+                print(e)
     return {"ok": True}
 
 @app.post("/discard/{session_id}")
-def discard(session_id: str):
-    app.state.pending.pop(session_id, None)
+async def discard(session_id: str):
+    # only unsaved recordings. a saved session stays in data/ and in the catalog (nothing here deletes its files)
+    rec = app.state.pending.pop(session_id, None)
+    if rec is None:
+        raise HTTPException(status_code=404, detail="No unsaved session with this id")
+    await devices.detach(session_id)
+    rec.discard()
     return {"ok": True}
 
+@app.get("/pending")
+def list_pending():
+    # unsaved recordings (live, finished, or recovered after a restart) that can still be saved or discarded
+    sessions = sorted((r.info() for r in app.state.pending.values()), key=lambda r: r["created"], reverse=True)
+    return {"sessions": sessions, "bytes": app.state.pending.nbytes,
+            "max_bytes": app.state.pending.max_bytes, "over_budget": app.state.pending.over_budget,
+            "ttl_s": app.state.pending.ttl_s}
+
 @app.post("/meta/{session_id}")
 def save_meta(session_id: str, meta: dict = Body(...)):
-    path = DATA_DIR / f"meta_{session_id}.json"
-    path.write_text(json.dumps(meta, indent=2), encoding="utf-8")
+    storage.update_meta(DATA_DIR, session_id, meta)
+    catalog.update_meta(session_id, meta)
     return {"ok": True}
 
 # previous sessions
 
 @app.get("/sessions")
-def list_sessions():
-    # returns newest first
-    ids = sorted(
-        [p.stem.replace("raw_", "") for p in DATA_DIR.glob("raw_*.npy")],
-        reverse=True
-    )
-    out = []
-    for sid in ids: # testing metadata for sessions
-        mpath = DATA_DIR / f"meta_{sid}.json"
-        meta = json.loads(mpath.read_text()) if mpath.exists() else {}
-        out.append({"id": sid, "label": meta.get("label", ""), "notes": meta.get("notes", "")})
-    return {"sessions": out}
+def list_sessions(q: str = "", sort: str = "id", order: str = "desc", limit: int = 100, offset: int = 0):
+    # newest first by default; q searches label and notes
+    try:
+        total, rows = catalog.query(q, sort, order, max(1, min(limit, 1000)), max(0, offset))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"sessions": rows, "total": total, "offset": offset, "limit": limit}
+
+@app.get("/session/{session_id}/events")
+def session_events(session_id: str, start: int = None, end: int = None):
+    # swallow events detected while recording; start/end in samples
+    return {"session_id": session_id, "events": catalog.events(session_id, start, end)}
+
+@app.get("/session/{session_id}/gaps")
+def session_gaps(session_id: str):
+    # samples lost while recording (timing.py): start = sample the gap comes before, filled = interpolated in
+    if storage.open_session(DATA_DIR, session_id) is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    meta = storage.read_meta(DATA_DIR, session_id)
+    gaps = meta.get("gaps", [])
+    return {"session_id": session_id, "gaps": gaps, "missing_samples": sum(g["missing"] for g in gaps),
+            "filled_samples": sum(g["missing"] for g in gaps if g["filled"]),
+            "timestamps": storage.open_times(DATA_DIR, session_id) is not None}
 
 @app.get("/session/{session_id}")
-def load_session(session_id: str, decim: int = 1):
-    raw_path = DATA_DIR / f"raw_{session_id}.npy"
-    env_path = DATA_DIR / f"env_{session_id}.npy"
-    if not raw_path.exists() or not env_path.exists():
+def load_session(session_id: str, start: float = None, end: float = None, unit: str = "s",
+                 channels: str = "", points: int = 4000):
+    # window [start, end) in seconds (unit=s) or samples (unit=samples), reduced to ~points rows per stream
+    arrays = storage.open_session(DATA_DIR, session_id)
+    if arrays is None:
         raise HTTPException(status_code=404, detail="Session not found")
+    raw, env = arrays   # memory-mapped, shape (N, C)
+    if unit not in ("s", "samples"):
+        raise HTTPException(status_code=400, detail="unit must be 's' or 'samples'")
 
-    raw = np.load(raw_path)   # shape (N, C)
-    env = np.load(env_path)
-
-    # optional downsample for faster browser rendering
-    decim = max(1, int(decim))
-    raw = raw[::decim]
-    env = env[::decim]
+    n_samples, n_channels = raw.shape
+    session_fs = storage.read_meta(DATA_DIR, session_id).get("fs", DEFAULT_FS)
+    try:
+        chans = storage.parse_channels(channels, n_channels)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    s, e = storage.window(n_samples, session_fs, start, end, unit)
+
+    # only the requested window is read, from the coarsest pyramid level that still has enough detail
+    points = max(2, int(points))
+    sel = chans if len(chans) != n_channels else None
+    with METRICS.timer("emg_request_seconds", endpoint="load"):
+        x, raw_y = pyramid.reduce_window(DATA_DIR, session_id, "raw", raw, s, e, points, sel)
+        _, env_y = pyramid.reduce_window(DATA_DIR, session_id, "env", env, s, e, points, sel)
+        # board time of the window's first/last sample, for lining sessions up (None for older sessions)
+        times = storage.open_times(DATA_DIR, session_id)
+        t = [float(times[i, 0]) for i in (s, e - 1)] if times is not None and e > s else [None, None]
+
+    return JSONResponse({
+        "session_id": session_id, "fs": session_fs, "n_samples": n_samples, "channels": chans,
+        "start": s, "end": e, "t_start": t[0] if t[0] == t[0] else None, "t_end": t[1] if t[1] == t[1] else None,
+        "x": x.tolist(), "raw": raw_y.tolist(), "env": env_y.tolist(),
+    })
+
+@app.get("/session/{session_id}/spectrogram")
+def session_spectrogram(session_id: str, start: float = None, end: float = None, unit: str = "s", channel: int = 0,
+                        fmin: float = 0.0, fmax: float = None, cols: int = 1024, nperseg: int = spectrogram.NPERSEG):
+    # power (dB) of one channel over the window [start, end), at most ~cols columns. built from cached tiles
+    # (spectrogram.py), column i covers samples start + i * step ... + frame
+    arrays = storage.open_session(DATA_DIR, session_id)
+    if arrays is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    if unit not in ("s", "samples"):
+        raise HTTPException(status_code=400, detail="unit must be 's' or 'samples'")
+    n_samples, n_channels = arrays[0].shape
+    if not 0 <= channel < n_channels:
+        raise HTTPException(status_code=400, detail=f"channel must be in 0..{n_channels - 1}")
+    if not 8 <= nperseg <= 4096:
+        raise HTTPException(status_code=400, detail="nperseg must be between 8 and 4096")
+    session_fs = storage.read_meta(DATA_DIR, session_id).get("fs", DEFAULT_FS)
+    s, e = storage.window(n_samples, session_fs, start, end, unit)
+    cols = min(max(16, int(cols)), spectrogram.MAX_COLS)
+
+    with METRICS.timer("emg_request_seconds", endpoint="spectrogram"):
+        level, c0, step, power = spectrogram.window(DATA_DIR, session_id, channel, s, max(e, s + 1), cols, nperseg,
+                                                    max(1, nperseg // 8))
+    f = spectrogram.freqs(session_fs, nperseg)
+    keep = (f >= fmin) & (f <= (fmax if fmax is not None else f[-1]))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        db = np.round(10 * np.log10(np.maximum(power[:, keep], 1e-12)), 1)
+    return JSONResponse({
+        "session_id": session_id, "fs": session_fs, "channel": channel, "level": level, "start": c0 * step,
+        "step": step, "frame": nperseg, "freqs": f[keep].tolist(),
+        "db": [[None if v != v else v for v in row] for row in db.tolist()],  # nan past the end -> null
+    })
+
+# swallow metrics (analytics.py), cached per session and parameter set
+
+def metric_params(channel, k_on, k_off, min_s, max_s):
+    return {"channel": channel, "k_on": k_on, "k_off": k_off, "min_s": min_s, "max_s": max_s}
+
+@app.get("/sessions/{session_id}/metrics")
+def session_metrics(session_id: str, channel: int = 0, k_on: float = 3.0, k_off: float = 1.5,
+                    min_s: float = 0.15, max_s: float = 5.0):
+    params = metric_params(channel, k_on, k_off, min_s, max_s)
+    try:
+        with METRICS.timer("emg_request_seconds", endpoint="metrics"):
+            out = analytics.session_metrics(DATA_DIR, session_id, params, DEFAULT_FS)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if out is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return out
+
+@app.get("/metrics/summary")
+def metrics_summary(ids: str = "", channel: int = 0, k_on: float = 3.0, k_off: float = 1.5,
+                    min_s: float = 0.15, max_s: float = 5.0):
+    # ids=a,b,c (every saved session if empty); sessions that aren't cached yet are computed in parallel
+    session_ids = [x.strip() for x in ids.split(",") if x.strip()] if ids else storage.session_ids(DATA_DIR)
+    params = metric_params(channel, k_on, k_off, min_s, max_s)
+    try:
+        with METRICS.timer("emg_request_seconds", endpoint="metrics_summary"):
+            out = analytics.summary(DATA_DIR, session_ids, params, DEFAULT_FS)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"sessions": out}
 
-    return JSONResponse({"session_id": session_id, "raw": raw.tolist(), "env": env.tolist()})
+@app.get("/export/{session_id}")
+def export_session(session_id: str, format: str = "csv"):
+    # whole session as csv, edf or parquet, streamed block by block (export.py)
+    try:
+        body = export.export(DATA_DIR, session_id, format, DEFAULT_FS)
+    except LookupError:
+        raise HTTPException(status_code=404, detail="Session not found")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    headers = {"Content-Disposition": f'attachment; filename="session_{session_id}.{format}"'}
+    return StreamingResponse(body, media_type=export.MEDIA_TYPES[format], headers=headers)
+
+# boards
+
+@app.get("/devices")
+def list_devices():
+    return {"devices": [d.info() for d in devices], "default": devices.default.id}
+
+@app.get("/devices/{device_id}")
+def device_info(device_id: str):
+    device = devices.get(device_id)
+    if device is None:
+        raise HTTPException(status_code=404, detail="Device not found")
+    return device.info()
+
+@app.get("/devices/{device_id}/ready")
+def device_ready(device_id: str):
+    device = devices.get(device_id)
+    if device is None:
+        raise HTTPException(status_code=404, detail="Device not found")
+    status = device.acq.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+# calibration and biofeedback (feedback.py). a calibration is stored per patient in data/calibration/ and is
+# switched on for a board right away; POST /devices/<id>/feedback?patient=... switches a stored one on later
+
+def get_device(device_id):
+    device = devices.get(device_id)
+    if device is None:
+        raise HTTPException(status_code=404, detail="Device not found")
+    return device
+
+@app.post("/devices/{device_id}/calibration/start")
+def calibration_start(device_id: str, patient: str):
+    # the patient now swallows as hard as they can, feedback.MIN_SWALLOWS times or more
+    device = get_device(device_id)
+    try:
+        device.acq.start_calibration(patient)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"ok": True, "patient": patient, "min_swallows": feedback.MIN_SWALLOWS}
+
+@app.post("/devices/{device_id}/calibration/finish")
+def calibration_finish(device_id: str, target: float = feedback.TARGET):
+    device = get_device(device_id)
+    if device.acq.calibrating is None:
+        raise HTTPException(status_code=400, detail="no calibration running")
+    if not 0 < target <= 1.5:
+        raise HTTPException(status_code=400, detail="target must be in (0, 1.5]")
+    try:
+        cal = device.acq.finish_calibration(target)
+    except ValueError as e:  # too few swallows, calibration carries on
+        raise HTTPException(status_code=400, detail=str(e))
+    feedback.save_calibration(DATA_DIR, cal)
+    return cal
+
+@app.get("/patients/{patient}/calibration")
+def patient_calibration(patient: str):
+    try:
+        cal = feedback.load_calibration(DATA_DIR, patient)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if cal is None:
+        raise HTTPException(status_code=404, detail="Patient not calibrated")
+    return cal
+
+@app.post("/devices/{device_id}/feedback")
+def set_feedback(device_id: str, patient: str = "", target: float = feedback.TARGET):
+    # feedback for a calibrated patient on this board, patient empty = off
+    device = get_device(device_id)
+    if not 0 < target <= 1.5:
+        raise HTTPException(status_code=400, detail="target must be in (0, 1.5]")
+    cal = None
+    if patient:
+        try:
+            cal = feedback.load_calibration(DATA_DIR, patient)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if cal is None:
+            raise HTTPException(status_code=404, detail="Patient not calibrated")
+    device.acq.set_feedback(cal, target)
+    return device.acq.feedback_status()
+
+@app.get("/devices/{device_id}/feedback")
+def feedback_status(device_id: str):
+    # who is calibrated/getting feedback on this board, and the measured feedback latency (p50/p95/max, late
+    # = over feedback.LATENCY_BUDGET_S) from sample to socket ("sent") and to the screen ("shown")
+    return get_device(device_id).acq.feedback_status()
+
+# probes. /health: the process is up (always 200). /ready: every board is streaming (503 until then)
+
+@app.get("/health")
+def health():
+    default = devices.default
+    return {"status": "ok", "backend": type(default.board).__name__, "board": default.acq.status(),
+            "devices": [d.info() for d in devices],
+            "clients": sum(len(d.acq.subscribers) for d in devices), "pending_sessions": len(app.state.pending)}
+
+@app.get("/ready")
+def ready():
+    status = devices.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+@app.get("/metrics")
+def metrics(format: str = "prometheus"):
+    # prometheus scrape endpoint; /metrics?format=json for a readable debug view
+    if format == "json":
+        return METRICS.snapshot()
+    return PlainTextResponse(METRICS.render(), media_type="text/plain; version=0.0.4")
 
 # troubleshooting
 @app.websocket("/ws_test")
@@ -166,10 +435,9 @@ async def ws_test(websocket: WebSocket):
     await websocket.send_text("ok")
 
 @app.on_event("shutdown")
-def shutdown_event():
-    try:
-        # if raw_log: np.save(raw_path, np.concatenate(raw_log, axis=0))
-        # if env_log: np.save(env_path, np.concatenate(env_log, axis=0))
-        board.stop_stream()
-    finally:
-        board.release_session()
+async def shutdown_event():
+    await devices.stop()
+    app.state.sweeper.cancel()
+    for rec in app.state.pending.values():
+        rec.close()  # finish the headers so the next start picks these up cleanly
+    spectrogram.shutdown()  # the tile workers
@@ -0,0 +1,238 @@
+# spectrogram tiles for the session viewer (server.py /session/<id>/spectrogram).
+# the STFT is cut into tiles of TILE_COLS columns. at zoom level 0 a column is one frame (nperseg samples,
+# hann window, every HOP samples); at level L a column is the mean power of 2**L level-0 frames, so zoomed-out
+# views still show short bursts. a view only needs the few tiles its window overlaps. tiles are cached in
+# data/cache/spectrogram/<params hash>/<id>/ and in memory (LRU), so panning and zooming back and forth read
+# finished tiles instead of redoing FFTs. missing tiles are computed in parallel, one process per tile (like
+# analytics.summary), which is what makes the first full-session view fast. the endpoint runs on fastapi's
+# threadpool: requests for the same cache dir take turns (the second one finds the first one's tiles), and all
+# requests share one process pool, so a few viewers opening sessions at once don't start a pool each.
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+import storage
+from reprocess import params_key
+
+TILE_COLS = 128
+NPERSEG = 64        # samples per frame (0.32 s at 200 Hz, 3 Hz bins)
+HOP = 8             # samples between level-0 frames
+BLOCK_FRAMES = 4096  # frames transformed at once
+MEMORY_TILES = 512  # tiles kept in memory (~8 MB at the default nperseg)
+MAX_COLS = 4096
+
+_memory = OrderedDict()  # (cache dir, tile name) -> (TILE_COLS, bins) float32 power
+_lock = threading.Lock()  # guards _memory, _dir_locks and _pool
+_dir_locks = {}           # cache dir -> lock held while a request checks, reads or fills that dir
+_pool = None              # shared ProcessPoolExecutor, made on the first cold request
+
+
+def cache_dir(data_dir, session_id, params):
+    return Path(data_dir) / "cache" / "spectrogram" / params_key(params) / session_id
+
+
+def invalidate(data_dir, session_id):
+    for path in (Path(data_dir) / "cache" / "spectrogram").glob(f"*/{session_id}"):
+        with _dir_lock(path):
+            shutil.rmtree(path, ignore_errors=True)
+    with _lock:
+        for key in [k for k in _memory if k[0].name == session_id]:
+            del _memory[key]
+
+
+def _dir_lock(d):
+    with _lock:
+        return _dir_locks.setdefault(d, threading.Lock())
+
+
+def _shared_pool():
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=os.cpu_count() or 1)
+        return _pool
+
+
+def shutdown():
+    # called on server shutdown
+    global _pool
+    with _lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(cancel_futures=True)
+
+
+def frame_power(x, nperseg, hop, n_frames):
+    # (n_frames, nperseg // 2 + 1) power of hann-windowed, mean-removed frames of a 1-d signal starting at x[0].
+    # frames that run past the end of x are nan
+    win = np.hanning(nperseg)
+    out = np.full((n_frames, nperseg // 2 + 1), np.nan)
+    full = max(0, min(n_frames, (len(x) - nperseg) // hop + 1))
+    for i in range(0, full, BLOCK_FRAMES):
+        k = min(BLOCK_FRAMES, full - i)
+        seg = x[i * hop:(i + k - 1) * hop + nperseg]
+        frames = np.lib.stride_tricks.sliding_window_view(seg, nperseg)[::hop]  # (k, nperseg), no copy
+        frames = (frames - frames.mean(axis=1, keepdims=True)) * win
+        out[i:i + k] = np.abs(np.fft.rfft(frames, axis=1)) ** 2 / (win @ win)
+    return out
+
+
+def compute_tile(data_dir, session_id, channel, level, index, nperseg=NPERSEG, hop=HOP):
+    # (TILE_COLS, bins) float32 mean power per column; nan past the end of the session
+    raw, _ = storage.open_session(data_dir, session_id)
+    per_col = 1 << level
+    f0 = index * TILE_COLS * per_col                  # first level-0 frame of the tile
+    n_frames = TILE_COLS * per_col
+    s = f0 * hop
+    x = np.asarray(raw[s:s + (n_frames - 1) * hop + nperseg, channel], dtype=np.float64)
+    bins = nperseg // 2 + 1
+    out = np.empty((TILE_COLS, bins), dtype=np.float32)
+    # in slices of whole columns, so a coarse tile never holds all its frames at once
+    cols_per = max(1, BLOCK_FRAMES // per_col)
+    for c in range(0, TILE_COLS, cols_per):
+        k = min(cols_per, TILE_COLS - c)
+        a = c * per_col * hop
+        p = frame_power(x[a:], nperseg, hop, k * per_col).reshape(k, per_col, bins)
+        valid = np.isfinite(p).sum(axis=1)
+        total = np.nansum(p, axis=1)
+        out[c:c + k] = np.where(valid > 0, total / np.maximum(valid, 1), np.nan)  # columns past the end: nan
+    return out
+
+
+def _source(data_dir, session_id):
+    return [[p.name, p.stat().st_mtime_ns, p.stat().st_size] for p in storage.session_files(data_dir, session_id)]
+
+
+def _check_source(data_dir, session_id, d):
+    # tiles of an older version of the session's files are thrown away (d holds one parameter set's tiles).
+    # called with d's lock held
+    stamp = d / "source.json"
+    source = _source(data_dir, session_id)
+    try:
+        if json.loads(stamp.read_text(encoding="utf-8")) == source:
+            return
+    except (OSError, ValueError):
+        pass
+    # only this parameter set: the others check their own stamp
+    shutil.rmtree(d, ignore_errors=True)
+    with _lock:
+        for key in [k for k in _memory if k[0] == d]:
+            del _memory[key]
+    d.mkdir(parents=True, exist_ok=True)
+    stamp.write_text(json.dumps(source), encoding="utf-8")
+
+
+def _remember(key, tile):
+    with _lock:
+        _memory[key] = tile
+        _memory.move_to_end(key)
+        while len(_memory) > MEMORY_TILES:
+            _memory.popitem(last=False)
+
+
+def _save(path, tile):
+    tmp = path.with_suffix(".part")
+    with open(tmp, "wb") as f:
+        np.save(f, tile)
+    os.replace(tmp, path)
+
+
+def tiles(data_dir, session_id, channel, level, indices, params, workers=None):
+    # {index: tile} from memory, disk, or computed (in parallel when more than one is missing).
+    # workers=1 computes them here, one after the other
+    d = cache_dir(data_dir, session_id, params)
+    with _dir_lock(d):
+        _check_source(data_dir, session_id, d)
+        out, missing = {}, []
+        for k in indices:
+            name = f"{channel}_{level}_{k}.npy"
+            with _lock:
+                hit = _memory.get((d, name))
+            if hit is None and (d / name).exists():
+                try:
+                    hit = np.load(d / name)
+                except (OSError, ValueError):
+                    hit = None
+            if hit is None:
+                missing.append(k)
+                continue
+            _remember((d, name), hit)
+            out[k] = hit
+
+        args = (data_dir, session_id, channel, level)
+        if len(missing) == 1 or workers == 1:
+            computed = [compute_tile(*args, k, params["nperseg"], params["hop"]) for k in missing]
+        elif missing:
+            n = len(missing)
+            computed = list(_shared_pool().map(compute_tile, *zip(*[args] * n), missing, [params["nperseg"]] * n,
+                                               [params["hop"]] * n))
+        else:
+            computed = []
+        for k, tile in zip(missing, computed):
+            name = f"{channel}_{level}_{k}.npy"
+            _save(d / name, tile)
+            _remember((d, name), tile)
+            out[k] = tile
+    return out
+
+
+def window(data_dir, session_id, channel, s, e, cols, nperseg=NPERSEG, hop=HOP, workers=None):
+    # spectrogram of samples [s, e) with at most ~cols columns: picks the finest level that fits, reads the tiles
+    # covering the window. returns (level, first column index, column spacing in samples, (cols, bins) power)
+    params = {"nperseg": nperseg, "hop": hop}
+    frames = max(1, -(-(e - s) // hop))
+    level = 0
+    while frames >> level > cols:
+        level += 1
+    col_samples = hop << level
+    c0 = s // col_samples
+    c1 = max(c0 + 1, -(-e // col_samples))
+    t0, t1 = c0 // TILE_COLS, (c1 - 1) // TILE_COLS
+    got = tiles(data_dir, session_id, channel, level, range(t0, t1 + 1), params, workers)
+    power = np.concatenate([got[k] for k in range(t0, t1 + 1)])[c0 - t0 * TILE_COLS:c1 - t0 * TILE_COLS]
+    return level, c0, col_samples, power
+
+
+def freqs(fs, nperseg=NPERSEG):
+    return np.fft.rfftfreq(nperseg, 1.0 / fs)
+
+
+if __name__ == "__main__":
+    # full-session view of a saved session: cold (computed in parallel, then one process for comparison) vs cached.
+    #   python spectrogram.py [id] [--data-dir DIR]
+    import argparse
+    import tempfile
+    import time
+
+    ap = argparse.ArgumentParser(description="time the spectrogram tiles of one session")
+    ap.add_argument("session", nargs="?")
+    ap.add_argument("--data-dir", type=Path, default=Path(__file__).parent / "data")
+    ap.add_argument("--cols", type=int, default=1024)
+    args = ap.parse_args()
+    sid = args.session or storage.session_ids(args.data_dir)[-1]
+    n = storage.open_session(args.data_dir, sid)[0].shape[0]
+
+    def run(data_dir, workers=None):
+        t0 = time.perf_counter()
+        window(data_dir, sid, 0, 0, n, args.cols, workers=workers)
+        return time.perf_counter() - t0
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # cache in a scratch dir so every run starts cold; the session files are linked, not copied
+        for p in storage.session_files(args.data_dir, sid) + list(args.data_dir.glob(f"meta_{sid}.json")):
+            os.symlink(p.resolve(), Path(tmp) / p.name)
+        cold = run(tmp)
+        _memory.clear()
+        disk = run(tmp)
+        warm = run(tmp)
+        invalidate(tmp, sid)
+        serial = run(tmp, workers=1)
+        shutdown()
+    print(f"{sid}: {n} samples, full view at {args.cols} columns: cold {cold * 1e3:.0f} ms ({os.cpu_count()} cores), "
+          f"one core {serial * 1e3:.0f} ms, from disk {disk * 1e3:.1f} ms, from memory {warm * 1e3:.1f} ms")
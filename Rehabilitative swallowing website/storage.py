@@ -0,0 +1,204 @@
+import json
+from pathlib import Path
+
+import numpy as np
+
+import chunked
+
+# reading saved sessions for the viewer. two formats: data/raw_<id>.npy + data/env_<id>.npy (float64), and
+# data/session_<id>.emgc (compressed chunks, see chunked.py; migrate.py converts the first into the second).
+# sessions recorded since the timestamps were kept also have the board time of every sample: data/ts_<id>.npy (N, 1)
+# or the container's "time" stream. "raw" is the bandpassed signal; newer sessions also keep the samples as the board
+# sent them (data/board_<id>.npy or the "board" stream), which is what reprocess.py re-filters
+
+
+def session_paths(data_dir, session_id):
+    data_dir = Path(data_dir)
+    return data_dir / f"raw_{session_id}.npy", data_dir / f"env_{session_id}.npy"
+
+
+def times_path(data_dir, session_id):
+    return Path(data_dir) / f"ts_{session_id}.npy"
+
+
+def board_path(data_dir, session_id):
+    return Path(data_dir) / f"board_{session_id}.npy"
+
+
+def chunked_path(data_dir, session_id):
+    return Path(data_dir) / f"session_{session_id}.emgc"
+
+
+def session_files(data_dir, session_id):
+    # the files a saved session is read from, whichever format it's in
+    path = chunked_path(data_dir, session_id)
+    if path.exists():
+        return [path]
+    return [p for p in (*session_paths(data_dir, session_id), times_path(data_dir, session_id),
+                        board_path(data_dir, session_id)) if p.exists()]
+
+
+def session_ids(data_dir):
+    # every saved session, in either format
+    data_dir = Path(data_dir)
+    ids = {p.stem.replace("raw_", "", 1) for p in data_dir.glob("raw_*.npy")}
+    ids.update(p.stem.replace("session_", "", 1) for p in data_dir.glob("session_*.emgc"))
+    return sorted(ids)
+
+
+def open_session(data_dir, session_id):
+    # (N, C) raw and envelope arrays, nothing is read until they are sliced: memory-mapped .npy files,
+    # or views that decode only the chunks a slice touches
+    path = chunked_path(data_dir, session_id)
+    if path.exists():
+        s = chunked.open_session(path)
+        return s.raw, s.env
+    raw_path, env_path = session_paths(data_dir, session_id)
+    if not raw_path.exists() or not env_path.exists():
+        return None
+    return np.load(raw_path, mmap_mode="r"), np.load(env_path, mmap_mode="r")
+
+
+def open_times(data_dir, session_id):
+    # (N, 1) board timestamps (unix s) of a saved session, read lazily like open_session; None for older sessions
+    path = chunked_path(data_dir, session_id)
+    if path.exists():
+        return chunked.open_session(path).times
+    path = times_path(data_dir, session_id)
+    return np.load(path, mmap_mode="r") if path.exists() else None
+
+
+def open_board(data_dir, session_id):
+    # (N, C) unfiltered board samples of a saved session, read lazily like open_session; None for sessions that only
+    # kept the filtered signal
+    path = chunked_path(data_dir, session_id)
+    if path.exists():
+        return chunked.open_session(path).board
+    path = board_path(data_dir, session_id)
+    return np.load(path, mmap_mode="r") if path.exists() else None
+
+
+def _matches(a, b, scale, offset=0.0, block_rows=1 << 16):
+    # b decodes to a: within the quantization step (q32d chunks) or float32 rounding (f32 chunks, relative to offset)
+    for i in range(0, a.shape[0], block_rows):
+        x, y = np.asarray(a[i:i + block_rows]) - offset, np.asarray(b[i:i + block_rows]) - offset
+        if not np.allclose(y, x, rtol=1e-6, atol=scale, equal_nan=True):
+            return False
+    return True
+
+
+def to_chunked(data_dir, session_id, fs=None, with_env=None, keep_npy=False):
+    # rewrite a raw_/env_(/ts_/board_) .npy session as session_<id>.emgc, check it reads back as the same samples, then
+    # delete the .npy files (unless keep_npy). with_env=None stores the envelope only if it can't be recomputed from raw
+    # (sessions recorded with other envelope settings). returns the new file's path, None if there's no .npy session
+    arrays = open_session(data_dir, session_id) if not chunked_path(data_dir, session_id).exists() else None
+    if arrays is None:
+        return None
+    raw, env = arrays
+    times = open_times(data_dir, session_id)
+    board = open_board(data_dir, session_id)
+    meta = read_meta(data_dir, session_id)
+    fs = fs or meta.get("fs")
+    lead = meta.get("env_lead")  # what the envelope started from when the recording joined the stream
+    path = chunked_path(data_dir, session_id)
+    tmp = path.with_name(path.name + ".check")
+    chunked.write(tmp, raw, env if with_env else None, fs, times=times, board=board, env_lead=lead)
+    s = chunked.open_session(tmp)
+    if with_env is None and not s.has_env and not _matches(env, s.env, chunked.RAW_SCALE):
+        chunked.write(tmp, raw, env, fs, times=times, board=board, env_lead=lead)
+        s = chunked.open_session(tmp)
+    ok = _matches(raw, s.raw, chunked.RAW_SCALE) and (not s.has_env or _matches(env, s.env, chunked.RAW_SCALE))
+    ok = ok and (times is None or _matches(times, s.times, chunked.TIME_SCALE, s.times.offset))
+    ok = ok and (board is None or _matches(board, s.board, chunked.RAW_SCALE))
+    # drop the memmaps first, windows can't replace or delete a file that's still mapped
+    del s, arrays, raw, env, times, board
+    if not ok:
+        tmp.unlink(missing_ok=True)
+        raise ValueError(f"{session_id}: chunked copy doesn't match the .npy files, kept the .npy files")
+    tmp.replace(path)
+    if not keep_npy:
+        for p in (*session_paths(data_dir, session_id), times_path(data_dir, session_id),
+                  board_path(data_dir, session_id)):
+            p.unlink(missing_ok=True)
+    return path
+
+
+def parse_channels(channels, n_channels):
+    # "0,2" -> [0, 2]; empty/None -> all channels
+    if not channels:
+        return list(range(n_channels))
+    out = [int(c) for c in str(channels).split(",") if c.strip() != ""]
+    if any(c < 0 or c >= n_channels for c in out):
+        raise ValueError(f"channels must be in 0..{n_channels - 1}")
+    return out
+
+
+def window(n_samples, fs, start=None, end=None, unit="s"):
+    # clamp a requested [start, end) window (seconds or samples) to sample indices
+    scale = fs if unit == "s" else 1
+    s = 0 if start is None else int(np.floor(start * scale))
+    e = n_samples if end is None else int(np.ceil(end * scale))
+    s = min(max(s, 0), n_samples)
+    e = min(max(e, s), n_samples)
+    return s, e
+
+
+def minmax(a, points):
+    # peak-preserving reduction of a (n, C) block to about `points` rows:
+    # split into points/2 buckets and keep each bucket's min and max in the order they occur,
+    # so a short swallow burst still shows up at full height (a plain [::decim] can skip it).
+    # returns (x, y): x are sample offsets into `a`, y is (len(x), C)
+    n, c = a.shape
+    if n <= points:
+        return np.arange(n), np.asarray(a, dtype=np.float64)
+
+    n_buckets = max(1, points // 2)
+    step = -(-n // n_buckets)  # ceil
+    n_full = n // step
+
+    parts = []
+    if n_full:
+        parts.append(a[:n_full * step].reshape(n_full, step, c))
+    if n_full * step < n:
+        parts.append(a[n_full * step:][None])  # shorter last bucket
+
+    lo, hi = [], []
+    for blocks in parts:
+        i_min = blocks.argmin(axis=1)
+        i_max = blocks.argmax(axis=1)
+        v_min = np.take_along_axis(blocks, i_min[:, None, :], axis=1)[:, 0]
+        v_max = np.take_along_axis(blocks, i_max[:, None, :], axis=1)[:, 0]
+        min_first = i_min <= i_max
+        lo.append(np.where(min_first, v_min, v_max))
+        hi.append(np.where(min_first, v_max, v_min))
+    lo = np.concatenate(lo)
+    hi = np.concatenate(hi)
+
+    y = np.empty((2 * len(lo), c), dtype=np.float64)
+    y[0::2] = lo
+    y[1::2] = hi
+    starts = np.arange(len(lo)) * step
+    x = np.empty(2 * len(lo), dtype=np.int64)
+    x[0::2] = starts
+    x[1::2] = np.minimum(starts + step // 2, n - 1)
+    return x, y
+
+
+def read_meta(data_dir, session_id):
+    path = Path(data_dir) / f"meta_{session_id}.json"
+    return json.loads(path.read_text(encoding="utf-8")) if path.exists() else {}
+
+
+def update_meta(data_dir, session_id, fields):
+    # merge into meta_<id>.json (save writes fs/channels, the notes box adds label/notes later)
+    meta = read_meta(data_dir, session_id)
+    meta.update(fields)
+    path = Path(data_dir) / f"meta_{session_id}.json"
+    path.write_text(json.dumps(meta, indent=2), encoding="utf-8")
+    return meta
+
+
+def read_events(data_dir, session_id):
+    # swallow events saved with the session (events_<id>.json), [] for older sessions
+    path = Path(data_dir) / f"events_{session_id}.json"
+    return json.loads(path.read_text(encoding="utf-8")) if path.exists() else []
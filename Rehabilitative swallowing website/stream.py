@@ -0,0 +1,620 @@
+import asyncio
+import json
+import time
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from dsp import StreamingFilter
+from detector import SwallowDetector
+from timing import GapTracker, FILL_MAX_S
+import feedback
+import frames
+import storage
+from metrics import METRICS
+
+
+REPORT_S = 1.0    # how often a client is told about a change in its display rate
+DRAIN_ALPHA = 0.2  # smoothing of the measured drain rate
+MAX_LAG_S = 0.25   # for clients that ack: data allowed in flight, in seconds of their drain rate
+SLOW_SEND_S = 0.005  # for clients that don't: sends slower than this count as the socket pushing back
+MODES = ("full", "coalesced", "decimated", "dropping")  # mildest to harshest
+STREAMS = ("raw", "env", "events", "feedback")
+
+RECONNECT_MIN_S = 0.5  # backoff between board (re)connect attempts, doubling up to RECONNECT_MAX_S
+RECONNECT_MAX_S = 30.0
+STALL_S = 5.0          # no samples for this long while streaming = the board dropped (BLE often just goes quiet)
+
+
+class Client:
+    # one websocket subscriber: its frame format, a bounded display queue and how fast it drains.
+    # queue items are (start, n_samples, message, (seq, raw, env, view key, (t_first, t_last)) for data / None for
+    # other messages).
+    # the drain rate comes from {"type": "ack", "seq": ...} messages if the page sends them (index.html does),
+    # otherwise from how long sends take, which only shows up once the socket buffers are full.
+    # what it gets is set by subscribe messages (see subscribe()), by default everything at full rate.
+    # feedback messages (feedback.py) skip the queue and the in-flight limit, only the newest one is kept
+    def __init__(self, name, fmt, queue_size, interval_s=0.05, n_channels=1, fs=200, latency=None):
+        self.name = name
+        self.fmt = fmt
+        self.n_channels = n_channels
+        self.fs = fs
+        self.channels = None         # column indices to send, None = all
+        self.streams = set(STREAMS)
+        self.rate = None             # target display rows per second, None = every sample
+        self.queue = deque()
+        self.queue_size = queue_size
+        self.feedback = deque(maxlen=1)  # (message, time of its newest sample), an older one is stale anyway
+        self.latency = latency           # feedback.Latency of the board
+        self.wake = asyncio.Event()
+        self.interval_s = interval_s  # a frame should go out in about this long
+        self.sent_to = 0    # stream index just past the last sample sent
+        self.dropped = 0    # samples dropped from the display queue
+        self.bytes_per_s = None  # measured drain rate
+
+        self.acks = False          # has the client acked anything yet
+        self.in_flight = deque()   # (seq, nbytes, time sent, bytes delivered when sent), not acked yet
+        self.in_flight_bytes = 0
+        self.delivered = 0         # bytes acked so far
+        self.acked = asyncio.Event()
+
+        self.mode = "full"           # what the client was last told
+        self._worst = "full"         # harshest mode used since the last report
+        self._reported_dropped = 0
+        self._window_t0 = time.perf_counter()
+
+    def subscribe(self, msg):
+        # {"type": "subscribe", "channels": [0], "streams": ["raw", "env", "events"], "rate": 100}
+        # any field left out keeps its current value; channels/rate null mean all channels/full rate.
+        # raises ValueError for anything malformed, the previous subscription stays in place then
+        channels, streams, rate = self.channels, self.streams, self.rate
+        if "channels" in msg:
+            channels = msg["channels"]
+            if channels is not None:
+                if not isinstance(channels, list) or not channels or \
+                        not all(isinstance(c, int) and not isinstance(c, bool) and 0 <= c < self.n_channels
+                                for c in channels):
+                    raise ValueError(f"channels must be a non-empty list of indices in 0..{self.n_channels - 1}")
+                channels = sorted(set(channels))
+                if len(channels) == self.n_channels:
+                    channels = None
+        if "streams" in msg:
+            streams = msg["streams"]
+            if not isinstance(streams, list) or not set(streams) <= set(STREAMS):
+                raise ValueError(f"streams must be a list drawn from {list(STREAMS)}")
+            streams = set(streams)
+        if "rate" in msg:
+            rate = msg["rate"]
+            if rate is not None:
+                if not isinstance(rate, (int, float)) or isinstance(rate, bool) or rate <= 0:
+                    raise ValueError("rate must be a positive number of rows per second")
+                if rate >= self.fs:
+                    rate = None
+        self.channels, self.streams, self.rate = channels, streams, rate
+        return json.dumps({"type": "subscribed", "channels": self.channels or list(range(self.n_channels)),
+                           "streams": [k for k in STREAMS if k in self.streams], "rate": self.rate or self.fs})
+
+    @property
+    def view_key(self):
+        # clients with the same key get byte-identical data frames, so those are encoded once per chunk
+        chans = tuple(self.channels) if self.channels is not None else None
+        return self.fmt, chans, "raw" in self.streams, "env" in self.streams, self.rate
+
+    def view(self, raw, env):
+        # the part of a chunk this client draws: its channels, its streams, at most its display rate
+        out = []
+        for name, a in (("raw", raw), ("env", env)):
+            if name not in self.streams:
+                out.append(None)
+                continue
+            if self.channels is not None:
+                a = a[:, self.channels]
+            if self.rate is not None:
+                _, a = storage.minmax(a, max(2, round(a.shape[0] * self.rate / self.fs)))
+            out.append(a)
+        return out
+
+    def put(self, item):
+        if len(self.queue) >= self.queue_size:
+            # slow client: drop its oldest data chunk instead of stalling everyone (events are tiny, keep those)
+            old = next((it for it in self.queue if it[3] is not None), self.queue[0])
+            self.queue.remove(old)
+            self.dropped += old[1]
+            METRICS.inc("emg_samples_dropped_total", old[1])
+        self.queue.append(item)
+        self.wake.set()
+
+    def put_feedback(self, msg, t):
+        self.feedback.append((msg, t))
+        self.wake.set()
+        self.acked.set()  # gets it past window() too
+
+    async def take(self):
+        # everything waiting, oldest first (waits for at least one item, or returns nothing when feedback came in)
+        while not self.queue and not self.feedback:
+            self.wake.clear()
+            await self.wake.wait()
+        items = list(self.queue)
+        self.queue.clear()
+        return items
+
+    @property
+    def blocked(self):
+        return self.acks and self.in_flight_bytes and self.in_flight_bytes > (self.bytes_per_s or 0) * MAX_LAG_S
+
+    async def window(self):
+        # clients that ack get at most MAX_LAG_S worth of data in flight. while we wait here their queue
+        # builds up and the next plan() merges/decimates it, instead of piling seconds of data into
+        # socket buffers. feedback waiting ends the wait, it doesn't count against the window
+        while self.blocked and not self.feedback:
+            self.acked.clear()
+            await self.acked.wait()
+
+    def plan(self, items):
+        # turn what's waiting into (start, n, message, seq) to send now. a single chunk goes out as the shared,
+        # already encoded frame. a backlog is merged into one frame, min/max decimated when the measured
+        # drain rate can't take it at full resolution within about one poll interval. the recording never
+        # sees any of this, it's display only
+        data = [it for it in items if it[3] is not None]
+        if data:
+            # chunks queued before a subscription change don't fit the new layout, skip those
+            data = [it for it in data if it[3][3] == data[-1][3][3]]
+        budget = self.bytes_per_s * self.interval_s if self.bytes_per_s is not None else None
+        out = []
+        mode = "full"
+        if len(data) == 1 and (budget is None or len(data[0][2]) <= budget):
+            start, n, msg, (seq, _, _, _, _) = data[0]
+            out.append((start, n, msg, seq))
+        elif data:
+            seq = data[-1][3][0]
+            start = data[0][0]
+            times = (data[0][3][4][0], data[-1][3][4][1])
+            n = sum(it[1] for it in data)  # stream samples covered
+            parts = [np.concatenate([it[3][k] for it in data]) if data[0][3][k] is not None else None
+                     for k in (1, 2)]
+            have = [a for a in parts if a is not None]
+            rows, c = have[0].shape
+            mode = "coalesced" if len(data) > 1 else "full"
+            size = frames.frame_bytes(self.fmt, rows, c, len(have))
+            if budget is not None and size > budget:
+                target = max(2, int(rows * budget / size))
+                if target < rows:
+                    parts = [storage.minmax(a, target)[1] if a is not None else None for a in parts]
+                    mode = "decimated"
+            out.append((start, n, frames.encode(self.fmt, seq, start, parts[0], parts[1], n, times), seq))
+        if data:
+            METRICS.inc("emg_frames_total", mode=mode)
+        out.extend((start, n, msg, None) for start, n, msg, payload in items if payload is None)
+
+        status = self._status(mode)
+        if status is not None:
+            out.insert(0, (None, 0, status, None))
+        return out
+
+    def _status(self, mode):
+        # "rate" message for the UI when the display rate changes (at most every REPORT_S)
+        if self.dropped > self._reported_dropped:
+            mode = "dropping"
+        if MODES.index(mode) > MODES.index(self._worst):
+            self._worst = mode
+        now = time.perf_counter()
+        if now - self._window_t0 < REPORT_S:
+            return None
+        worst, self._worst, self._window_t0 = self._worst, "full", now
+        self._reported_dropped = self.dropped
+        if worst == self.mode:
+            return None
+        self.mode = worst
+        return json.dumps({"type": "rate", "mode": worst, "reduced": worst in ("decimated", "dropping"),
+                           "dropped": self.dropped,
+                           "drain_bytes_per_s": round(self.bytes_per_s) if self.bytes_per_s else None})
+
+    def _rate(self, rate):
+        if self.bytes_per_s is None:
+            self.bytes_per_s = rate
+        else:
+            self.bytes_per_s += DRAIN_ALPHA * (rate - self.bytes_per_s)
+
+    def sent(self, seq, nbytes, seconds):
+        if seq is not None:
+            self.in_flight.append((seq, nbytes, time.perf_counter(), self.delivered))
+            self.in_flight_bytes += nbytes
+        # no acks: a send that had to wait for the socket is the best hint we get
+        # (quick ones only went into a buffer and say nothing about the client)
+        if not self.acks and seconds > SLOW_SEND_S:
+            self._rate(nbytes / seconds)
+
+    def ack(self, seq):
+        # delivery rate over each acked frame's flight time (bytes delivered meanwhile / time in flight)
+        if not self.acks:
+            self.acks = True
+            self.bytes_per_s = None  # forget the guess from send times
+        now = time.perf_counter()
+        while self.in_flight and self.in_flight[0][0] <= seq:
+            _, nbytes, t_sent, delivered_then = self.in_flight.popleft()
+            self.in_flight_bytes -= nbytes
+            self.delivered += nbytes
+            if now > t_sent:
+                self._rate((self.delivered - delivered_then) / (now - t_sent))
+        self.acked.set()
+
+
+class BoardError(Exception):
+    # a board call failed, the board is reopened. anything else failing while a chunk is processed is a bug
+    # and stops the acquisition loudly instead (Acquisition._stopped)
+    pass
+
+
+class Acquisition:
+    # one background reader per board. it drains the board's buffer (so every sample is read exactly once),
+    # filters each chunk once (filter state carries over between chunks) and fans the result out
+    # to any number of websocket clients.
+    # it also owns the board connection: the board is opened in the background (the server is up before it),
+    # and if it errors or goes quiet the session is torn down and reopened with backoff. clients and
+    # recordings stay attached the whole time, the outage is just a stretch with no samples.
+    # the blocking board calls, the filter/detector and the recordings' disk writes run on this board's own thread,
+    # so with several boards (devices.py) a slow or reconnecting one never holds up the others.
+    # package numbers and timestamps are checked for lost samples on the way in (timing.py): every gap is counted,
+    # reported to the clients and kept with the recordings, short ones are filled in when fill_gaps is on.
+    # the timestamps go out with every frame and into the recordings next to the samples.
+    # with a patient's calibration active (feedback.py) the board is polled every feedback.INTERVAL_MS and each read
+    # produces a feedback message; display frames are still put together chunk_samples at a time
+    def __init__(self, board, fs, channels, chunk_samples=20, interval_ms=50, queue_size=64, name="board",
+                 fill_gaps=True):
+        self.name = name
+        self.board = board
+        self.fs = fs
+        self.channels = list(channels)
+        self.chunk_samples = chunk_samples  # min samples per message
+        self.interval_ms = interval_ms      # how often the board is polled
+        self.queue_size = queue_size        # per-client backlog (~3 s at 20 msgs/s)
+
+        self.filt = StreamingFilter(fs, len(self.channels))
+        self.detector = SwallowDetector(fs)
+        self.gaps = GapTracker(fs, getattr(board, "package_period", None) or 256, FILL_MAX_S if fill_gaps else 0)
+        self.cursor = 0   # index of the next sample we will read from the board
+        self.seq = 0      # message counter
+        self.subscribers = {}  # name -> Client
+        self.recordings = {}  # session_id -> SessionRecorder, appended to for every chunk
+        self.calibrating = None  # feedback.Calibrator while a patient is being calibrated
+        self.feedback = None     # feedback.Feedback while a patient gets feedback
+        self.latency = feedback.Latency(name)
+        self._held = []          # reads not sent to the display yet, (start, raw, env, stamps)
+        self._task = None
+        self._thread = None   # single worker thread for this board
+
+        for counter in ("emg_samples_acquired_total", "emg_board_reconnects_total", "emg_gaps_total",
+                        "emg_samples_lost_total", "emg_samples_filled_total"):
+            METRICS.inc(counter, 0, device=name)  # show up as 0 before anything happens
+
+        self.state = "idle"       # idle, connecting, streaming, reconnecting, failed (see _stopped)
+        self.last_error = None
+        self.reconnects = 0
+        self.last_data = None     # time.time() of the last chunk
+        self._last_data_t = None  # same, perf_counter
+
+    def start(self):
+        if self._task is None:
+            self._thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"acq-{self.name}")
+            self._task = asyncio.create_task(self._run())
+            self._task.add_done_callback(self._stopped)
+
+    def _stopped(self, task):
+        # _run only returns by being cancelled (stop()) or on an error that isn't the board's
+        if task.cancelled() or task.exception() is None:
+            return
+        e = task.exception()
+        print(f"{self.name}: acquisition stopped by an error while processing data")
+        traceback.print_exception(type(e), e, e.__traceback__)
+        self._set_state("failed", f"processing failed: {e!r}")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            except Exception:
+                pass  # reported by _stopped
+            self._task = None
+            # let a read that's still running finish before the board gets closed
+            await asyncio.to_thread(self._thread.shutdown)
+            self._thread = None
+
+    def _in_thread(self, fn):
+        return asyncio.get_running_loop().run_in_executor(self._thread, fn)
+
+    def subscribe(self, name, fmt="json"):
+        client = Client(name, fmt, self.queue_size, self.interval_ms / 1000.0, len(self.channels), self.fs,
+                        self.latency)
+        self.subscribers[name] = client
+        return client
+
+    def unsubscribe(self, client):
+        self.subscribers.pop(client.name, None)
+
+    async def detach(self, session_id):
+        # stop feeding a recording. returns once a write to it that's already under way on the board's thread
+        # has finished (that thread runs one job at a time, so an empty job queued behind it is enough)
+        self.recordings.pop(session_id, None)
+        if self._thread is not None:
+            await self._in_thread(lambda: None)
+
+    def status(self):
+        # for /health and /ready
+        return {"state": self.state, "ready": self.state == "streaming", "last_error": self.last_error,
+                "reconnects": self.reconnects, "last_data": self.last_data, "samples": self.cursor,
+                "gaps": self.gaps.gaps, "missing_samples": self.gaps.missing, "filled_samples": self.gaps.filled}
+
+    def start_calibration(self, patient):
+        # from now on swallows count as maximal-effort swallows of this patient. feedback is off meanwhile,
+        # it would be measured against the old calibration
+        self.feedback = None
+        self.calibrating = feedback.Calibrator(patient, self.detector.channel, self.fs)
+
+    def finish_calibration(self, target=None):
+        # the patient's normalization, which is also switched on. ValueError (and calibration carries on)
+        # if there aren't enough swallows yet
+        cal = self.calibrating.finish()
+        self.calibrating = None
+        self.set_feedback(cal, target)
+        return cal
+
+    def set_feedback(self, cal, target=None):
+        # cal: a stored calibration, None switches feedback off
+        self.feedback = feedback.Feedback(cal, target) if cal is not None else None
+
+    def feedback_status(self):
+        cal = self.calibrating
+        return {"calibrating": {"patient": cal.patient, "swallows": len(cal.peaks)} if cal is not None else None,
+                "feedback": self.feedback.info() if self.feedback is not None else None,
+                "interval_ms": min(self.interval_ms, feedback.INTERVAL_MS) if self.feedback else self.interval_ms,
+                "latency": self.latency.summary()}
+
+    def _set_state(self, state, error=None):
+        if error is not None:
+            self.last_error = error
+        if state == self.state:
+            return
+        self.state = state
+        # let the pages know, e.g. to show "board reconnecting"
+        msg = json.dumps({"type": "board", "state": state, "error": self.last_error if state != "streaming" else None})
+        for client in self.subscribers.values():
+            client.put((None, 0, msg, None))
+
+    def _connect(self):
+        # runs on the board's thread, brainflow's prepare_session can block for seconds
+        if self.state == "reconnecting":
+            try:
+                self.board.stop()
+            except Exception:
+                pass  # the old session is usually half dead already
+        self.board.start()
+
+    async def _supervise(self):
+        # (re)open the board until it works, with exponential backoff
+        delay = RECONNECT_MIN_S
+        while True:
+            try:
+                await self._in_thread(self._connect)
+            except Exception as e:
+                self.last_error = f"connect failed: {e}"
+                print(f"{self.name}: {self.last_error}, retrying in {delay:.1f} s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RECONNECT_MAX_S)
+                continue
+            if self.state == "reconnecting":
+                self.reconnects += 1
+                METRICS.inc("emg_board_reconnects_total", device=self.name)
+                self.filt.reset()  # don't filter across the gap
+                self.gaps.reset()
+            self._last_data_t = time.perf_counter()
+            self._set_state("streaming")
+            print(f"BOARD INIT OK ({self.name})")
+            return
+
+    def _lost(self, reason):
+        print(f"{self.name}: {reason}, reconnecting")
+        self._set_state("reconnecting", reason)
+
+    def queue_depths(self):
+        # for the /metrics gauge
+        return {(("client", c.name), ("device", self.name)): len(c.queue) for c in self.subscribers.values()}
+
+    def _read(self):
+        # runs on the board's thread so the blocking brainflow calls stay off the event loop
+        # read once: the endpoints switch these from other threads while we work
+        fb, cal = self.feedback, self.calibrating
+        try:
+            n = self.board.get_board_data_count()
+            if n < (1 if fb is not None else self.chunk_samples):
+                return None
+            t0 = time.perf_counter()
+            data = self.board.get_board_data(n)  # removes the samples from brainflow's ring buffer
+        except Exception as e:
+            raise BoardError(e) from e
+        raw = np.ascontiguousarray(data[self.channels, :].T, dtype=np.float64)  # (chunk, C)
+        pkg_ch = getattr(self.board, "package_channel", None)
+        ts_ch = getattr(self.board, "timestamp_channel", None)
+        raw, stamps, gaps = self.gaps.process(raw, data[pkg_ch] if pkg_ch is not None else None,
+                                              data[ts_ch] if ts_ch is not None else None)
+        t1 = time.perf_counter()
+
+        start = self.cursor
+        self.cursor += raw.shape[0]
+        board = raw  # as the board sent it (gaps filled), kept with the recordings
+        lead = self.filt.tail  # what the envelope window holds before this chunk, for recordings starting here
+        raw, env = self.filt.process(raw)
+        t2 = time.perf_counter()
+        events = self.detector.process(env, start)
+        if cal is not None:
+            cal.add(events, self.detector.baseline)
+        if fb is not None:
+            # the newest sample's board timestamp is where the feedback latency is measured from
+            fb = fb.process(env, float(stamps[-1]) if np.isfinite(stamps[-1]) else time.time())
+        t3 = time.perf_counter()
+
+        METRICS.inc("emg_samples_acquired_total", raw.shape[0], device=self.name)
+        if np.isfinite(stamps[-1]):
+            # how long the newest sample sat in brainflow's buffer before we read it
+            METRICS.observe("emg_stage_seconds", time.time() - stamps[-1], stage="board_buffer")
+        gaps = [{"start": start + row, "missing": m, "filled": filled,
+                 "t": float(stamps[row]) if row < len(stamps) and np.isfinite(stamps[row]) else None}
+                for row, m, filled in gaps]
+        for g in gaps:
+            METRICS.inc("emg_gaps_total", device=self.name)
+            METRICS.inc("emg_samples_lost_total", g["missing"], device=self.name)
+            if g["filled"]:
+                METRICS.inc("emg_samples_filled_total", g["missing"], device=self.name)
+
+        # recordings are lossless, only the display queues (_publish) can drop
+        for rec in list(self.recordings.values()):
+            rec.append(raw, env, start, stamps, board, lead)
+            rec.add_events(events)
+            rec.add_gaps(gaps)
+        t4 = time.perf_counter()
+
+        METRICS.observe("emg_stage_seconds", t1 - t0, stage="board_read")
+        METRICS.observe("emg_stage_seconds", t2 - t1, stage="filter")
+        METRICS.observe("emg_stage_seconds", t3 - t2, stage="detect")
+        METRICS.observe("emg_stage_seconds", t4 - t3, stage="record")
+        return start, raw, env, events, stamps, gaps, fb
+
+    async def _run(self):
+        self._set_state("connecting")
+        while True:
+            if self.state != "streaming":
+                await self._supervise()
+            try:
+                chunk = await self._in_thread(self._read)
+            except BoardError as e:
+                self._lost(f"read failed: {e}")
+                continue
+            if chunk is not None:
+                self._last_data_t = time.perf_counter()
+                self.last_data = time.time()
+                self._publish(*chunk)
+            elif time.perf_counter() - self._last_data_t > STALL_S:
+                self._lost(f"no data for {STALL_S:.0f} s")
+                continue
+            interval = self.interval_ms if self.feedback is None else min(self.interval_ms, feedback.INTERVAL_MS)
+            await asyncio.sleep(interval / 1000.0)
+
+    def _publish(self, start, raw, env, events, stamps, gaps, fb=None):
+        t0 = time.perf_counter()
+
+        # feedback first, it goes out ahead of anything queued
+        if fb is not None:
+            msg = json.dumps(fb)
+            for client in self.subscribers.values():
+                if "feedback" in client.streams:
+                    client.put_feedback(msg, fb["t"])
+
+        # the display gets chunk_samples at a time, also when feedback has the board read in smaller pieces
+        self._held.append((start, raw, env, stamps))
+        if sum(h[1].shape[0] for h in self._held) >= self.chunk_samples:
+            held, self._held = self._held, []
+            if len(held) > 1:
+                start = held[0][0]
+                raw, env, stamps = (np.concatenate([h[k] for h in held]) for k in (1, 2, 3))
+            self._fan_out(start, raw, env, stamps)
+
+        # swallow events and gaps go out as their own (json) messages right after the chunk they were found in
+        # (or ahead of it, while it's held)
+        msgs = [json.dumps({"type": "gap", **g}) for g in gaps]
+        for ev in events:
+            METRICS.inc("emg_events_total", kind=ev["kind"], device=self.name)
+            msgs.append(json.dumps({"type": "event", **ev}))
+        for msg in msgs:
+            for client in self.subscribers.values():
+                if "events" in client.streams:
+                    client.put((None, 0, msg, None))
+
+        METRICS.observe("emg_stage_seconds", time.perf_counter() - t0, stage="publish")
+
+    def _fan_out(self, start, raw, env, stamps):
+        n = raw.shape[0]
+        times = (float(stamps[0]), float(stamps[-1]))
+
+        # each client only gets the channels/streams/rate it subscribed to. that's computed and serialized
+        # once per distinct subscription, clients asking for the same thing share the message
+        encoded = {}
+        for client in self.subscribers.values():
+            if "raw" not in client.streams and "env" not in client.streams:
+                continue
+            key = client.view_key
+            if key not in encoded:
+                te = time.perf_counter()
+                r, e = client.view(raw, env)
+                encoded[key] = (frames.encode(client.fmt, self.seq, start, r, e, n, times), (self.seq, r, e, key, times))
+                METRICS.observe("emg_stage_seconds", time.perf_counter() - te, stage=f"encode_{client.fmt}")
+            msg, payload = encoded[key]
+            client.put((start, n, msg, payload))
+        self.seq += 1
+
+
+async def serve_client(websocket, client):
+    # forward queued messages to one websocket until the client goes away.
+    # the receive side is watched too, so a disconnect is noticed even when no data is flowing
+    async def sender():
+        while True:
+            await client.window()
+            while client.feedback:
+                msg, t = client.feedback.popleft()
+                await websocket.send_text(msg)
+                client.latency.add("sent", t)
+                METRICS.inc("emg_messages_sent_total")
+            if client.blocked:
+                continue  # woken for the feedback only
+            for start, n, msg, seq in client.plan(await client.take()):
+                t0 = time.perf_counter()
+                if isinstance(msg, bytes):
+                    await websocket.send_bytes(msg)
+                else:
+                    await websocket.send_text(msg)
+                dt = time.perf_counter() - t0
+                client.sent(seq, len(msg), dt)
+                METRICS.observe("emg_stage_seconds", dt, stage="send")
+                METRICS.inc("emg_messages_sent_total")
+                if start is not None:
+                    if start < client.sent_to:
+                        METRICS.inc("emg_samples_duplicated_total", min(n, client.sent_to - start))
+                    client.sent_to = max(client.sent_to, start + n)
+                    METRICS.inc("emg_samples_sent_total", n)
+
+    async def receiver():
+        while True:
+            m = await websocket.receive()
+            if m["type"] == "websocket.disconnect":
+                return
+            try:
+                msg = json.loads(m.get("text") or "")
+            except ValueError:
+                continue
+            if not isinstance(msg, dict):
+                continue
+            if msg.get("type") == "ack" and isinstance(msg.get("seq"), int):
+                client.ack(msg["seq"])
+            elif msg.get("type") == "feedback_ack" and isinstance(msg.get("t"), (int, float)):
+                # the page shows a feedback message and echoes its "t" back
+                client.latency.add("shown", msg["t"])
+            elif msg.get("type") == "subscribe":
+                try:
+                    reply = client.subscribe(msg)
+                except ValueError as e:
+                    reply = json.dumps({"type": "error", "detail": str(e)})
+                client.put((None, 0, reply, None))
+
+    tasks = [asyncio.create_task(sender()), asyncio.create_task(receiver())]
+    for t in tasks:
+        # errors here just mean the socket closed, don't let asyncio log them as unretrieved
+        t.add_done_callback(lambda t: t.cancelled() or t.exception())
+    try:
+        # either side ending (disconnect, or a send failing on a closed socket) ends the client
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for t in tasks:
+            t.cancel()
@@ -0,0 +1,95 @@
+# .emgc files (chunked.py): what goes in comes back out within the quantization step, for every stream and
+# both codecs, and the envelope recomputed on read matches the live filter's, lead-in included
+#   python -m pytest tests
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import chunked  # noqa: E402
+import dsp  # noqa: E402
+
+CODECS = ["zlib", pytest.param("zstd", marks=pytest.mark.skipif(chunked.zstandard is None,
+                                                                   reason="zstandard not installed"))]
+
+
+def emg(n, n_channels, seed=0):
+    # bandpassed-looking signal, a few hundred uV
+    rng = np.random.default_rng(seed)
+    return rng.normal(0, 30, (n, n_channels)) * (1 + np.sin(np.arange(n) / 50.0))[:, None]
+
+
+@pytest.mark.parametrize("codec", CODECS)
+def test_roundtrip_all_streams(tmp_path, codec):
+    n, c = 1050, 3  # several chunks, the last one short
+    raw, env, board = emg(n, c), np.abs(emg(n, c, 1)), 800.0 + emg(n, c, 2)
+    times = (1.7e9 + np.arange(n) / 200.0)[:, None]
+    path = chunked.write(tmp_path / "s.emgc", raw, env, 200, chunk_rows=100, codec=codec, times=times, board=board)
+    s = chunked.open_session(path)
+    assert s.meta["codec"] == codec and s.has_env
+    assert s.raw.shape == s.env.shape == s.board.shape == (n, c) and s.times.shape == (n, 1)
+    for a, b in ((raw, s.raw), (env, s.env), (board, s.board)):
+        assert np.max(np.abs(np.asarray(b) - a)) <= chunked.RAW_SCALE / 2 + 1e-9
+    assert np.max(np.abs(np.asarray(s.times) - times)) <= chunked.TIME_SCALE / 2 + 1e-6
+    assert {enc for _, _, enc in s.raw.chunks} == {"q32d"}
+
+
+def test_f32_fallback(tmp_path):
+    # values that don't fit int32 at the scale are stored as float32
+    raw = emg(300, 2)
+    raw[150:] *= 1e6
+    s = chunked.open_session(chunked.write(tmp_path / "s.emgc", raw, np.abs(raw), 200, chunk_rows=100))
+    assert [enc for _, _, enc in s.raw.chunks] == ["q32d", "f32", "f32"]
+    assert np.allclose(np.asarray(s.raw), raw, rtol=1e-6, atol=chunked.RAW_SCALE)
+
+
+def test_nan_chunk_roundtrip():
+    block = np.array([[1.0, np.nan], [2.0, 3.0]])
+    blob, enc = chunked.encode_chunk(block, chunked.RAW_SCALE, "zlib")
+    assert enc == "f32"
+    out = chunked.decode_chunk(blob, enc, 2, 2, chunked.RAW_SCALE, "zlib")
+    assert np.array_equal(out, block, equal_nan=True)
+
+
+def test_indexing_like_numpy(tmp_path):
+    raw = emg(500, 4)
+    s = chunked.open_session(chunked.write(tmp_path / "s.emgc", raw, None, 200, chunk_rows=64))
+    q = np.round(raw / chunked.RAW_SCALE) * chunked.RAW_SCALE  # what the file holds
+    idx = np.array([499, 3, 70, 64, 63, 300])
+    for key in (slice(60, 130), (slice(60, 130), [0, 2]), (slice(None), 1), 65, -1, idx, (idx, 3),
+                slice(10, 400, 7), slice(200, 100)):
+        assert np.allclose(s.raw[key], q[key], atol=1e-9)
+    with pytest.raises(IndexError):
+        s.raw[500]
+
+
+@pytest.mark.parametrize("fs", [200, 250])
+def test_envelope_on_read_with_lead(tmp_path, fs):
+    # a recording that joins the stream partway: its first envelope rows also average samples from before it
+    raw = 800.0 + emg(20 * fs, 2)
+    filt = dsp.StreamingFilter(fs, 2)
+    k = 3 * fs + 17
+    filt.process(raw[:k])
+    lead = filt.tail.copy()
+    y, env = filt.process(raw[k:])
+
+    s = chunked.open_session(chunked.write(tmp_path / "s.emgc", y, None, fs, chunk_rows=500, env_lead=lead))
+    assert not s.has_env
+    assert np.max(np.abs(np.asarray(s.env) - env)) < chunked.RAW_SCALE
+    assert np.max(np.abs(s.env[1000:1600, 1] - env[1000:1600, 1])) < chunked.RAW_SCALE
+
+    # without the lead-in only the first win - 1 rows are off
+    s = chunked.open_session(chunked.write(tmp_path / "t.emgc", y, None, fs, chunk_rows=500))
+    win = dsp.env_window(fs)
+    diff = np.max(np.abs(np.asarray(s.env) - env), axis=1)
+    assert diff[:win - 1].max() > 1.0 and diff[win - 1:].max() < chunked.RAW_SCALE
+
+
+def test_incomplete_file(tmp_path):
+    path = chunked.write(tmp_path / "s.emgc", emg(100, 2), None, 200)
+    path.write_bytes(path.read_bytes()[:-4])
+    with pytest.raises(ValueError):
+        chunked.open_session(path)
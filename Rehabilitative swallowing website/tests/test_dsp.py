@@ -0,0 +1,73 @@
+# streaming filter vs offline(): ragged chunks of a multi-channel recording have to give the same
+# filtered signal and envelope as filtering the whole recording at once
+#   python -m pytest tests
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from dsp import StreamingFilter, env_window, offline  # noqa: E402
+
+
+def recording(fs, n_channels, seconds=30, seed=0):
+    # electrode offset + noise + power line hum, a different offset per channel
+    rng = np.random.default_rng(seed)
+    t = np.arange(seconds * fs) / fs
+    offset = 800.0 + 100.0 * np.arange(n_channels)
+    return offset + rng.normal(0, 20, (t.size, n_channels)) + 50 * np.sin(2 * np.pi * 60 * t)[:, None]
+
+
+def stream(filt, raw, sizes):
+    ys, envs, i = [], [], 0
+    for n in sizes:
+        y, env = filt.process(raw[i:i + n])
+        assert y.shape == env.shape == (len(raw[i:i + n]), raw.shape[1])
+        ys.append(y)
+        envs.append(env)
+        i += n
+    assert i >= len(raw)
+    return np.concatenate(ys), np.concatenate(envs)
+
+
+def ragged(n, seed=1, largest=40):
+    rng = np.random.default_rng(seed)
+    sizes, total = [], 0
+    while total < n:
+        sizes.append(int(rng.integers(1, largest)))
+        total += sizes[-1]
+    return sizes
+
+
+@pytest.mark.parametrize("fs,n_channels", [(200, 1), (200, 4), (250, 16)])
+def test_ragged_chunks_match_offline(fs, n_channels):
+    raw = recording(fs, n_channels)
+    y, env = stream(StreamingFilter(fs, n_channels), raw, ragged(len(raw)))
+    y_ref, env_ref = offline(raw, fs)
+    assert np.max(np.abs(y - y_ref)) < 1e-6
+    assert np.max(np.abs(env - env_ref)) < 1e-6
+
+
+def test_empty_and_single_sample_chunks():
+    fs = 200
+    raw = recording(fs, 4, seconds=2)
+    sizes = [0, 1, 1, 0, env_window(fs) - 1, 1, 0] + ragged(len(raw), largest=5)
+    y, env = stream(StreamingFilter(fs, 4), raw, sizes)
+    y_ref, env_ref = offline(raw, fs)
+    assert np.max(np.abs(y - y_ref)) < 1e-6
+    assert np.max(np.abs(env - env_ref)) < 1e-6
+
+
+def test_one_block_and_reset():
+    # the whole recording as one block, then the same again after reset(): no state left over
+    fs = 200
+    raw = recording(fs, 4, seconds=5)
+    filt = StreamingFilter(fs, 4)
+    y_ref, env_ref = offline(raw, fs)
+    for _ in range(2):
+        y, env = filt.process(raw)
+        assert np.max(np.abs(y - y_ref)) < 1e-6
+        assert np.max(np.abs(env - env_ref)) < 1e-6
+        filt.reset()
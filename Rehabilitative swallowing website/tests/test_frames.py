@@ -0,0 +1,60 @@
+# websocket frames (frames.py): binary frames decode to what was encoded, whichever streams the client asked for
+#   python -m pytest tests
+import json
+import math
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import frames  # noqa: E402
+
+
+def block(n, c, seed=0):
+    return np.random.default_rng(seed).normal(0, 50, (n, c))
+
+
+def test_header_size():
+    # the page views the payloads as Float32Array straight after the header
+    assert frames.HEADER.size == 44
+
+
+@pytest.mark.parametrize("streams", ["both", "raw", "env"])
+def test_binary_roundtrip(streams):
+    raw, env = block(20, 3), np.abs(block(20, 3, 1))
+    raw_in = raw if streams != "env" else None
+    env_in = env if streams != "raw" else None
+    buf = frames.encode_binary(7, 123456789012, raw_in, env_in, span=80, times=(1.7e9, 1.7e9 + 0.4))
+    assert len(buf) == frames.frame_bytes("binary", 20, 3, 2 if streams == "both" else 1)
+    seq, start, r, e, span, times = frames.decode_binary(buf)
+    assert (seq, start, span, times) == (7, 123456789012, 80, (1.7e9, 1.7e9 + 0.4))
+    for got, want in ((r, raw_in), (e, env_in)):
+        if want is None:
+            assert got is None
+        else:
+            assert np.array_equal(got, want.astype(np.float32))
+
+
+def test_binary_defaults():
+    # seq wraps at 32 bits, span defaults to the row count, no timestamps -> nan
+    seq, _, r, _, span, times = frames.decode_binary(frames.encode_binary(2**32 + 5, 0, block(4, 2), None))
+    assert seq == 5 and span == 4 and r.shape == (4, 2)
+    assert all(math.isnan(t) for t in times)
+
+
+def test_bad_version():
+    buf = bytearray(frames.encode_binary(1, 0, block(2, 2), None))
+    buf[0] = frames.VERSION + 1
+    with pytest.raises(ValueError):
+        frames.decode_binary(bytes(buf))
+
+
+def test_json():
+    raw = block(3, 2)
+    msg = json.loads(frames.encode("json", 3, 10, raw, None, span=12, times=(1.0, 2.0)))
+    assert msg == {"type": "data", "seq": 3, "start": 10, "t0": 1.0, "t1": 2.0, "raw": raw.tolist(), "span": 12}
+    msg = json.loads(frames.encode("json", 3, 10, None, raw, times=(float("nan"),) * 2))
+    assert "t0" not in msg and "span" not in msg and msg["env"] == raw.tolist()
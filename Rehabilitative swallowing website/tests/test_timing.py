@@ -0,0 +1,108 @@
+# timing.GapTracker: lost packages and pauses found from the package numbers and timestamps, short gaps filled in,
+# across chunk boundaries, package number wraps and reconnects
+#   python -m pytest tests
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from timing import GapTracker  # noqa: E402
+
+FS = 200
+
+
+def board(n, per_package=1, period=256, t0=1.7e9):
+    # n rows as brainflow hands them over: values, package numbers (wrapping), host timestamps
+    rows = np.arange(n)
+    raw = np.column_stack([rows, -rows]).astype(np.float64)
+    return raw, (rows // per_package) % period, t0 + rows / FS
+
+
+def feed(tracker, raw, packages, stamps, sizes):
+    outs, gaps, i, start = [], [], 0, 0
+    for n in sizes:
+        r, t, g = tracker.process(raw[i:i + n], packages[i:i + n], stamps[i:i + n])
+        gaps += [(start + row, m, f) for row, m, f in g]
+        outs.append((r, t))
+        start += len(r)
+        i += n
+    return np.concatenate([r for r, _ in outs]), np.concatenate([t for _, t in outs]), gaps
+
+
+def test_no_gaps_across_chunks_and_wraps():
+    raw, pk, ts = board(1000)
+    tracker = GapTracker(FS)
+    r, t, gaps = feed(tracker, raw, pk, ts, [7, 300, 1, 256, 436])
+    assert gaps == [] and tracker.missing == 0
+    assert np.array_equal(r, raw) and np.array_equal(t, ts)
+
+
+def test_short_gap_filled():
+    raw, pk, ts = board(400)
+    keep = np.r_[0:150, 155:400]  # 5 samples lost
+    tracker = GapTracker(FS)
+    r, t, gaps = feed(tracker, raw[keep], pk[keep], ts[keep], [100, 100, 195])
+    assert gaps == [(150, 5, True)]
+    assert (tracker.gaps, tracker.missing, tracker.filled) == (1, 5, 5)
+    # linear between the rows around the gap, which here is exactly what was lost
+    assert np.allclose(r, raw) and np.allclose(t, ts)
+
+
+def test_gap_at_chunk_boundary_filled_from_previous_chunk():
+    raw, pk, ts = board(300)
+    keep = np.r_[0:100, 103:300]
+    tracker = GapTracker(FS)
+    r, t, gaps = feed(tracker, raw[keep], pk[keep], ts[keep], [100, 197])
+    assert gaps == [(100, 3, True)]
+    assert np.allclose(r, raw) and np.allclose(t, ts)
+
+
+def test_long_gap_reported_not_filled():
+    raw, pk, ts = board(400)
+    keep = np.r_[0:150, 200:400]  # 50 samples, longer than FILL_MAX_S
+    tracker = GapTracker(FS)
+    r, t, gaps = feed(tracker, raw[keep], pk[keep], ts[keep], [120, 230])
+    assert gaps == [(150, 50, False)]
+    assert (tracker.missing, tracker.filled) == (50, 0)
+    assert np.array_equal(r, raw[keep])
+
+
+def test_two_samples_per_package():
+    # ganglion: two samples share a package number, a lost package is two samples
+    raw, pk, ts = board(400, per_package=2, period=201)
+    keep = np.r_[0:100, 106:400]  # 3 packages
+    tracker = GapTracker(FS, period=201)
+    r, _, gaps = feed(tracker, raw[keep], pk[keep], ts[keep], [80, 314])
+    assert tracker.samples_per_package == 2
+    assert gaps == [(100, 6, True)] and np.allclose(r, raw)
+
+
+def test_timestamps_only():
+    # boards without package numbers: only pauses longer than TS_GAP_S count, jitter doesn't
+    raw, _, ts = board(400)
+    ts = ts + np.where(np.arange(400) >= 200, 0.5, 0.0)  # 0.5 s pause before row 200
+    ts[50] += 0.02
+    tracker = GapTracker(FS)
+    _, _, gaps = tracker.process(raw, None, ts)
+    assert gaps == [(200, 100, False)]
+
+
+def test_renumbering_without_pause_is_not_a_gap():
+    raw, pk, ts = board(300)
+    pk = np.where(np.arange(300) >= 150, (pk + 40) % 256, pk)
+    tracker = GapTracker(FS)
+    _, _, gaps = tracker.process(raw, pk, ts)
+    assert gaps == []
+
+
+def test_reconnect():
+    # after reset() the package numbers start over; the pause in the timestamps is what was lost
+    raw, pk, ts = board(600)
+    tracker = GapTracker(FS)
+    tracker.process(raw[:200], pk[:200], ts[:200])
+    tracker.reset()
+    _, _, gaps = tracker.process(raw[400:], (pk[400:] - pk[400]) % 256, ts[400:])
+    assert gaps == [(0, 200, False)]
+    assert tracker.missing == 200
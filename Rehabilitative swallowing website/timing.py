@@ -0,0 +1,101 @@
+# package numbers and timestamps from the board, so lost samples don't go unnoticed.
+# brainflow numbers every package (synthetic: 0..255 per sample, ganglion: 0..200 with two samples per package)
+# and stamps it with the host time it arrived. a jump in the package number is lost packages (dropped BLE
+# packets, or brainflow's ring buffer overflowing between polls); a pause in the timestamps across a reconnect,
+# or on boards without package numbers, is lost time. short gaps can be filled in (linear, before filtering, so
+# the filters see a continuous signal), longer ones are only reported.
+import numpy as np
+
+FILL_MAX_S = 0.1   # gaps up to this long are filled in, 0 = never fill
+TS_GAP_S = 0.25    # without package numbers, a pause this long in the timestamps counts as a gap
+                   # (the host stamps packages as they arrive, so shorter pauses are just bluetooth jitter)
+
+
+class GapTracker:
+    # one per board, fed every chunk in order. period: how many package numbers there are before they wrap
+    def __init__(self, fs, period=256, fill_max_s=FILL_MAX_S):
+        self.fs = fs
+        self.period = period
+        self.fill_max = int(round(fill_max_s * fs))
+        self.prev_pkg = None   # package number of the last row we saw
+        self.prev_row = None   # last row (board values), to fill from
+        self.prev_t = None     # its timestamp
+        self.rows = 0          # rows / package number steps -> samples per package
+        self.steps = 0
+        self.gaps = 0
+        self.missing = 0       # samples lost, filled ones included
+        self.filled = 0
+
+    def reset(self):
+        # board reconnected: package numbers start over, the timestamps still tell how long we were gone
+        self.prev_pkg = None
+
+    @property
+    def samples_per_package(self):
+        return max(1, round(self.rows / self.steps)) if self.steps else 1
+
+    def _missing(self, packages, stamps):
+        # samples missing just before each row
+        n = len(packages) if packages is not None else len(stamps)
+        miss = np.zeros(n, dtype=np.int64)
+        if stamps is not None:
+            dt = np.diff(stamps, prepend=np.nan if self.prev_t is None else self.prev_t)
+        if packages is not None:
+            pk = packages.astype(np.int64)
+            prev = np.concatenate([[pk[0] if self.prev_pkg is None else self.prev_pkg], pk[:-1]])
+            step = (pk - prev) % self.period
+            self.rows += n
+            self.steps += int(np.count_nonzero(step))
+            miss = np.where(step > 1, (step - 1) * self.samples_per_package, 0)
+            if stamps is not None:
+                # a jump with no matching pause in the timestamps is the board renumbering, not loss
+                miss = np.where(dt * self.fs >= 0.5 * miss, miss, 0)
+        if stamps is not None and (packages is None or self.prev_pkg is None):
+            # no package numbers to go by (first row after a reconnect, or none at all): long pauses
+            pause = dt > TS_GAP_S
+            if packages is not None:
+                pause[1:] = False
+            miss = np.where(pause, np.maximum(0, np.round(np.nan_to_num(dt) * self.fs).astype(np.int64) - 1), miss)
+        return miss
+
+    def process(self, raw, packages=None, stamps=None):
+        # raw: (n, C) board values, packages / stamps: (n,) or None.
+        # returns (raw, stamps, gaps) with short gaps filled in: stamps is (rows,), nan if the board has none,
+        # gaps is [(row of the returned chunk the gap comes before, samples missing, filled?)]
+        n = raw.shape[0]
+        stamps = None if stamps is None else np.asarray(stamps, dtype=np.float64)
+        miss = self._missing(packages, stamps) if packages is not None or stamps is not None else np.zeros(n, int)
+        t = stamps if stamps is not None else np.full(n, np.nan)
+
+        gaps = []
+        parts_raw, parts_t = [], []
+        i0 = 0
+        out_rows = 0
+        for i in np.flatnonzero(miss).tolist():
+            m = int(miss[i])
+            before = raw[i - 1] if i > 0 else self.prev_row
+            fill = m <= self.fill_max and before is not None
+            parts_raw.append(raw[i0:i])
+            parts_t.append(t[i0:i])
+            out_rows += i - i0
+            if fill:
+                frac = np.arange(1, m + 1)[:, None] / (m + 1)
+                parts_raw.append(before + frac * (raw[i] - before))
+                t_before = t[i - 1] if i > 0 else self.prev_t
+                parts_t.append(t_before + frac[:, 0] * (t[i] - t_before) if t_before is not None else np.full(m, np.nan))
+            gaps.append((out_rows, m, fill))
+            out_rows += m if fill else 0
+            i0 = i
+        if gaps:
+            raw = np.concatenate(parts_raw + [raw[i0:]])
+            t = np.concatenate(parts_t + [t[i0:]])
+
+        self.gaps += len(gaps)
+        self.missing += sum(m for _, m, _ in gaps)
+        self.filled += sum(m for _, m, f in gaps if f)
+        if n:
+            self.prev_row = raw[-1].copy()
+            self.prev_t = float(t[-1]) if np.isfinite(t[-1]) else None
+            if packages is not None:
+                self.prev_pkg = int(packages[-1])
+        return raw, t, gaps
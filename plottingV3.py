@@ -1,11 +1,11 @@
 import sys
 import numpy as np
+from scipy import signal
 
 import pyqtgraph as pg
 from pyqtgraph.Qt import QtCore, QtWidgets
 
 from brainflow.board_shim import BoardShim, BrainFlowInputParams, BoardIds
-from brainflow.data_filter import DataFilter, FilterTypes, DetrendOperations, NoiseTypes, AggOperations
 
 
 def main():
@@ -37,60 +37,73 @@ def main():
     env_plot.showGrid(x=True, y=True)
 
     seconds = 5 # display last 5 seconds of data
+    interval_ms = 50 # how often the plot is updated
     n_points = int(seconds * fs) # seconds * sampling rate = num of samples in that window
     x = np.arange(n_points) / fs # convert sample indices to time (seconds) for x-axis
-
-    raw_curves = []
-    raw_buffers = []
-    env_curves = []
-    env_buffers = []
-    for i, _ch in enumerate(emg_channels):
-        raw_buf = np.zeros(n_points, dtype=np.float64) # creates buffer array filled with zeros
-        env_buf = np.zeros(n_points, dtype=np.float64)
-        # for raw EMG signal
-        raw_buffers.append(raw_buf)
-        c_raw = raw_plot.plot(x, raw_buf)  # one curve per channel
-        raw_curves.append(c_raw)
-        # for EMG signal envelope
-        env_buffers.append(env_buf)
-        c_env = env_plot.plot(x, env_buf)  # plot envelope
-        env_curves.append(c_env)
+    n_ch = len(emg_channels)
+
+    # only draw what fits on screen: skip points outside the view, and min/max ("peak") downsample to the
+    # pixel width, so a 60 s window costs about the same to draw as a 5 s one
+    for plot in (raw_plot, env_plot):
+        plot.setClipToView(True)
+        plot.setDownsampling(auto=True, mode="peak")
+
+    # circular buffers, one row per channel. every sample is written twice (at w and w + n_points), so
+    # buf[:, w:w + n_points] is always the last n_points samples in time order, without copying or np.roll
+    raw_buf = np.zeros((n_ch, 2 * n_points))
+    env_buf = np.zeros((n_ch, 2 * n_points))
+    w = 0  # next write index (= oldest sample in the window)
+
+    raw_curves = [raw_plot.plot(x, raw_buf[i, :n_points], skipFiniteCheck=True) for i in range(n_ch)]  # one curve per channel
+    env_curves = [env_plot.plot(x, env_buf[i, :n_points], skipFiniteCheck=True) for i in range(n_ch)]
+
+    # EMG filtering, done incrementally: notch (58-62 Hz, like remove_environmental_noise) + 40-100 Hz
+    # butterworth bandpass as one sos cascade whose state carries over between ticks, so each tick only
+    # filters the samples that arrived since the last one
+    sos = np.vstack([
+        signal.butter(2, [58.0, 62.0], btype="bandstop", fs=fs, output="sos"), # power cord noise (60 Hz in US)
+        signal.butter(4, [40.0, min(100.0, fs / 2 - 1.0)], btype="bandpass", fs=fs, output="sos"),
+    ]) # 40 Hz removes ECG content; 100 Hz is the Nyquist frequency for Ganglion 200 Hz sampling
+    zi = None # filter state, (sections, channels, 2)
+    env_win = 50 # moving average window for the envelope (samples)
+    rect_tail = np.zeros((n_ch, env_win - 1)) # last rectified samples, so the moving average continues across ticks
 
     # update loop
     def update():
-        data = board.get_current_board_data(n_points)  # get latest n_points samples/channel as NumPy array with shape (rows, n_points)
-
-        for i, ch in enumerate(emg_channels):
-            y = np.array(data[ch, :], dtype=np.float64, copy=True)
-
-            y = y[-n_points:]                    # trim if longer
-            if y.size < n_points:
-                y = np.pad(y, (n_points - y.size, 0))  # left-pad zeros
-            raw_buffers[i][:] = y
-
-            # EMG filtering
-            DataFilter.detrend(y, DetrendOperations.CONSTANT.value) # detrend
-            DataFilter.remove_environmental_noise(y, fs, NoiseTypes.SIXTY.value) # notch filter for power cord noise (60 Hz in US)
-            # bandwidth=2 Hz, order=4
-            DataFilter.perform_bandpass(
-                y, fs, 40.0, 100.0, 4, FilterTypes.BUTTERWORTH.value, 0
-            ) # bandpass filter: 40–100 Hz (based on Nyquist frequency of 100 Hz for Ganglion 200 Hz sampling and 40 Hz for ECG content)
-
-            raw_buffers[i][:] = y
-            raw_curves[i].setData(x, raw_buffers[i])
-
-            # Smoothing & rectifying to create envelope
-            y_rect = np.abs(y) # rectify raw signal
-            window_sz = 10 # duration of window for rolling filter in ms
-            DataFilter.perform_rolling_filter(y_rect, period=(50), operation=AggOperations.MEAN.value); # creates a moving average
-            y_env = y_rect # signal envelope
-
-            env_buffers[i][:] = y_env
-            env_curves[i].setData(x, env_buffers[i])
+        nonlocal w, zi, rect_tail
+        data = board.get_board_data()  # only the samples since the last tick (and removes them from brainflow's buffer)
+        if data.shape[1] == 0:
+            return
+        y = np.asarray(data[emg_channels, :], dtype=np.float64) # (channels, new samples)
+
+        if zi is None:
+            # start the filters settled at the first sample's DC offset (this replaces the detrend)
+            zi = signal.sosfilt_zi(sos)[:, None, :] * y[:, 0][None, :, None]
+        y, zi = signal.sosfilt(sos, y, axis=1, zi=zi)
+
+        # Smoothing & rectifying to create envelope: running sum over the tail + new rectified samples
+        rect = np.concatenate([rect_tail, np.abs(y)], axis=1)
+        csum = np.cumsum(rect, axis=1)
+        y_env = csum[:, env_win - 1:].copy()
+        y_env[:, 1:] -= csum[:, :-env_win]
+        y_env /= env_win
+        rect_tail = rect[:, rect.shape[1] - (env_win - 1):]
+
+        # write the new samples into the circular buffers (a big backlog only keeps its last n_points)
+        k = min(y.shape[1], n_points)
+        idx = (w + np.arange(k)) % n_points
+        for buf, new in ((raw_buf, y), (env_buf, y_env)):
+            buf[:, idx] = new[:, -k:]
+            buf[:, idx + n_points] = new[:, -k:]
+        w = (w + k) % n_points
+
+        for i in range(n_ch):
+            raw_curves[i].setData(x, raw_buf[i, w:w + n_points])
+            env_curves[i].setData(x, env_buf[i, w:w + n_points])
 
     timer = QtCore.QTimer()
     timer.timeout.connect(update)
-    timer.start(50)  # update plot every 50 ms (20 updates/second); the lower, the smoother, but higher CPU
+    timer.start(interval_ms)  # update plot every 50 ms (20 updates/second); each update only handles the new samples
 
     win.show()
 